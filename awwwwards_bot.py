@@ -1,111 +1,625 @@
+import argparse
 import json
 import logging
 import os  # Though os might not be strictly necessary, it's good practice to include if dealing with file paths.
+import time
+from contextlib import closing
+from functools import partial
 
-from rss_parser import fetch_rss_feed
-from telegram_messege import send_digest
+from enrichment import EnrichmentCache, enrich_articles
+from feed_scheduler import FeedScheduler
+from link_index import canonical_link
+from metrics import PipelineMetrics
+from rss_parser import FeedCache, fetch_many, fetch_rss_feed, make_parse_pool, parse_feed
+from sharding import shard_path, shard_urls, stray_shard_paths
+from state_store import FileLock, Outbox, Retention, get_backend, write_json_atomic
 
 # Configuration
 RSS_URL = "https://www.awwwards.com/blog/feed/"
-SENT_ARTICLES_FILE = "sent_articles.json"
+# Comma-separated list of feeds to watch; defaults to the Awwwards blog feed
+RSS_URLS = [url.strip() for url in os.getenv("RSS_URLS", RSS_URL).split(",") if url.strip()]
+# Use a .db/.sqlite path to keep the sent articles in SQLite instead of a JSON file
+SENT_ARTICLES_FILE = os.getenv("SENT_ARTICLES_FILE", "sent_articles.json")
+# Several workers can share the feeds: worker WORKER_INDEX (0 to WORKER_COUNT - 1) only
+# polls the feeds that hash to it (see sharding.shard_urls), keeps its own outbox, and
+# claims new articles in the shared SENT_ARTICLES_FILE before sending them
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+# Per-feed HTTP validators and watermarks, shared by the workers (see store_feed_state)
+FEED_STATE_FILE = "feed_state.json"
+# Articles waiting to be delivered, with their attempt counts
+OUTBOX_FILE = shard_path("outbox.json", WORKER_INDEX)
+# Sent links are forgotten once they are older than RETENTION_DAYS, or beyond the
+# RETENTION_MAX_ENTRIES most recent ones; 0 disables either limit
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "180"))
+RETENTION_MAX_ENTRIES = int(os.getenv("RETENTION_MAX_ENTRIES", "0"))
+# Worker processes that parse the downloaded feeds; 0 parses them in the fetching threads.
+# Worth it for many or large feeds, where feedparser keeps a single core busy.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+# Feed parser backend: "feedparser" handles every format, "streaming" only reads the
+# fields the bot uses from RSS 2.0 and Atom and falls back to feedparser for anything else
+FEED_PARSER = os.getenv("FEED_PARSER", "feedparser")
+# Fetch each new article's page before sending, for its preview image (og:image) and an
+# estimated reading time. Pages are fetched once: results are kept in ENRICHMENT_CACHE_FILE.
+ENRICH_ARTICLES = os.getenv("ENRICH_ARTICLES", "").lower() in ("1", "true", "yes")
+ENRICHMENT_CACHE_FILE = shard_path("enrichment_cache.json", WORKER_INDEX)
+# Push mode for the daemon: with WEBSUB_CALLBACK_URL set to a public URL that reaches port
+# WEBSUB_PORT, feeds advertising a WebSub hub are subscribed to and their updates are sent
+# as soon as the hub pushes them. Those feeds are still polled, rarely, as a fallback.
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL", "")
+WEBSUB_PORT = int(os.getenv("WEBSUB_PORT", "8080"))
+WEBSUB_STATE_FILE = shard_path("websub.json", WORKER_INDEX)
+# Where to write per-run stage timings and counters: a .prom file for node_exporter's
+# textfile collector, JSON for anything else; empty to only log them
+METRICS_FILE = os.getenv("METRICS_FILE", "")
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Telegram delivery. telegram_messege pulls in python-telegram-bot and dotenv and reads the
+# credentials, which costs far more than the rest of a run that finds nothing new, so it is
+# only imported once there is something to send.
+def send_digest(articles, **kwargs):
+    """
+    Sends a digest through telegram_messege.send_digest, importing it on first use.
+    """
+    from telegram_messege import send_digest as telegram_send_digest
+    return telegram_send_digest(articles, **kwargs)
+
 # State Management Functions
 def load_sent_articles(filepath: str) -> set:
     """
-    Loads the set of sent article links from a JSON file.
+    Loads the set of sent article links using the backend matching the file extension
+    (see state_store.get_backend).
+
+    Args:
+        filepath: The path to the JSON file or SQLite database.
+
+    Returns:
+        A set-like collection of article links; empty if the state doesn't exist or is invalid.
+    """
+    return get_backend(filepath).load()
+
+def save_sent_articles(filepath: str, article_links: set):
+    """
+    Saves the article links using the backend matching the file extension, evicting
+    the links that fall outside RETENTION_DAYS / RETENTION_MAX_ENTRIES.
+
+    Args:
+        filepath: The path to the JSON file or SQLite database.
+        article_links: The collection returned by load_sent_articles, with new links added.
+    """
+    retention = Retention(max_age_days=RETENTION_DAYS, max_entries=RETENTION_MAX_ENTRIES)
+    get_backend(filepath, retention=retention).save(article_links)
+
+def load_feed_state(filepath: str) -> dict:
+    """
+    Loads the per-feed state (HTTP validators) from a JSON file.
 
     Args:
         filepath: The path to the JSON file.
 
     Returns:
-        A set of article links if the file exists and is valid, otherwise an empty set.
+        A dict keyed by feed URL if the file exists and is valid, otherwise an empty dict.
+    """
+    try:
+        return read_feed_state(filepath)
+    except json.JSONDecodeError:
+        logging.warning(f"Error decoding JSON from '{filepath}'. Starting with empty feed state.")
+        return {}
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while loading feed state from '{filepath}': {e}")
+        return {}
+
+def read_feed_state(filepath: str) -> dict:
+    """
+    Reads the per-feed state like load_feed_state, but only a missing file gives an empty
+    dict: other errors are raised, so a merge never replaces the file with partial state.
     """
     try:
         with open(filepath, 'r') as f:
             data = json.load(f)
-            return set(data)
+            return data if isinstance(data, dict) else {}
     except FileNotFoundError:
-        logging.warning(f"Sent articles file '{filepath}' not found. Starting with an empty set.")
-        return set()
-    except json.JSONDecodeError:
-        logging.warning(f"Error decoding JSON from '{filepath}'. Starting with an empty set.")
-        return set()
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while loading sent articles from '{filepath}': {e}")
-        return set()
+        return {}
 
-def save_sent_articles(filepath: str, article_links: set):
+def save_feed_state(filepath: str, feed_state: dict, urls=None):
     """
-    Saves the set of article links to a JSON file.
+    Saves the per-feed state to a JSON file.
 
     Args:
         filepath: The path to the JSON file.
-        article_links: A set of article links to save.
+        feed_state: A dict keyed by feed URL.
+        urls: Only write these feeds' entries, merged into the file under a FileLock, for
+            a file shared by several workers; None replaces the whole file.
     """
     try:
-        with open(filepath, 'w') as f:
-            json.dump(list(article_links), f, indent=4)  # Convert set to list for JSON serialization
-        logging.info(f"Sent articles saved to '{filepath}'.")
+        if urls is None:
+            write_json_atomic(filepath, feed_state)
+        else:
+            with FileLock(filepath):
+                stored = read_feed_state(filepath)
+                stored.update((url, feed_state[url]) for url in urls if url in feed_state)
+                write_json_atomic(filepath, stored)
+        logging.info(f"Feed state saved to '{filepath}'.")
     except IOError:
-        logging.error(f"Could not write sent articles to file '{filepath}'.")
+        logging.error(f"Could not write feed state to file '{filepath}'.")
     except Exception as e:
-        logging.error(f"An unexpected error occurred while saving sent articles to '{filepath}': {e}")
+        logging.error(f"An unexpected error occurred while saving feed state to '{filepath}': {e}")
 
-# Main Logic
-def main():
+def store_feed_state(feed_state: dict):
     """
-    Main function for the Awwwards RSS Bot.
-    Fetches new articles, filters out already sent ones, and sends a digest.
+    Saves the per-feed state to FEED_STATE_FILE. With several workers the file is shared
+    and keyed by feed URL, so it doesn't depend on WORKER_COUNT: each worker only writes
+    the entries of the feeds it owns, and a feed that moves to another worker after a
+    resize keeps its validators and watermark.
     """
-    logging.info("Starting Awwwards RSS Bot...")
+    urls = shard_urls(feed_state, WORKER_INDEX, WORKER_COUNT) if WORKER_COUNT > 1 else None
+    save_feed_state(FEED_STATE_FILE, feed_state, urls)
+
+def adopt_stray_state():
+    """
+    Takes over the files left by workers that a change of WORKER_COUNT removed, and the
+    per-worker files of earlier versions, named after the count (outbox.1-of-3.json):
+    their outboxes, whose articles are already claimed in the shared state and would
+    otherwise never be sent, and their feed state, so those feeds keep their watermarks.
+    Run by worker 0 when it loads the state; files it can't take over are left in place
+    for the next start.
+    """
+    try:
+        outbox_paths = stray_shard_paths(OUTBOX_FILE, WORKER_COUNT)
+        if outbox_paths:
+            outbox = Outbox.load(OUTBOX_FILE)
+            for path in outbox_paths:
+                adopted = outbox.adopt(Outbox.load(path))
+                logging.info(f"Took over {adopted} outstanding articles from '{path}'.")
+            write_json_atomic(OUTBOX_FILE, outbox.entries)
+            for path in outbox_paths:
+                os.remove(path)
+
+        feed_state_paths = stray_shard_paths(FEED_STATE_FILE, 1)
+        if feed_state_paths:
+            with FileLock(FEED_STATE_FILE):
+                stored = read_feed_state(FEED_STATE_FILE)
+                for path in feed_state_paths:
+                    for url, entry in read_feed_state(path).items():
+                        stored.setdefault(url, entry)
+                write_json_atomic(FEED_STATE_FILE, stored)
+            for path in feed_state_paths:
+                os.remove(path)
+            logging.info(f"Merged the feed state of {len(feed_state_paths)} former workers into '{FEED_STATE_FILE}'.")
+    except Exception as e:
+        logging.error(f"Could not take over the state of former workers: {e}")
+
+def store_sent_articles(outbox: Outbox, sent_article_links):
+    """
+    Moves the articles the outbox has delivered (or given up on) into the sent-articles
+    state, then saves the outbox. Links are saved as sent before they leave the outbox,
+    so a crash in between can't lead to a duplicate message.
+    """
+    delivered = outbox.sent_links() + outbox.abandoned
+    if not delivered:
+        return
+    for link in delivered:
+        sent_article_links.add(link)
+    if WORKER_COUNT > 1:
+        # Other workers have written the shared state since it was loaded: merge into it
+        # instead of overwriting it. The links were claimed before sending, so this only
+        # adds back those evicted since.
+        try:
+            claim_links(delivered, sent_article_links)
+        except Exception as e:
+            # They stay in the outbox, as sent, and are stored by a later call
+            logging.error(f"Could not store {len(delivered)} sent articles in the shared state: {e}")
+            return
+    else:
+        save_sent_articles(SENT_ARTICLES_FILE, sent_article_links)
+    outbox.pop_sent()
+    outbox.abandoned = []
+    outbox.save()
+
+def claim_links(links, sent_article_links) -> set:
+    """
+    Claims links for this worker in the shared sent-articles state, atomically with
+    respect to the other workers (see the backends' `claim`), so that an article found by
+    several workers is only queued and sent by one of them. The claimed links are also
+    added to `sent_article_links`.
+
+    Returns:
+        The links this worker claimed.
+    """
+    retention = Retention(max_age_days=RETENTION_DAYS, max_entries=RETENTION_MAX_ENTRIES)
+    claimed = set(get_backend(SENT_ARTICLES_FILE, retention=retention).claim(links))
+    for link in claimed:
+        sent_article_links.add(link)
+    return claimed
+
+class BotState:
+    """
+    Everything the pipeline keeps between runs: the sent links, the per-feed state, the
+    outbox and, with ENRICH_ARTICLES, the enrichment cache. main() loads it for a single
+    run, the daemon keeps it in memory.
+    """
+
+    def __init__(self, sent_article_links, feed_cache: FeedCache, outbox: Outbox,
+                 enrichment_cache: EnrichmentCache = None):
+        self.sent_article_links = sent_article_links
+        self.feed_cache = feed_cache
+        self.outbox = outbox
+        self.enrichment_cache = enrichment_cache
+
+def load_state() -> BotState:
+    if WORKER_INDEX == 0:
+        adopt_stray_state()
 
     # Load previously sent articles
     sent_article_links = load_sent_articles(SENT_ARTICLES_FILE)
     logging.info(f"Loaded {len(sent_article_links)} sent articles.")
 
-    # Fetch new articles from RSS feed
-    logging.info(f"Fetching articles from RSS feed: {RSS_URL}")
-    fetched_articles = fetch_rss_feed(RSS_URL)
+    # Per-feed validators and watermarks: unchanged feeds answer 304 and are never parsed,
+    # changed feeds are only read down to the newest entry processed by the last run
+    feed_cache = FeedCache(load_feed_state(FEED_STATE_FILE))
 
-    if not fetched_articles:
-        logging.info("No articles fetched from the RSS feed. Exiting.")
-        return
+    # Articles queued by earlier runs that still have to be delivered
+    outbox = Outbox.load(OUTBOX_FILE)
+    if len(outbox):
+        logging.info(f"Loaded {len(outbox)} outstanding articles from the outbox.")
+
+    # Preview images and reading times of the articles already enriched
+    enrichment_cache = EnrichmentCache.load(ENRICHMENT_CACHE_FILE) if ENRICH_ARTICLES else None
 
-    # Filter out already sent articles
-    new_articles_to_send = []
-    for article in fetched_articles:
+    return BotState(sent_article_links, feed_cache, outbox, enrichment_cache)
+
+def filter_new_articles(articles, sent_article_links, outbox, seen_links: set) -> list:
+    """
+    Returns the articles that haven't been sent, aren't queued in the outbox and weren't
+    already picked up during this run. Links are compared in canonical form (see
+    link_index.canonical_link), and those of the returned articles are added to `seen_links`.
+    """
+    new_articles = []
+    for article in articles:
         # Assuming each article dictionary has a 'link' key
-        if 'link' in article and article['link'] not in sent_article_links:
-            new_articles_to_send.append(article)
+        if 'link' not in article:
+            continue
+        canonical = canonical_link(article['link'])
+        if canonical not in seen_links and article['link'] not in sent_article_links \
+                and article['link'] not in outbox:
+            seen_links.add(canonical)
+            new_articles.append(article)
+    return new_articles
 
-    # Send notifications for new articles
-    if new_articles_to_send:
-        logging.info(f"Found {len(new_articles_to_send)} new articles to send.")
-        try:
-            # Assuming send_digest returns True on success, False otherwise
-            # or raises an exception on failure, which should be handled by telegram_messege.py
-            send_digest(new_articles_to_send) # send_digest should handle its own success/failure logging
-            logging.info("Digest sent successfully.")
-            
-            # Update the set of sent articles with the new ones
-            for article in new_articles_to_send:
-                sent_article_links.add(article['link'])
-            save_sent_articles(SENT_ARTICLES_FILE, sent_article_links)
+def parse_pushed(feed_cache: FeedCache, pushed) -> list:
+    """
+    Parses feed content pushed by WebSub hubs, down to each feed's watermark, and
+    advances the watermarks.
+
+    Args:
+        pushed: (feed URL, body, headers) tuples, see websub.WebSubSubscriber.drain.
 
+    Returns:
+        (feed URL, articles) tuples.
+    """
+    results = []
+    for url, body, headers in pushed:
+        try:
+            result = parse_feed(body, headers, feed_cache.watermark(url), parser=FEED_PARSER)
         except Exception as e:
-            # This is a general catch-all. Ideally, send_digest would raise specific exceptions.
-            logging.error(f"Failed to send digest or save sent articles: {e}")
-            # Depending on the error, you might choose not to save sent_articles_links
-            # if the digest failed to send. For now, we attempt to save anyway if some articles were processed.
+            logging.error(f"Error parsing content pushed for RSS feed '{url}': {e}")
+            continue
+        if result["newest"] is not None:
+            feed_cache.record_watermark(url, result["newest"])
+        results.append((url, result["articles"]))
+    return results
 
-    else:
+def fetch_new_articles(state: BotState, urls, metrics: PipelineMetrics, parse_pool=None, pushed=None):
+    """
+    Fetches the given feeds and returns their articles that are new (see
+    filter_new_articles), along with those of the pushed content. Each feed's articles
+    are filtered as soon as it arrives.
+
+    The fetch stage is the wall time of downloading and parsing the feeds. The parse
+    stage is the time spent in parse_feed, summed over the feeds and the pushed content;
+    feeds downloaded concurrently are also parsed concurrently, so it can exceed fetch.
+
+    Returns:
+        (fetched_per_feed, new_articles), fetched_per_feed as returned by run_cycle.
+    """
+    sent_article_links, feed_cache, outbox = state.sent_article_links, state.feed_cache, state.outbox
+    cache_before = (feed_cache.hits, feed_cache.bytes_received, feed_cache.entries_parsed, feed_cache.parse_seconds)
+    if urls:
+        logging.info(f"Fetching articles from {len(urls)} RSS feed(s).")
+    fetched_per_feed = {}
+    new_articles = []
+    seen_links = set()  # Links already picked up from another feed during this run
+    pushed_articles = []
+    if pushed:
+        with metrics.stage("parse"):
+            pushed_articles = parse_pushed(feed_cache, pushed)
+    for url, articles in pushed_articles:
+        logging.info(f"Received {len(articles)} pushed articles for RSS feed: {url}")
+        metrics.add("articles_pushed", len(articles))
+        with metrics.stage("dedup"):
+            new_articles.extend(filter_new_articles(articles, sent_article_links, outbox, seen_links))
+    fetch = partial(fetch_rss_feed, cache=feed_cache)
+    if parse_pool is not None:
+        fetch = partial(fetch, parse_pool=parse_pool)
+    if FEED_PARSER != "feedparser":
+        fetch = partial(fetch, parser=FEED_PARSER)
+    # Closing the generator waits for the fetches in flight, should filtering fail
+    with closing(fetch_many(urls, fetch=fetch)) as results:
+        for url, articles in metrics.timed("fetch", results):
+            logging.info(f"Fetched {len(articles)} articles from RSS feed: {url}")
+            fetched_per_feed[url] = len(articles)
+            with metrics.stage("dedup"):
+                new_articles.extend(filter_new_articles(articles, sent_article_links, outbox, seen_links))
+
+    metrics.add("feeds_fetched", len(urls))
+    metrics.add("feeds_not_modified", feed_cache.hits - cache_before[0])
+    metrics.add("bytes_received", feed_cache.bytes_received - cache_before[1])
+    metrics.add("entries_parsed", feed_cache.entries_parsed - cache_before[2])
+    metrics.add("new_articles", len(new_articles))
+    if feed_cache.parse_seconds > cache_before[3]:
+        metrics.add_time("parse", feed_cache.parse_seconds - cache_before[3])
+    if urls:
+        logging.info(f"Feed cache: {feed_cache.hits} not modified, {feed_cache.misses} downloaded.")
+        if not sum(fetched_per_feed.values()):
+            logging.info("No articles fetched from the RSS feeds.")
+    return fetched_per_feed, new_articles
+
+def run_cycle(state: BotState, urls, send, metrics: PipelineMetrics = None, parse_pool=None, pushed=None) -> dict:
+    """
+    Fetches the given feeds, queues their new articles and sends whatever is due.
+
+    Args:
+        state: The state to read and update; it is saved as part of the cycle.
+        urls: The feeds to fetch.
+        send: Callable with send_digest's signature, called as
+            send(articles, on_result=..., latencies=..., delivered=...).
+        metrics: Receives the stage timings and counters of the cycle.
+        parse_pool: Optional process pool to parse the downloaded feeds in (see
+            rss_parser.make_parse_pool).
+        pushed: Optional content received by push, as (feed URL, body, headers) tuples
+            (see websub.WebSubSubscriber.drain); its articles are read down to the feed's
+            watermark, then deduplicated, queued and sent like the fetched ones.
+
+    Returns:
+        A dict mapping each fetched feed URL to the number of articles it returned.
+    """
+    sent_article_links, feed_cache, outbox = state.sent_article_links, state.feed_cache, state.outbox
+    metrics = metrics if metrics is not None else PipelineMetrics()
+
+    # Fetching moves the feeds' validators and watermarks past their new articles before
+    # those are queued. If the cycle fails in between, the state is put back so that the
+    # next fetch downloads and reads the feeds again instead of getting a 304.
+    snapshot = feed_cache.snapshot()
+    try:
+        fetched_per_feed, new_articles_to_send = fetch_new_articles(state, urls, metrics, parse_pool, pushed)
+
+        # With several workers, an article is only queued by the worker that claims it first.
+        # Claiming comes before queueing: a crash in between loses the article, rather than
+        # letting two workers send it.
+        # If the shared state stays locked or can't be read, the articles are left to the
+        # next fetch of their feeds and the cycle goes on with the outbox.
+        if WORKER_COUNT > 1 and new_articles_to_send:
+            try:
+                with metrics.stage("claim"):
+                    claimed = claim_links([article['link'] for article in new_articles_to_send], sent_article_links)
+            except Exception as e:
+                logging.error(f"Could not claim {len(new_articles_to_send)} new articles, "
+                              f"their feeds will be read again on the next fetch: {e}")
+                metrics.add("claim_failures", 1)
+                feed_cache.restore(snapshot)
+                new_articles_to_send = []
+            else:
+                metrics.add("articles_claimed_elsewhere", len(new_articles_to_send) - len(claimed))
+                new_articles_to_send = [article for article in new_articles_to_send if article['link'] in claimed]
+
+        # Enrich the new articles before they are queued, so retries of the outbox reuse the
+        # result. Every page is fetched once, the cache covers those seen by earlier runs.
+        if state.enrichment_cache is not None and new_articles_to_send:
+            with metrics.stage("enrich"):
+                enriched = enrich_articles(new_articles_to_send, state.enrichment_cache)
+                state.enrichment_cache.save()
+            metrics.add("articles_enriched", enriched["fetched"])
+            metrics.add("enrichment_cache_hits", enriched["cached"])
+            metrics.add("enrichment_failures", enriched["failed"])
+
+        # Queue new articles durably before sending anything. From here on they survive a
+        # crash, so the feed validators and watermarks that led to them can be saved too.
+        if new_articles_to_send:
+            with metrics.stage("save"):
+                logging.info(f"Found {len(new_articles_to_send)} new articles to send.")
+                outbox.enqueue(new_articles_to_send)
+                outbox.save()
+    except BaseException:
+        feed_cache.restore(snapshot)
+        raise
+    if feed_cache.dirty:
+        with metrics.stage("save"):
+            store_feed_state(feed_cache.state)
+            feed_cache.dirty = False
+
+    articles_due = outbox.due()
+    if not articles_due:
         logging.info("No new articles found to send.")
+        with metrics.stage("save"):
+            store_sent_articles(outbox, sent_article_links)
+        return fetched_per_feed
+
+    # Send notifications, recording every message's outcome as soon as it is known. With
+    # several chats an article is done once every chat that wants it has it; the chats it
+    # reached are saved right away so that a retry doesn't send it to them again.
+    reported_links = set()
+    failed_links = set()
 
+    def on_result(articles, ok, chat_id=None):
+        reported_links.update(article['link'] for article in articles)
+        if not ok:
+            failed_links.update(article['link'] for article in articles)
+        elif chat_id is None:
+            outbox.mark_sent(articles)
+        else:
+            outbox.mark_delivered(articles, chat_id)
+        outbox.save()
+
+    logging.info(f"Sending {len(articles_due)} articles.")
+    latencies = []
+    ok = False
+    with metrics.stage("send"):
+        try:
+            # send returns True only if every article was delivered
+            ok = send(articles_due, on_result=on_result, latencies=latencies, delivered=outbox.delivered())
+            if ok:
+                logging.info("Digest sent successfully.")
+            else:
+                logging.error("Failed to send some articles; they stay in the outbox for a retry.")
+        except Exception as e:
+            logging.error(f"Failed to send digest: {e}")
+    metrics.observe("telegram_request_seconds", latencies)
+
+    # Articles whose outcome was never reported take the overall result; if send failed
+    # early they count as failed
+    sent, failed = [], []
+    for article in articles_due:
+        if article['link'] in failed_links or (article['link'] not in reported_links and not ok):
+            failed.append(article)
+        else:
+            sent.append(article)
+    outbox.mark_sent(sent)
+    outbox.mark_failed(failed)
+    metrics.add("articles_sent", len(sent))
+    metrics.add("articles_failed", len(failed))
+    with metrics.stage("save"):
+        outbox.save()
+        store_sent_articles(outbox, sent_article_links)
+    return fetched_per_feed
+
+def report_metrics(metrics: PipelineMetrics, metrics_file: str = None):
+    """
+    Logs the metrics of a run and writes them to `metrics_file` (if set).
+    """
+    metrics.log_summary()
+    if metrics_file:
+        metrics.write(metrics_file)
+
+# Main Logic
+def main(metrics_file: str = None, metrics: PipelineMetrics = None):
+    """
+    Main function for the Awwwards RSS Bot.
+    Fetches new articles, filters out already sent ones, and sends a digest.
+
+    Args:
+        metrics_file: Where to write the run's metrics; defaults to METRICS_FILE.
+        metrics: Receives the run's metrics, e.g. for a load test; a new one by default.
+    """
+    logging.info("Starting Awwwards RSS Bot...")
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    with metrics.stage("state_load"):
+        state = load_state()
+    parse_pool = make_parse_pool(PARSE_WORKERS)
+    try:
+        urls = shard_urls(RSS_URLS, WORKER_INDEX, WORKER_COUNT)
+        run_cycle(state, urls, send=send_digest, metrics=metrics, parse_pool=parse_pool)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+    report_metrics(metrics, metrics_file or METRICS_FILE)
     logging.info("Awwwards RSS Bot finished.")
 
+def run_daemon(max_sleep: float = 60.0, metrics_file: str = None):
+    """
+    Runs the bot as a resident process.
+
+    The state stays in memory and one Telegram Bot (with its connection pool) is reused
+    for every digest. Each feed is polled on its own adaptive schedule (see FeedScheduler),
+    and queued retries in the outbox are picked up at least every `max_sleep` seconds.
+    The metrics file (METRICS_FILE unless `metrics_file` is given) describes the last cycle.
+
+    With WEBSUB_CALLBACK_URL, feeds with a WebSub hub are subscribed to (see
+    websub.WebSubSubscriber). A push wakes the loop up and its articles are sent within
+    the same cycle; subscribed feeds are polled at most every PUSH_FALLBACK_POLL_INTERVAL,
+    in case the hub misses an update or the subscription lapses.
+    """
+    import asyncio
+    import telegram_messege
+
+    logging.info("Starting Awwwards RSS Bot in daemon mode...")
+    state = load_state()
+    urls_to_watch = shard_urls(RSS_URLS, WORKER_INDEX, WORKER_COUNT)
+    scheduler = FeedScheduler(urls_to_watch, state.feed_cache.state)
+    subscriber = None
+    if WEBSUB_CALLBACK_URL:
+        import websub
+
+        subscriber = websub.WebSubSubscriber.load(WEBSUB_STATE_FILE, callback_url=WEBSUB_CALLBACK_URL,
+                                                  port=WEBSUB_PORT)
+        subscriber.start()
+    loop = asyncio.new_event_loop()
+    engine = None
+    parse_pool = make_parse_pool(PARSE_WORKERS)
+
+    def send(articles, **kwargs):
+        nonlocal engine
+        if engine is None:
+            engine = telegram_messege.DeliveryEngine(telegram_messege.BOT_TOKEN)
+            loop.run_until_complete(engine.start())
+        return loop.run_until_complete(telegram_messege.send_digest_async(articles, engine=engine, **kwargs))
+
+    retry_pushed = []  # Pushed content of a failed cycle, read again by the next one
+    try:
+        while True:
+            urls = scheduler.due()
+            pushed = retry_pushed + (subscriber.drain() if subscriber is not None else [])
+            retry_pushed = []
+            if urls or pushed or state.outbox.due():
+                metrics = PipelineMetrics()
+                try:
+                    fetched_per_feed = run_cycle(state, urls, send=send, metrics=metrics, parse_pool=parse_pool,
+                                                 pushed=pushed)
+                except Exception as e:
+                    # run_cycle has put back the feed state of articles it didn't queue
+                    logging.error(f"Cycle failed, will try again on the next poll: {e}")
+                    fetched_per_feed = None
+                    retry_pushed = pushed
+                report_metrics(metrics, metrics_file or METRICS_FILE)
+                for url in urls:
+                    pushed_feed = subscriber is not None and subscriber.is_active(url)
+                    next_poll = scheduler.record(url, (fetched_per_feed or {}).get(url, 0), min_interval=(
+                        websub.PUSH_FALLBACK_POLL_INTERVAL if pushed_feed else 0))
+                    logging.info(f"Next poll of {url} in {next_poll - time.time():.0f}s.")
+                if (urls or pushed) and fetched_per_feed is not None:
+                    store_feed_state(state.feed_cache.state)
+            if subscriber is not None:
+                subscriber.maintain(urls_to_watch, state.feed_cache)
+                subscriber.save(WEBSUB_STATE_FILE)
+            next_poll_at = scheduler.next_poll_at()
+            delay = max_sleep if next_poll_at is None else min(max_sleep, next_poll_at - time.time())
+            if subscriber is not None:
+                subscriber.wait(delay)  # Returns as soon as a hub pushes something
+            else:
+                time.sleep(max(delay, 0))
+    except KeyboardInterrupt:
+        logging.info("Awwwards RSS Bot stopped.")
+    finally:
+        if subscriber is not None:
+            subscriber.stop()
+            subscriber.save(WEBSUB_STATE_FILE)
+        if engine is not None:
+            loop.run_until_complete(engine.close())
+        loop.close()
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
 # Entry point for the script
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Awwwards RSS to Telegram bot")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and poll each feed on its own adaptive schedule")
+    parser.add_argument("--metrics-file", default=None,
+                        help="write stage timings and counters to this file (.prom for Prometheus, "
+                             "otherwise JSON); overrides METRICS_FILE")
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon(metrics_file=args.metrics_file)
+    else:
+        main(metrics_file=args.metrics_file)
@@ -0,0 +1,208 @@
+"""
+Local stand-ins for the services the bot talks to, for load tests: a Telegram Bot API
+server that can inject latency, 429 rate limits and 5xx errors, and a feed server
+serving synthetic feeds that grow on demand, or recorded feeds from a directory.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from synthetic import article_link, make_feed_xml
+
+
+class _Server:
+    """
+    Runs a ThreadingHTTPServer in a background thread; `start` returns its base URL.
+    """
+
+    handler = None
+
+    def start(self) -> str:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class _BotAPIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        _, _, method = self.path.rpartition("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode("utf-8")))
+        status, response = fake.handle(method, params)
+        payload = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotAPI(_Server):
+    """
+    Answers the Bot API methods the bot uses (getMe, sendMessage) for any token.
+
+    Every request first waits `latency` plus up to `jitter` seconds. A `rate_limit_rate`
+    fraction of the sendMessage calls then get a 429 asking to retry after `retry_after`
+    seconds, and an `error_rate` fraction a 500; neither of those delivers the message.
+    Delivered messages are recorded in `deliveries` as (chat_id, text, time) tuples.
+    """
+
+    handler = _BotAPIHandler
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: int = 1, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.deliveries = []
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> str:
+        """
+        Returns the base URL to configure as TELEGRAM_API_URL.
+        """
+        return super().start() + "/bot"
+
+    def handle(self, method: str, params: dict) -> tuple:
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            roll = self.random.random()
+        time.sleep(delay)
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Load test",
+                                                "username": "load_test_bot"}}
+        if method != "sendMessage":
+            return 200, {"ok": True, "result": True}
+
+        with self._lock:
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            now = time.time()
+            self.deliveries.append((str(params.get("chat_id")), params.get("text", ""), now))
+            message_id = len(self.deliveries)
+        chat_id = params.get("chat_id")
+        chat = {"id": int(chat_id), "type": "private"} if str(chat_id).lstrip("-").isdigit() \
+            else {"id": -1, "type": "channel", "username": str(chat_id).lstrip("@")}
+        return 200, {"ok": True, "result": {"message_id": message_id, "date": int(now), "chat": chat,
+                                            "text": params.get("text", "")}}
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        feed = self.server.fake.feeds.get(self.path)
+        if feed is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag, body = feed
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeFeedServer(_Server):
+    """
+    Serves `count` synthetic RSS feeds with ETags. Each feed starts empty, `publish` adds
+    new items to all of them, and a feed answers 304 until it changes. Feed i numbers its
+    items from (i + 1) * 10_000_000, so links never collide across feeds.
+
+    With `feed_dir`, the .xml files in it are served as they are instead (recorded feeds);
+    they never change.
+    """
+
+    handler = _FeedHandler
+    FEED_NUMBER_BASE = 10_000_000
+
+    def __init__(self, count: int = 1, feed_dir: str = None, window: int = 50):
+        self.feeds = {}  # path -> (etag, body)
+        self.window = window  # Items kept in each synthetic feed
+        self.first = {}   # path -> number before the first item of a synthetic feed
+        self.newest = {}  # path -> number of the newest item of a synthetic feed
+        self.epoch = time.time()
+        if feed_dir:
+            for name in sorted(os.listdir(feed_dir)):
+                if name.endswith(".xml"):
+                    with open(os.path.join(feed_dir, name), "rb") as f:
+                        body = f.read()
+                    self.feeds[f"/{name}"] = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+        else:
+            for i in range(count):
+                self.first[f"/feed{i}.xml"] = self.newest[f"/feed{i}.xml"] = (i + 1) * self.FEED_NUMBER_BASE
+                self.feeds[f"/feed{i}.xml"] = ('"empty"', make_feed_xml(0, newest=0))
+
+    def start(self) -> str:
+        self.base_url = super().start()
+        return self.base_url
+
+    @property
+    def urls(self) -> list:
+        return [self.base_url + path for path in self.feeds]
+
+    def publish(self, count: int) -> list:
+        """
+        Adds `count` items to every synthetic feed.
+
+        Returns:
+            The links of the new items, newest first within each feed.
+        """
+        links = []
+        for path, newest in self.newest.items():
+            newest += count
+            self.newest[path] = newest
+            published = newest - self.first[path]
+            entries = min(max(self.window, count), published)
+            # Item k is always published k minutes after the epoch, so the watermark's
+            # publication time stays comparable from one round to the next
+            body = make_feed_xml(entries, newest=newest, now=self.epoch + published * 60)
+            self.feeds[path] = (f'"{newest}"', body)
+            links += [article_link(n) for n in range(newest, newest - count, -1)]
+        return links
@@ -0,0 +1,222 @@
+"""
+End-to-end load test: runs the bot's whole `main` pipeline against a local fake Telegram
+Bot API and a local feed server (see fakes.py), never the real services.
+
+Every round publishes new items to each feed and runs `main` once, as cron would; the
+state lives in a temporary directory. The fake Bot API injects latency, 429s with
+retry_after and 5xx errors as configured. Afterwards every (chat, article) pair is
+checked: delivered once, delivered more than once (duplicate), still queued in the
+outbox for a retry, or lost. The report (JSON) has messages per second during the send
+stage, p50/p99 latency of the Bot API calls and of the delivery of each article after
+it was published. The exit status is 1 when any article was duplicated or lost.
+
+With --workers N, every round runs N bot processes at once, each polling its shard of
+the feeds and claiming articles in the shared state, as several cron jobs or hosts would.
+
+    python benchmarks/loadtest.py --rounds 5 --feeds 4 --articles 10 --chats 20
+    python benchmarks/loadtest.py --latency 0.2 --rate-limit-rate 0.05 --error-rate 0.05
+    python benchmarks/loadtest.py --workers 4 --feeds 16 --state sqlite
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_ROOT, "awwwwards_bot.py")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeBotAPI, FakeFeedServer  # noqa: E402
+
+LINK_PATTERN = re.compile(r"https?://\S+")
+FIRST_CHAT_ID = 100_001  # Private chats, so each one is limited to a message per second
+
+
+def quantiles(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p99": None}
+    return {"p50": values[int(0.5 * len(values))], "p99": values[min(len(values) - 1, int(0.99 * len(values)))]}
+
+
+def recorded_links(feed_server) -> list:
+    """
+    Returns the links a first run takes from each recorded feed (its newest entries).
+    """
+    from rss_parser import parse_feed
+
+    return [article["link"] for _, body in feed_server.feeds.values()
+            for article in parse_feed(body)["articles"]]
+
+
+def run_workers(count: int, workdir: str, verbose: bool = False) -> list:
+    """
+    Runs `count` bot processes at once, as shards WORKER_INDEX 0 to count - 1 of the feeds,
+    and returns the metrics each of them wrote.
+    """
+    output = None if verbose else subprocess.DEVNULL
+    processes = []
+    for index in range(count):
+        env = dict(os.environ, WORKER_INDEX=str(index), WORKER_COUNT=str(count), PYTHONPATH=REPO_ROOT)
+        metrics_file = os.path.join(workdir, f"metrics-{index}.json")
+        process = subprocess.Popen([sys.executable, BOT_SCRIPT, "--metrics-file", metrics_file],
+                                   cwd=workdir, env=env, stdout=output, stderr=output)
+        processes.append((process, metrics_file))
+    results = []
+    for process, metrics_file in processes:
+        if process.wait() != 0:
+            raise RuntimeError(f"Worker exited with status {process.returncode}")
+        with open(metrics_file) as f:
+            results.append(json.load(f))
+    return results
+
+
+def run(args, workdir) -> dict:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit_rate,
+                     retry_after=args.retry_after, error_rate=args.error_rate, seed=args.seed)
+    feeds = FakeFeedServer(count=args.feeds, feed_dir=args.feed_dir)
+    api_url = api.start()
+    feeds.start()
+    chats = [str(FIRST_CHAT_ID + i) for i in range(args.chats)]
+    state_file = "sent_articles.db" if args.state == "sqlite" else "sent_articles.json"
+    os.environ.update({"RSS_URLS": ",".join(feeds.urls), "SENT_ARTICLES_FILE": state_file,
+                       "BOT_TOKEN": "123456:load-test", "CHAT_ID": ",".join(chats), "TARGETS_FILE": "",
+                       "TELEGRAM_API_URL": api_url, "DIGEST_MODE": args.mode, "FEED_PARSER": args.parser,
+                       "METRICS_FILE": ""})
+    os.chdir(workdir)  # The feed state and outbox live in the working directory
+
+    # Imported once the environment is configured, as both read it on import
+    import awwwwards_bot
+    from metrics import PipelineMetrics
+    from rss_parser import INITIAL_ENTRIES
+    from sharding import shard_path
+    from state_store import Outbox
+
+    logging.disable(logging.CRITICAL if not args.verbose else logging.NOTSET)
+    metrics = PipelineMetrics()
+    worker_metrics = []  # Per round, the metrics of each worker process
+    published_at = {}  # link -> time it appeared in its feed
+    started = time.perf_counter()
+    try:
+        for round_number in range(args.rounds):
+            if args.feed_dir:
+                links = recorded_links(feeds) if round_number == 0 else []
+            elif round_number == 0:
+                # A first run only takes the newest INITIAL_ENTRIES items of a feed
+                links = feeds.publish(min(args.articles, INITIAL_ENTRIES))
+            else:
+                links = feeds.publish(args.articles)
+            now = time.time()
+            published_at.update((link, now) for link in links)
+            if args.workers > 1:
+                worker_metrics.append(run_workers(args.workers, workdir, args.verbose))
+            else:
+                awwwwards_bot.main(metrics=metrics)
+    finally:
+        feeds.stop()
+        api.stop()
+    wall_seconds = time.perf_counter() - started
+
+    # Which article reached which chat, and how often
+    delivered = Counter()
+    delivery_seconds = []
+    for chat_id, text, delivered_at in api.deliveries:
+        for link in LINK_PATTERN.findall(text):
+            if link in published_at:
+                delivered[chat_id, link] += 1
+                if delivered[chat_id, link] == 1:
+                    delivery_seconds.append(delivered_at - published_at[link])
+    expected = {(chat_id, link) for chat_id in chats for link in published_at}
+    outboxes = [Outbox.load(shard_path("outbox.json", index)) for index in range(args.workers)]
+    queued = {(chat_id, link) for chat_id, link in expected - set(delivered)
+              if any(link in outbox for outbox in outboxes)}
+    lost = expected - set(delivered) - queued
+
+    if args.workers > 1:
+        # Workers of a round send at the same time: the round's send time is the slowest one's.
+        # Only quantile summaries come back from the processes, so the worst one is reported.
+        send_seconds = sum(max(worker["stages"].get("send", 0.0) for worker in workers)
+                           for workers in worker_metrics)
+        summaries = [worker["observations"].get("telegram_request_seconds", {})
+                     for workers in worker_metrics for worker in workers]
+        request_latency = {"p50": max((summary["0.5"] for summary in summaries if "0.5" in summary), default=None),
+                           "p99": max((summary["0.99"] for summary in summaries if "0.99" in summary), default=None)}
+    else:
+        send_seconds = metrics.stages.get("send", 0.0)
+        request_latency = quantiles(metrics.observations.get("telegram_request_seconds", []))
+    return {
+        "rounds": args.rounds, "feeds": len(feeds.urls), "chats": len(chats), "mode": args.mode,
+        "workers": args.workers,
+        "articles": len(published_at),
+        "faults": {"latency": args.latency, "jitter": args.jitter, "rate_limit_rate": args.rate_limit_rate,
+                   "retry_after": args.retry_after, "error_rate": args.error_rate},
+        "requests": api.requests,
+        "rate_limited": api.rate_limited,
+        "server_errors": api.errors,
+        "messages": len(api.deliveries),
+        "wall_seconds": wall_seconds,
+        "send_seconds": send_seconds,
+        "messages_per_second": len(api.deliveries) / send_seconds if send_seconds else None,
+        "request_latency": request_latency,
+        "delivery_latency": quantiles(delivery_seconds),
+        "deliveries_expected": len(expected),
+        "delivered": len(delivered),
+        "duplicates": sum(count - 1 for count in delivered.values()),
+        "queued_for_retry": len(queued),
+        "lost": len(lost),
+        "stages": metrics.stages if args.workers == 1 else None,
+        "counters": metrics.counters if args.workers == 1 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5, help="runs of the bot, each after new items appear")
+    parser.add_argument("--feeds", type=int, default=4, help="synthetic feeds to serve")
+    parser.add_argument("--articles", type=int, default=10,
+                        help="new items per feed and round (at most 5 in the first round, as a first run "
+                             "takes no more)")
+    parser.add_argument("--feed-dir", help="serve the recorded .xml feeds in this directory instead")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="bot processes per round, each polling its shard of the feeds (WORKER_COUNT)")
+    parser.add_argument("--chats", type=int, default=5, help="chats that receive every digest")
+    parser.add_argument("--mode", choices=("packed", "single"), default="packed", help="digest mode")
+    parser.add_argument("--parser", default="feedparser", help="feed parser backend (FEED_PARSER)")
+    parser.add_argument("--state", choices=("json", "sqlite"), default="json", help="sent-articles backend")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every Bot API call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="random extra latency, up to this many seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="fraction of sendMessage calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of the injected 429s, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of sendMessage calls answered with 500")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the injected latency and faults")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        try:
+            report = run(args, workdir)
+        finally:
+            os.chdir(cwd)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 1 if report["duplicates"] or report["lost"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
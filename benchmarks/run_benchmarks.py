@@ -0,0 +1,330 @@
+"""
+Benchmarks for the pipeline's hot paths: feed parsing, the dedup filter, the
+sent-articles state I/O (JSON and SQLite backends), the memory of the dedup index and
+the throughput of parsing many feeds in a process pool.
+
+Every stage runs on synthetic data (feeds of 10 to 100k entries, histories of up to
+1M links). Each measurement records the best wall time over --repeat runs and the
+peak traced memory (tracemalloc) of a separate run, and the results are written as
+JSON. Given --compare, the run is checked against an earlier result file and the
+script exits with status 1 when any stage got slower or hungrier than --max-regression
+allows, so CI can flag regressions.
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --full --compare bench.json --max-regression 0.25
+"""
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_articles, make_atom_xml, make_feed_xml, make_links  # noqa: E402
+
+QUICK_FEED_SIZES = (10, 1_000, 10_000)
+FULL_FEED_SIZES = (10, 1_000, 10_000, 100_000)
+QUICK_HISTORY_SIZES = (1_000, 100_000)
+FULL_HISTORY_SIZES = (1_000, 100_000, 1_000_000)
+INDEX_SIZES = (100_000, 1_000_000)  # Always includes 1M: the index exists for large histories
+POOL_FEEDS = 8                      # Feeds parsed at once by the parse_pool stage
+QUICK_POOL_ENTRIES = 1_000          # Entries per feed in the parse_pool stage
+FULL_POOL_ENTRIES = 10_000
+NEW_ARTICLES_PER_RUN = 50
+
+
+def measure(func, setup=None, repeat=3) -> dict:
+    """
+    Times `func(setup())` and traces its peak memory.
+
+    Returns:
+        {"seconds": best wall time, "peak_bytes": peak traced allocation}
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        started = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - started)
+
+    arg = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def bench_parse(workdir, sizes, repeat):
+    from rss_parser import FeedCache, fetch_rss_feed
+
+    results = []
+    for size in sizes:
+        path = os.path.join(workdir, f"feed-{size}.xml")
+        with open(path, "wb") as f:
+            f.write(make_feed_xml(size))
+
+        def setup():
+            # A watermark older than every entry, so the whole feed is turned into articles
+            return FeedCache({path: {"watermark": {"id": None, "published": 0}}})
+
+        result = measure(lambda cache: fetch_rss_feed(path, cache=cache), setup, repeat)
+        result.update(stage="parse", entries=size, bytes=os.path.getsize(path))
+        results.append(result)
+    return results
+
+
+def bench_dedup(sizes, history_sizes, repeat):
+    from awwwwards_bot import filter_new_articles
+    from link_index import FingerprintIndex
+    from state_store import Outbox
+
+    results = []
+    for history in history_sizes:
+        now = time.time()
+        sent = FingerprintIndex.from_items((link, now) for link in make_links(history))
+        outbox = Outbox(os.devnull)
+        for size in sizes:
+            # The newest NEW_ARTICLES_PER_RUN entries are new, the rest are already sent
+            articles = make_articles(size, start=history - size + NEW_ARTICLES_PER_RUN + 1)
+            result = measure(lambda _: filter_new_articles(articles, sent, outbox, set()), repeat=repeat)
+            result.update(stage="dedup", entries=size, history=history)
+            results.append(result)
+        del sent
+    return results
+
+
+def bench_state_io(workdir, history_sizes, repeat):
+    from state_store import JsonStateBackend, SqliteStateBackend
+
+    results = []
+    for history in history_sizes:
+        links = make_links(history)
+        batches = itertools.count()
+        for name, backend_class, suffix in (("json", JsonStateBackend, ".json"),
+                                            ("sqlite", SqliteStateBackend, ".db")):
+            path = os.path.join(workdir, f"sent-{name}-{history}{suffix}")
+            backend = backend_class(path)
+            backend.save(set(links))
+
+            load = measure(lambda _: backend.load(), repeat=repeat)
+            load.update(stage="state_load", backend=name, history=history)
+
+            def loaded_with_new_links():
+                # A history of the same size plus a batch of links it hasn't seen yet
+                if name == "json":
+                    backend.save(set(links))
+                loaded = backend.load()
+                start = history + 1 + next(batches) * NEW_ARTICLES_PER_RUN
+                for link in make_links(NEW_ARTICLES_PER_RUN, start=start):
+                    loaded.add(link)
+                return loaded
+
+            save = measure(lambda loaded: backend.save(loaded), loaded_with_new_links, repeat)
+            save.update(stage="state_save", backend=name, history=history, new_links=NEW_ARTICLES_PER_RUN)
+            results.extend([load, save])
+    return results
+
+
+def bench_index(sizes):
+    """
+    Compares the memory held by a plain set of link strings with the FingerprintIndex
+    that replaced it, and the time to look up a batch of links in each. Both are built
+    from freshly created strings, as when they are loaded from the state file, and the
+    build is timed separately from the (much slower) traced run.
+    """
+    from link_index import FingerprintIndex
+
+    builders = {
+        "set": lambda size: set(make_links(size)),
+        "fingerprints": lambda size: FingerprintIndex.from_items((link, 0.0) for link in make_links(size)),
+    }
+    results = []
+    for size in sizes:
+        probes = make_links(NEW_ARTICLES_PER_RUN, start=size - NEW_ARTICLES_PER_RUN // 2)
+        for name, build in builders.items():
+            gc.collect()
+            started = time.perf_counter()
+            index = build(size)
+            build_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for link in probes:
+                link in index
+            lookup_seconds = time.perf_counter() - started
+            del index
+
+            gc.collect()
+            tracemalloc.start()
+            index = build(size)
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del index
+            results.append({"stage": "index", "structure": name, "history": size, "seconds": lookup_seconds,
+                            "build_seconds": build_seconds, "retained_bytes": retained, "peak_bytes": peak})
+    return results
+
+
+def bench_parse_pool(entries, max_workers):
+    """
+    Parses POOL_FEEDS feeds at once: in threads (workers=0, serialized by the GIL) and in
+    process pools of 1, 2, 4, ... up to `max_workers` processes. Pools are warmed up
+    before timing, as in the daemon where they outlive a cycle.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from rss_parser import make_parse_pool, parse_feed
+
+    bodies = [make_feed_xml(entries, newest=entries * (i + 1)) for i in range(POOL_FEEDS)]
+    watermark = {"id": None, "published": 0}  # Older than every entry: parse them all
+    counts = [0] + [n for n in (1, 2, 4, 8, 16, 32) if n < max_workers] + [max_workers]
+    results = []
+    for workers in sorted(set(counts)):
+        pool = make_parse_pool(workers) or ThreadPoolExecutor(max_workers=POOL_FEEDS)
+        try:
+            pool.submit(parse_feed, make_feed_xml(1)).result()
+            started = time.perf_counter()
+            parsed = list(pool.map(parse_feed, bodies, [None] * POOL_FEEDS, [watermark] * POOL_FEEDS))
+            seconds = time.perf_counter() - started
+        finally:
+            pool.shutdown()
+        assert sum(len(result["articles"]) for result in parsed) == entries * POOL_FEEDS
+        results.append({"stage": "parse_pool", "workers": workers, "feeds": POOL_FEEDS, "entries": entries,
+                        "seconds": seconds,
+                        "entries_per_second": round(entries * POOL_FEEDS / seconds)})
+    return results
+
+
+def parser_samples(sizes, samples_dir=None):
+    """
+    Yields (name, body) feed samples for the parsers stage: rich RSS 2.0 and Atom feeds of
+    every size, plus each .xml file in `samples_dir` (saved copies of real feeds).
+    """
+    for size in sizes:
+        yield f"rss-{size}", make_feed_xml(size, rich=True)
+        yield f"atom-{size}", make_atom_xml(size)
+    if samples_dir:
+        for name in sorted(os.listdir(samples_dir)):
+            if name.endswith(".xml"):
+                with open(os.path.join(samples_dir, name), "rb") as f:
+                    yield name, f.read()
+
+
+def bench_parsers(sizes, repeat, samples_dir=None):
+    """
+    Parses each sample with every backend, once reading every entry (a watermark older
+    than all of them) and once as a first run, which stops after INITIAL_ENTRIES.
+    """
+    from feed_backends import BACKENDS
+    from rss_parser import parse_feed
+
+    results = []
+    for sample, body in parser_samples(sizes, samples_dir):
+        for read, watermark in (("all", {"id": None, "published": 0}), ("first_run", None)):
+            links = {}
+            for parser in BACKENDS:
+                def run(_):
+                    links[parser] = [article["link"] for article in parse_feed(body, None, watermark, True, parser)["articles"]]
+                result = measure(run, repeat=repeat)
+                results.append({"stage": "parsers", "sample": sample, "bytes": len(body), "read": read,
+                                "parser": parser, "entries": len(links[parser]), **result})
+            if len(set(map(tuple, links.values()))) != 1:
+                logging.warning(f"Parsers disagree on {sample} ({read}): "
+                                + ", ".join(f"{parser} found {len(found)}" for parser, found in links.items()))
+    return results
+
+
+def result_key(result) -> str:
+    return "/".join(f"{key}={result[key]}" for key in sorted(result)
+                    if key not in ("seconds", "peak_bytes", "bytes", "build_seconds", "retained_bytes",
+                                   "entries_per_second"))
+
+
+def compare(results, baseline, max_regression) -> list:
+    """
+    Returns a description of every stage that regressed by more than `max_regression`
+    (as a fraction) in time or peak memory compared to `baseline`.
+    """
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if old.get(metric) and result.get(metric, 0) > old[metric] * (1 + max_regression):
+                regressions.append(f"{result_key(result)}: {metric} {old[metric]:.6g} -> {result[metric]:.6g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="include the 100k-entry feed and the 1M-link history")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement (best is kept)")
+    parser.add_argument("--stages", default="parse,dedup,state,index,parse_pool,parsers",
+                        help="comma-separated subset of parse,dedup,state,index,parse_pool,parsers")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1,
+                        help="largest process pool for the parse_pool stage (default: CPU count)")
+    parser.add_argument("--feed-samples", help="directory of saved real-world feeds (.xml) for the parsers stage")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed slowdown / memory growth as a fraction (default 0.25)")
+    args = parser.parse_args()
+
+    # The modules under test log every save; keep the output to the results
+    logging.disable(logging.INFO)
+
+    feed_sizes = FULL_FEED_SIZES if args.full else QUICK_FEED_SIZES
+    history_sizes = FULL_HISTORY_SIZES if args.full else QUICK_HISTORY_SIZES
+    stages = set(args.stages.split(","))
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if "parse" in stages:
+            results += bench_parse(workdir, feed_sizes, args.repeat)
+        if "dedup" in stages:
+            results += bench_dedup(feed_sizes, history_sizes, args.repeat)
+        if "state" in stages:
+            results += bench_state_io(workdir, history_sizes, args.repeat)
+        if "index" in stages:
+            results += bench_index(INDEX_SIZES)
+        if "parse_pool" in stages:
+            results += bench_parse_pool(FULL_POOL_ENTRIES if args.full else QUICK_POOL_ENTRIES, args.max_workers)
+        if "parsers" in stages:
+            results += bench_parsers(feed_sizes, args.repeat, args.feed_samples)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Cold-start benchmark for the cron entry point.
+
+Runs `awwwwards_bot.py` in a fresh interpreter against a local feed server that answers
+304 Not Modified, which is what most cron runs see. Reports the import time of
+awwwwards_bot (from `python -X importtime`) and the wall time of the whole run, and
+fails when either exceeds its budget or when a module that should only be imported
+once there is something to send shows up on this path.
+
+    python benchmarks/startup.py --runs 5 --import-budget-ms 100 --run-budget-ms 250
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_ROOT, "awwwwards_bot.py")
+ETAG = '"unchanged"'
+
+# Only needed once there is something to send, or a feed to parse
+DEFERRED_MODULES = ("telegram", "telegram_messege", "dotenv", "httpx", "asyncio", "feedparser")
+
+
+class NotModifiedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(304 if self.headers.get("If-None-Match") == ETAG else 500)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Parses `-X importtime` output into {module: cumulative microseconds}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        modules[name.strip()] = int(cumulative_us)
+    return modules
+
+
+def run_once(workdir: str, feed_url: str) -> dict:
+    env = dict(os.environ, RSS_URLS=feed_url, PYTHONPATH=REPO_ROOT)
+
+    # Import cost of the entry point module on its own
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import awwwwards_bot"],
+                            cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    import_ms = parse_importtime(result.stderr)["awwwwards_bot"] / 1000
+
+    # A complete run that finds nothing new
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", BOT_SCRIPT],
+                            cwd=workdir, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"awwwwards_bot.py failed:\n{result.stderr}")
+    modules = parse_importtime(result.stderr)
+    return {
+        "wall_ms": wall_ms,
+        "import_ms": import_ms,
+        "deferred_imported": sorted(m for m in DEFERRED_MODULES if m in modules),
+        "not_modified": "1 not modified" in result.stderr,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=100.0)
+    parser.add_argument("--run-budget-ms", type=float, default=250.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NotModifiedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    feed_url = f"http://127.0.0.1:{server.server_address[1]}/feed"
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(os.path.join(workdir, "feed_state.json"), "w") as f:
+                json.dump({feed_url: {"etag": ETAG, "modified": None}}, f)
+            runs = [run_once(workdir, feed_url) for _ in range(args.runs)]
+    finally:
+        server.shutdown()
+
+    # The fastest run is the least disturbed by whatever else the machine is doing
+    report = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "import_ms": min(run["import_ms"] for run in runs),
+        "wall_ms": min(run["wall_ms"] for run in runs),
+        "import_budget_ms": args.import_budget_ms,
+        "run_budget_ms": args.run_budget_ms,
+        "deferred_imported": sorted({m for run in runs for m in run["deferred_imported"]}),
+        "not_modified": all(run["not_modified"] for run in runs),
+    }
+    report["ok"] = (report["import_ms"] <= args.import_budget_ms and report["wall_ms"] <= args.run_budget_ms
+                    and not report["deferred_imported"] and report["not_modified"])
+    print(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
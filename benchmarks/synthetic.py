@@ -0,0 +1,105 @@
+"""
+Synthetic feeds and sent-article histories for the benchmarks.
+"""
+import time
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+SUMMARY = ("A closer look at the layout, typography and motion design choices behind this "
+           "site, with notes on the tools and techniques the team used to build it.")
+
+
+def article_link(n: int) -> str:
+    return f"https://www.example.com/blog/synthetic-article-{n}"
+
+
+# Full article body in the shape WordPress puts in <content:encoded>, about 2 KB
+CONTENT = "".join(f"<h2>Part {i}</h2><p>{SUMMARY} <a href=\"https://www.example.com/\">More</a></p>"
+                  '<figure><img src="https://www.example.com/image.jpg" alt=""/></figure>'
+                  for i in range(1, 6))
+
+
+def make_feed_xml(entries: int, newest: int = None, rich: bool = False, now: float = None) -> bytes:
+    """
+    Builds an RSS 2.0 feed with `entries` items, newest first. Item numbers count down
+    from `newest` (default: `entries`), so links line up with make_links(). Items are a
+    minute apart, the newest published at `now` (default: the current time).
+
+    With `rich`, each item also carries what real-world (WordPress) feeds add: an author,
+    categories, a comments link and the full article in <content:encoded>.
+    """
+    newest = entries if newest is None else newest
+    now = time.time() if now is None else now
+    items = []
+    for n in range(newest, newest - entries, -1):
+        extras = ""
+        if rich:
+            extras = (
+                f"<comments>{article_link(n)}#respond</comments>"
+                "<dc:creator><![CDATA[Synthetic Author]]></dc:creator>"
+                "<category><![CDATA[Inspiration]]></category><category><![CDATA[Design]]></category>"
+                f"<content:encoded><![CDATA[{CONTENT}]]></content:encoded>"
+            )
+        items.append(
+            "<item>"
+            f"<title>{escape(f'Synthetic article {n} & friends')}</title>"
+            f"<link>{article_link(n)}</link>"
+            f"<guid isPermaLink=\"false\">synthetic-{n}</guid>"
+            f"<pubDate>{formatdate(now - (newest - n) * 60)}</pubDate>"
+            f"<description>{escape(f'<p>{SUMMARY}</p>')}</description>"
+            + extras +
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/"><channel>'
+        "<title>Synthetic feed</title><link>https://www.example.com/blog/</link>"
+        "<description>Benchmark feed</description><ttl>30</ttl>"
+        + "".join(items) +
+        "</channel></rss>\n"
+    ).encode("utf-8")
+
+
+def make_atom_xml(entries: int, newest: int = None) -> bytes:
+    """
+    Builds an Atom feed with `entries` entries, newest first, each with a summary and the
+    full article as HTML content, numbered like make_feed_xml().
+    """
+    newest = entries if newest is None else newest
+    now = time.time()
+    items = []
+    for n in range(newest, newest - entries, -1):
+        updated = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - (newest - n) * 60))
+        items.append(
+            "<entry>"
+            f"<title type=\"html\">{escape(f'Synthetic article {n} &amp; friends')}</title>"
+            f"<link rel=\"alternate\" type=\"text/html\" href=\"{article_link(n)}\"/>"
+            f"<link rel=\"replies\" href=\"{article_link(n)}#comments\"/>"
+            f"<id>tag:example.com,2024:synthetic-{n}</id>"
+            f"<published>{updated}</published><updated>{updated}</updated>"
+            "<author><name>Synthetic Author</name></author>"
+            f"<summary type=\"html\">{escape(f'<p>{SUMMARY}</p>')}</summary>"
+            f"<content type=\"html\">{escape(CONTENT)}</content>"
+            "</entry>"
+        )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom">'
+        "<title>Synthetic feed</title><id>tag:example.com,2024:feed</id>"
+        '<link rel="self" href="https://www.example.com/feed.atom"/>'
+        + "".join(items) +
+        "</feed>\n"
+    ).encode("utf-8")
+
+
+def make_links(count: int, start: int = 1) -> list:
+    """
+    Returns `count` distinct article links, numbered from `start`.
+    """
+    return [article_link(n) for n in range(start, start + count)]
+
+
+def make_articles(count: int, start: int = 1) -> list:
+    return [{"title": f"Synthetic article {n}", "link": article_link(n), "summary": SUMMARY}
+            for n in range(start, start + count)]
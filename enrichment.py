@@ -0,0 +1,257 @@
+import json
+import logging
+import math
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+from feed_transport import FeedHTTPError, FeedTransport
+from link_index import canonical_link
+from rss_parser import fetch_many
+from state_store import Retention, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Concurrency limits for fetching article pages (see rss_parser.fetch_many)
+MAX_CONCURRENT_ENRICHMENTS = 4  # Pages fetched at the same time overall
+MAX_ENRICHMENTS_PER_HOST = 2    # Pages fetched at the same time from one host
+
+MAX_PAGE_BYTES = 2 * 1024 * 1024  # Larger article pages are not enriched
+WORDS_PER_MINUTE = 230            # Reading speed for the estimated reading time
+
+# Cached results are kept for CACHE_TTL_DAYS, and at most CACHE_MAX_ENTRIES of them
+CACHE_TTL_DAYS = 7
+CACHE_MAX_ENTRIES = 5000
+
+# Pages are fetched over their own pooled connections, under a tighter size limit than feeds
+TRANSPORT = FeedTransport(user_agent="awwwwards-bot", max_bytes=MAX_PAGE_BYTES)
+
+CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class _PageParser(HTMLParser):
+    """
+    Collects the preview image (og:image, else twitter:image) and counts the words of
+    the visible text, separately for the text inside <article> elements.
+    """
+
+    SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.images = {}
+        self.words = 0
+        self.article_words = 0
+        self._skipped = 0   # Nesting inside tags whose text isn't read
+        self._articles = 0  # Nesting inside <article>
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            name = (attrs.get("property") or attrs.get("name") or "").lower()
+            if name in ("og:image", "og:image:url", "og:image:secure_url", "twitter:image") and attrs.get("content"):
+                self.images.setdefault(name, attrs["content"].strip())
+        elif tag in self.SKIPPED_TAGS:
+            self._skipped += 1
+        elif tag == "article":
+            self._articles += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skipped:
+            self._skipped -= 1
+        elif tag == "article" and self._articles:
+            self._articles -= 1
+
+    def handle_data(self, data):
+        if self._skipped:
+            return
+        count = len(data.split())
+        self.words += count
+        if self._articles:
+            self.article_words += count
+
+
+def extract_metadata(body: bytes, headers: dict = None, url: str = None) -> dict:
+    """
+    Extracts the enrichment of an article page.
+
+    Args:
+        body: The HTML document.
+        headers: The HTTP response headers (lowercase keys), used to find the charset.
+        url: The page URL, to resolve a relative image URL.
+
+    Returns:
+        A dict with "image" (absolute URL or None) and "reading_minutes" (at least 1,
+        based on the words inside <article> if the page has any, else the whole page;
+        None for a page without text).
+    """
+    content_type = (headers or {}).get("content-type", "")
+    charset = content_type.partition("charset=")[2].split(";")[0].strip(" \"'")
+    if not charset:
+        match = CHARSET_PATTERN.search(body[:2048])
+        charset = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        text = body.decode(charset, errors="replace")
+    except LookupError:  # Unknown charset name
+        text = body.decode("utf-8", errors="replace")
+
+    parser = _PageParser()
+    parser.feed(text)
+    parser.close()
+    image = next((parser.images[name] for name in ("og:image", "og:image:url", "og:image:secure_url",
+                                                   "twitter:image") if name in parser.images), None)
+    if image and url:
+        image = urljoin(url, image)
+    words = parser.article_words or parser.words
+    return {"image": image, "reading_minutes": max(1, math.ceil(words / WORDS_PER_MINUTE)) if words else None}
+
+
+def fetch_metadata(url: str, transport: FeedTransport = None) -> dict:
+    """
+    Downloads an article page and extracts its enrichment (see extract_metadata).
+
+    Raises:
+        FeedHTTPError: The server answered with an error status.
+        FeedTooLarge: The page is larger than MAX_PAGE_BYTES.
+    """
+    response = (transport or TRANSPORT).get(url)
+    if not 200 <= response.status < 300:
+        raise FeedHTTPError(response.status, url)
+    return extract_metadata(response.body, response.headers, response.url)
+
+
+class EnrichmentCache:
+    """
+    On-disk cache of article enrichments, keyed by canonical link, so a page is fetched
+    at most once however many runs, retries or feeds bring its article back.
+
+    Entries are {"image", "reading_minutes", "fetched"}; pages that couldn't be fetched
+    are cached too, with both values None, so they aren't tried again on every run.
+    Entries older than the retention's age are treated as missing, and `save` keeps at
+    most its max_entries most recently fetched ones.
+    """
+
+    def __init__(self, filepath: str, entries: dict = None, retention: Retention = None):
+        self.filepath = filepath
+        self.entries = entries if entries is not None else {}
+        self.retention = retention or Retention(max_age_days=CACHE_TTL_DAYS, max_entries=CACHE_MAX_ENTRIES)
+        self.dirty = False  # True once the entries differ from the file
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath: str, **kwargs) -> "EnrichmentCache":
+        """
+        Loads the cache from a JSON file; missing or invalid files give an empty cache.
+        """
+        try:
+            with open(filepath, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load the enrichment cache from '{filepath}', starting empty: {e}")
+            entries = {}
+        return cls(filepath, entries if isinstance(entries, dict) else {}, **kwargs)
+
+    def get(self, link: str, now: float = None):
+        """
+        Returns the cached enrichment of a link, or None if it is missing or expired.
+        """
+        entry = self.entries.get(canonical_link(link))
+        cutoff = self.retention.cutoff(now if now is not None else time.time())
+        if entry is None or (cutoff is not None and entry.get("fetched", 0) < cutoff):
+            return None
+        return entry
+
+    def put(self, link: str, metadata: dict, now: float = None):
+        with self._lock:
+            self.entries[canonical_link(link)] = {"image": metadata.get("image"),
+                                                  "reading_minutes": metadata.get("reading_minutes"),
+                                                  "fetched": now if now is not None else time.time()}
+            self.dirty = True
+
+    def evict(self, now: float = None) -> int:
+        """
+        Drops the expired entries and the oldest ones beyond the size limit.
+
+        Returns:
+            The number of entries dropped.
+        """
+        cutoff = self.retention.cutoff(now if now is not None else time.time())
+        keep = [(link, entry) for link, entry in self.entries.items()
+                if cutoff is None or entry.get("fetched", 0) >= cutoff]
+        if self.retention.max_entries and len(keep) > self.retention.max_entries:
+            keep.sort(key=lambda item: item[1].get("fetched", 0), reverse=True)
+            keep = keep[:self.retention.max_entries]
+        dropped = len(self.entries) - len(keep)
+        if dropped:
+            self.entries = dict(keep)
+            self.dirty = True
+        return dropped
+
+    def save(self):
+        """
+        Evicts and writes the cache if it changed.
+        """
+        self.evict()
+        if not self.dirty:
+            return
+        try:
+            write_json_atomic(self.filepath, self.entries)
+            self.dirty = False
+        except Exception as e:
+            logger.error(f"Could not write the enrichment cache to '{self.filepath}': {e}")
+
+
+def enrich_articles(articles, cache: EnrichmentCache, fetch=fetch_metadata,
+                    max_workers: int = MAX_CONCURRENT_ENRICHMENTS, per_host: int = MAX_ENRICHMENTS_PER_HOST) -> dict:
+    """
+    Adds "image" and "reading_minutes" to the articles (in place) wherever they are known.
+
+    Cached enrichments are used as they are. The other pages are fetched concurrently,
+    at most `max_workers` at a time and `per_host` per host, each link once even if
+    several articles share it, and the results go into the cache. Only http(s) links
+    are fetched. A page that fails leaves its article as it is.
+
+    Args:
+        articles: Article dicts with a 'link'.
+        cache: The EnrichmentCache to read and update; the caller saves it.
+        fetch: Callable taking a URL and returning the metadata dict (see fetch_metadata).
+
+    Returns:
+        Counters: "cached" articles served from the cache, "fetched" pages downloaded
+        and "failed" pages that couldn't be enriched.
+    """
+    stats = {"cached": 0, "fetched": 0, "failed": 0}
+    pending = {}  # canonical link -> URL to fetch
+    for article in articles:
+        link = article.get('link', '')
+        if cache.get(link) is not None:
+            stats["cached"] += 1
+        elif urlsplit(link).scheme in ("http", "https"):
+            pending.setdefault(canonical_link(link), link)
+
+    def fetch_one(url):
+        try:
+            return fetch(url)
+        except Exception as e:
+            logger.warning(f"Could not enrich article '{url}': {e}")
+            return None
+
+    for url, metadata in fetch_many(pending.values(), fetch=fetch_one, max_workers=max_workers, per_host=per_host):
+        if metadata:
+            stats["fetched"] += 1
+        else:
+            stats["failed"] += 1
+        cache.put(url, metadata or {})
+
+    for article in articles:
+        entry = cache.get(article.get('link', ''))
+        if entry is None:
+            continue
+        for key in ("image", "reading_minutes"):
+            if entry.get(key) is not None:
+                article[key] = entry[key]
+    return stats
@@ -0,0 +1,226 @@
+import calendar
+import html
+import io
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import mktime_tz, parsedate_tz
+from types import SimpleNamespace
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+XHTML_NS = "{http://www.w3.org/1999/xhtml}"
+WEBSUB_RELS = ("hub", "self")  # Channel links read for WebSub, see websub.py
+
+
+class UnsupportedFeed(Exception):
+    """
+    Raised by a backend for a document it can't handle, so the caller falls back to feedparser.
+    """
+
+
+class ParsedFeed:
+    """
+    What a backend returns: `entries`, an iterable of objects with the attributes
+    feedparser gives its entries (title, link, summary, id, published_parsed), newest
+    first; `hints()`, the channel's polling hints, {"ttl": ..., "skip_hours": [...]}; and
+    `links()`, the channel's WebSub links, {"hub": ..., "self": ...}, None for those it
+    doesn't have.
+
+    `entries` may be lazy, so a consumer that stops early saves the rest of the work.
+    `hints()` and `links()` then only have the keys read by the time they are called: a
+    missing key is unknown, not absent from the feed.
+    """
+
+    def __init__(self, entries, hints, links):
+        self.entries = entries
+        self._hints = hints
+        self._links = links
+
+    def hints(self):
+        return self._hints()
+
+    def links(self):
+        return self._links()
+
+
+class FeedparserBackend:
+    """
+    Parses with feedparser: every feed format and every kind of broken markup, at the
+    cost of normalizing and sanitizing the whole document up front.
+    """
+
+    name = "feedparser"
+
+    def parse(self, body: bytes, headers: dict = None) -> ParsedFeed:
+        import feedparser
+
+        feed = feedparser.parse(body, response_headers=headers or {})
+        return ParsedFeed(feed.entries, lambda: feedparser_hints(feed), lambda: feedparser_links(feed))
+
+
+class StreamingBackend:
+    """
+    Reads RSS 2.0 and Atom with ElementTree's iterparse and extracts only what the bot
+    uses. Items are produced one at a time while the document is read, so the work stops
+    at the first entry the caller doesn't want, and every processed item is cleared to
+    keep memory flat.
+
+    Malformed XML raises ET.ParseError, and other formats (RSS 1.0/RDF, ...) or entries
+    without a link raise UnsupportedFeed, possibly after some entries were produced;
+    callers then start over with feedparser. As in feedparser, an RSS item without <link>
+    takes its permalink <guid>, and Atom xhtml text is serialized. Unlike feedparser, text
+    is not sanitized or normalized beyond stripping whitespace, and all <skipHours> hours
+    are kept.
+    """
+
+    name = "streaming"
+
+    def parse(self, body: bytes, headers: dict = None) -> ParsedFeed:
+        channel = {"hints": {}, "links": {}}
+        return ParsedFeed(self._entries(body, channel), lambda: dict(channel["hints"]),
+                          lambda: dict(channel["links"]))
+
+    def _entries(self, body, channel):
+        events = ET.iterparse(io.BytesIO(body), events=("start", "end"))
+        _, root = next(events)
+        if root.tag == "rss":
+            item_tag, read = "item", self._rss_entry
+        elif root.tag == f"{ATOM_NS}feed":
+            item_tag, read = f"{ATOM_NS}entry", self._atom_entry
+        else:
+            raise UnsupportedFeed(f"Unsupported root element <{root.tag}>")
+
+        depth = 0  # Nesting inside the current item
+        for event, element in events:
+            if event == "start":
+                if element.tag == item_tag or depth:
+                    depth += 1
+                continue
+            if depth:
+                depth -= 1
+                if depth == 0:
+                    yield read(element)
+                    element.clear()
+            elif element.tag == "ttl":
+                text = (element.text or "").strip()
+                channel["hints"]["ttl"] = int(text) if text.isdigit() else None
+            elif element.tag == "hour":
+                text = (element.text or "").strip()
+                if text.isdigit():
+                    channel["hints"].setdefault("skip_hours", []).append(int(text))
+            elif element.tag == f"{ATOM_NS}link" and element.get("rel") in WEBSUB_RELS and element.get("href"):
+                channel["links"].setdefault(element.get("rel"), element.get("href").strip())
+        # Read to the end: whatever wasn't found isn't in the feed
+        channel["hints"].setdefault("ttl", None)
+        channel["hints"].setdefault("skip_hours", [])
+        for rel in WEBSUB_RELS:
+            channel["links"].setdefault(rel, None)
+
+    @staticmethod
+    def _rss_entry(item):
+        fields = {}
+        permalink = False
+        for child in item:
+            if child.tag in ("title", "link", "description", "guid", "pubDate"):
+                fields.setdefault(child.tag, (child.text or "").strip())
+            if child.tag == "guid":
+                permalink = child.get("isPermaLink", "true").lower() == "true"
+        entry = SimpleNamespace()
+        if "title" in fields:
+            entry.title = fields["title"]
+        if "link" in fields:
+            entry.link = fields["link"]
+        elif permalink and fields.get("guid"):
+            entry.link = fields["guid"]
+        if "description" in fields:
+            entry.summary = fields["description"]
+        if fields.get("guid"):
+            entry.id = fields["guid"]
+        entry.published_parsed = _rfc822_time(fields.get("pubDate"))
+        return _complete(entry)
+
+    @staticmethod
+    def _atom_entry(item):
+        entry = SimpleNamespace()
+        for child in item:
+            tag = child.tag[len(ATOM_NS):] if child.tag.startswith(ATOM_NS) else None
+            if tag == "link":
+                if child.get("rel", "alternate") == "alternate" and not hasattr(entry, "link"):
+                    entry.link = child.get("href", "")
+            elif tag in ("title", "id") and not hasattr(entry, tag):
+                setattr(entry, tag, _atom_text(child))
+            elif tag == "summary" or (tag == "content" and not hasattr(entry, "summary")):
+                entry.summary = _atom_text(child)
+            elif tag in ("published", "updated"):
+                setattr(entry, f"{tag}_parsed", _iso8601_time(child.text))
+        return _complete(entry)
+
+
+def _complete(entry):
+    """
+    Returns the entry if it has a link, else raises UnsupportedFeed: feedparser knows
+    more places to find one.
+    """
+    if not getattr(entry, "link", None):
+        raise UnsupportedFeed(f"Entry {getattr(entry, 'id', None) or getattr(entry, 'title', '')!r} has no link")
+    return entry
+
+
+def _atom_text(element):
+    """
+    Returns the text of an Atom text construct; type="xhtml" content is serialized
+    from inside its wrapping <div>, without the XHTML namespace, as feedparser does.
+    """
+    if element.get("type") != "xhtml":
+        return (element.text or "").strip()
+    div = next(iter(element), None)
+    if div is None:
+        return ""
+    for node in div.iter():
+        if isinstance(node.tag, str) and node.tag.startswith(XHTML_NS):
+            node.tag = node.tag[len(XHTML_NS):]
+    parts = [html.escape(div.text or "", quote=False)]
+    parts.extend(ET.tostring(child, encoding="unicode") for child in div)
+    return "".join(parts).strip()
+
+
+def _rfc822_time(text):
+    parsed = parsedate_tz(text) if text else None
+    return time.gmtime(mktime_tz(parsed)) if parsed else None
+
+
+def _iso8601_time(text):
+    try:
+        moment = datetime.fromisoformat((text or "").strip())
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return time.gmtime(calendar.timegm(moment.utctimetuple()))
+
+
+def feedparser_hints(feed):
+    """
+    Extracts the polling hints ({"ttl": ..., "skip_hours": [...]}) from a feed parsed by feedparser.
+    """
+    channel = feed.get("feed") or {}
+    ttl = channel.get("ttl")
+    ttl = int(ttl) if isinstance(ttl, str) and ttl.strip().isdigit() else None
+    # feedparser flattens <skipHours> and only keeps the last <hour> it contains
+    hour = channel.get("hour")
+    skip_hours = [int(hour)] if isinstance(hour, str) and hour.strip().isdigit() else []
+    return {"ttl": ttl, "skip_hours": skip_hours}
+
+
+def feedparser_links(feed):
+    """
+    Extracts the WebSub links ({"hub": ..., "self": ...}) of a feed parsed by feedparser.
+    """
+    links = dict.fromkeys(WEBSUB_RELS)
+    for link in (feed.get("feed") or {}).get("links", []):
+        if link.get("rel") in WEBSUB_RELS and link.get("href"):
+            links[link["rel"]] = links[link["rel"]] or link["href"].strip()
+    return links
+
+
+BACKENDS = {backend.name: backend for backend in (FeedparserBackend(), StreamingBackend())}
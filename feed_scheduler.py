@@ -0,0 +1,79 @@
+import heapq
+import time
+
+# Polling bounds for the daemon, in seconds
+MIN_POLL_INTERVAL = 5 * 60
+MAX_POLL_INTERVAL = 24 * 60 * 60
+DEFAULT_POLL_INTERVAL = 30 * 60
+SPEED_UP = 0.5   # Interval factor after a poll that found new articles
+SLOW_DOWN = 1.5  # Interval factor after a poll that found nothing
+
+
+class FeedScheduler:
+    """
+    Decides when each feed is polled next in daemon mode.
+
+    Every feed has its own interval. A poll that finds new articles halves it and an empty
+    poll stretches it by half, within MIN/MAX_POLL_INTERVAL, so busy feeds converge on
+    frequent polls and dead ones on rare polls. The feed's own hints are honoured: the
+    interval never drops below its RSS <ttl>, and polls due in one of its <skipHours>
+    (UTC) are moved to the next allowed hour.
+
+    The learned interval is kept in the per-feed state dict (as used by FeedCache) under
+    "poll_interval", so it survives restarts.
+    """
+
+    def __init__(self, urls, feed_state: dict, now: float = None):
+        self.feed_state = feed_state
+        self._queue = []
+        now = time.time() if now is None else now
+        for url in dict.fromkeys(urls):
+            heapq.heappush(self._queue, (now, url))  # Everything is polled once on startup
+
+    def interval(self, url) -> float:
+        return self.feed_state.get(url, {}).get("poll_interval", DEFAULT_POLL_INTERVAL)
+
+    def due(self, now: float = None) -> list:
+        """
+        Removes and returns the feeds whose poll time has come.
+        """
+        now = time.time() if now is None else now
+        urls = []
+        while self._queue and self._queue[0][0] <= now:
+            urls.append(heapq.heappop(self._queue)[1])
+        return urls
+
+    def next_poll_at(self):
+        """
+        Returns the time of the earliest scheduled poll, or None if nothing is scheduled.
+        """
+        return self._queue[0][0] if self._queue else None
+
+    def record(self, url, new_articles: int, now: float = None, min_interval: float = 0) -> float:
+        """
+        Adapts the feed's interval to the outcome of a poll and schedules the next one,
+        at least `min_interval` seconds later (e.g. for a feed whose updates are pushed).
+
+        Returns:
+            The time of the next poll.
+        """
+        now = time.time() if now is None else now
+        entry = self.feed_state.setdefault(url, {})
+        interval = self.interval(url) * (SPEED_UP if new_articles else SLOW_DOWN)
+        interval = min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+        entry["poll_interval"] = interval
+
+        ttl = entry.get("ttl")
+        next_poll = now + max(interval, ttl * 60 if ttl else 0, min_interval)
+        next_poll = self._skip_hours(next_poll, entry.get("skip_hours") or [])
+        heapq.heappush(self._queue, (next_poll, url))
+        return next_poll
+
+    @staticmethod
+    def _skip_hours(when: float, skip_hours) -> float:
+        skip = set(skip_hours)
+        if len(skip) >= 24:
+            return when
+        while time.gmtime(when).tm_hour in skip:
+            when = (when // 3600 + 1) * 3600  # Start of the next hour
+        return when
@@ -0,0 +1,266 @@
+import http.client
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli  # Optional: lets servers send Content-Encoding: br (see _brotli_has_output_limit)
+except ImportError:
+    brotli = None
+
+CONNECT_TIMEOUT = 10     # Seconds to establish a connection
+READ_TIMEOUT = 30        # Seconds to wait for each chunk of the response
+TOTAL_TIMEOUT = 60       # Seconds for a whole download, so a server trickling bytes can't stall a run
+MAX_FEED_BYTES = 10 * 1024 * 1024  # Largest feed accepted, after decompression
+MAX_REDIRECTS = 5
+MAX_IDLE_PER_HOST = 2    # Keep-alive connections kept per host (fetch_many runs at most 2 per host)
+CHUNK_SIZE = 64 * 1024
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+LINK_HEADER_PATTERN = re.compile(r'<([^>]*)>\s*((?:;\s*[^,;]*)*)')
+REL_PATTERN = re.compile(r'rel\s*=\s*"?([^";]+)"?', re.IGNORECASE)
+
+FeedResponse = namedtuple("FeedResponse", "status headers body bytes_received url")
+FeedResponse.__doc__ = """
+A downloaded feed: the HTTP status, the headers (lowercase names), the decoded body
+(empty for 304), the bytes that came over the wire and the final URL after redirects.
+"""
+
+
+def parse_link_header(value: str) -> dict:
+    """
+    Returns the URLs of an HTTP Link header by relation, e.g. {"hub": ..., "self": ...}.
+    """
+    links = {}
+    for url, params in LINK_HEADER_PATTERN.findall(value or ""):
+        match = REL_PATTERN.search(params)
+        for rel in (match.group(1).lower().split() if match else ()):
+            links.setdefault(rel, url.strip())
+    return links
+
+
+class FeedTooLarge(Exception):
+    """
+    Raised when a feed exceeds the transport's `max_bytes` after decompression.
+    """
+
+
+class FeedHTTPError(Exception):
+    """
+    Raised for a feed the server answered with an error status.
+    """
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+def _brotli_has_output_limit() -> bool:
+    """
+    Tells whether the installed brotli can cap a decompressor's output (brotli 1.2+).
+    Older versions decompress a whole chunk at once, past any size limit, so br is
+    neither asked for nor decoded with them.
+    """
+    if brotli is None:
+        return False
+    try:
+        brotli.Decompressor().process(brotli.compress(b""), output_buffer_limit=1)
+    except TypeError:
+        return False
+    return True
+
+
+class _Decoder:
+    """
+    Incrementally decodes a Content-Encoding, never producing more than asked for, so
+    a small compressed body can't expand past the size limit in memory.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding in ("gzip", "x-gzip"):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._zlib = zlib.decompressobj()
+            self._raw_deflate_fallback = True
+        elif encoding == "br" and _brotli_has_output_limit():
+            self._brotli = brotli.Decompressor()
+        elif encoding not in ("", "identity"):
+            raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+    def decode(self, data: bytes, limit: int) -> bytes:
+        """
+        Returns the decoded bytes for `data`, or at most `limit` + 1 of them.
+        """
+        if self.encoding in ("", "identity"):
+            return data[:limit + 1]
+        if self.encoding == "br":
+            return self._brotli.process(data, output_buffer_limit=limit + 1)
+        try:
+            return self._zlib.decompress(data, limit + 1)
+        except zlib.error:
+            if not getattr(self, "_raw_deflate_fallback", False):
+                raise
+            # Some servers send a raw deflate stream without the zlib header
+            self._raw_deflate_fallback = False
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._zlib.decompress(data, limit + 1)
+
+
+class FeedTransport:
+    """
+    Downloads feeds over pooled keep-alive connections, with connect, read and total
+    timeouts and a cap on the (decompressed) size of a feed.
+
+    Connections are kept per (scheme, host, port) and reused by later requests to the
+    same host, so polling several feeds of one site doesn't pay a TCP and TLS handshake
+    for each. The transport is thread-safe; a connection is only used by one request at a time.
+
+    Plain paths and file:// URLs are read from disk, under the same size limit.
+    """
+
+    def __init__(self, user_agent: str = "awwwwards-bot", connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, total_timeout: float = TOTAL_TIMEOUT,
+                 max_bytes: int = MAX_FEED_BYTES, max_idle_per_host: int = MAX_IDLE_PER_HOST):
+        self.user_agent = user_agent
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.max_idle_per_host = max_idle_per_host
+        self.accept_encoding = "gzip, deflate, br" if _brotli_has_output_limit() else "gzip, deflate"
+        self.connections_opened = 0
+        self._idle = {}  # (scheme, host, port) -> idle connections
+        self._lock = threading.Lock()
+
+    def get(self, url: str, etag: str = None, modified: str = None) -> FeedResponse:
+        """
+        Downloads a feed with a conditional GET, following up to MAX_REDIRECTS redirects.
+
+        Raises:
+            FeedTooLarge: The feed is larger than `max_bytes`.
+            TimeoutError: Connecting, a read or the whole download took too long.
+            OSError, http.client.HTTPException: The request failed.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return self._read_file(parts.path if parts.scheme == "file" else url)
+
+        deadline = time.monotonic() + self.total_timeout
+        headers = {"User-Agent": self.user_agent, "Accept-Encoding": self.accept_encoding}
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+        received = 0
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body, wire_bytes = self._request(url, headers, deadline)
+            received += wire_bytes
+            if status not in REDIRECT_STATUSES or "location" not in response_headers:
+                return FeedResponse(status, response_headers, body, received, url)
+            url = urljoin(url, response_headers["location"])
+            if urlsplit(url).scheme not in ("http", "https"):
+                raise http.client.HTTPException(f"Refusing to follow redirect to {url}")
+        raise http.client.HTTPException(f"Too many redirects, last to {url}")
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _request(self, url, headers, deadline):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        connection, reused = self._checkout(key)
+        try:
+            try:
+                connection.request("GET", path, headers={**headers, "Host": parts.netloc})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed the idle connection in the meantime: retry once on a new one
+                connection.close()
+                connection, reused = self._checkout(key, fresh=True)
+                connection.request("GET", path, headers={**headers, "Host": parts.netloc})
+                response = connection.getresponse()
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+            body, wire_bytes = self._read_body(response, response_headers, deadline)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(key, connection)
+        return response.status, response_headers, body, wire_bytes
+
+    def _read_body(self, response, headers, deadline):
+        length = headers.get("content-length", "")
+        if length.isdigit() and int(length) > self.max_bytes and not headers.get("content-encoding"):
+            raise FeedTooLarge(f"Feed is {length} bytes, the limit is {self.max_bytes}")
+        decoder = _Decoder(headers.get("content-encoding", "").strip().lower())
+        chunks, size, wire_bytes = [], 0, 0
+        while True:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Download took longer than {self.total_timeout}s")
+            data = response.read1(CHUNK_SIZE)
+            if not data:
+                break
+            wire_bytes += len(data)
+            decoded = decoder.decode(data, self.max_bytes - size)
+            size += len(decoded)
+            if size > self.max_bytes:
+                raise FeedTooLarge(f"Feed is larger than {self.max_bytes} bytes")
+            chunks.append(decoded)
+        response.close()  # read1 doesn't release a drained response, which would block the connection
+        return b"".join(chunks), wire_bytes
+
+    def _checkout(self, key, fresh: bool = False):
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(host, port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return connection, False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _read_file(self, path: str) -> FeedResponse:
+        with open(path, "rb") as f:
+            body = f.read(self.max_bytes + 1)
+        if len(body) > self.max_bytes:
+            raise FeedTooLarge(f"Feed is larger than {self.max_bytes} bytes")
+        return FeedResponse(200, {}, body, len(body), path)
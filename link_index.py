@@ -0,0 +1,178 @@
+import hashlib
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableSet, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from; they never change the article
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "yclid"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_link(link: str) -> str:
+    """
+    Returns the form of an article link used for deduplication, so that variants of
+    the same URL count as one article: http and https are treated alike, the host is
+    lowercased, default ports, fragments, utm_* and other tracking parameters are
+    dropped, and a trailing slash on the path is removed.
+
+    Anything that isn't an http(s) URL is returned stripped but otherwise unchanged.
+    """
+    link = link.strip()
+    # Fast path for the common shape, scheme://host/path without query, fragment, port
+    # or uppercase host, which only needs the scheme and trailing slash normalized
+    if link.startswith("https://"):
+        rest = link[8:]
+    elif link.startswith("http://"):
+        rest = link[7:]
+    else:
+        rest = None
+    if rest is not None and "?" not in rest and "#" not in rest:
+        slash = rest.find("/")
+        host = rest[:slash]
+        if slash > 0 and host.islower() and ":" not in host and "@" not in host:
+            path = rest[slash:].rstrip("/") or "/"
+            return f"https://{host}{path}"
+
+    try:
+        parts = urlsplit(link)
+        port = parts.port
+    except ValueError:
+        return link
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return link
+
+    netloc = parts.hostname
+    if parts.username or parts.password:
+        netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc += f":{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS]
+    return urlunsplit(("https", netloc, path, urlencode(query), ""))
+
+
+def link_fingerprint(link: str) -> int:
+    """
+    Returns a signed 64-bit hash of the canonical link (fits SQLite's INTEGER and
+    array typecode 'q'). At a million links the chance of any collision is about 3e-8.
+    """
+    digest = hashlib.blake2b(canonical_link(link).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class FingerprintSet(MutableSet):
+    """
+    Base for sets of links stored as fingerprints. Membership tests accept either a link
+    (which is canonicalized and hashed) or a fingerprint; iteration yields fingerprints.
+    Comparing with a plain set of links checks that both hold the same articles.
+    """
+
+    @staticmethod
+    def key(item) -> int:
+        return item if isinstance(item, int) else link_fingerprint(item)
+
+    def __eq__(self, other):
+        if not isinstance(other, Set):
+            return NotImplemented
+        return len(self) == len(other) and all(item in self for item in other)
+
+    __hash__ = None
+
+
+class FingerprintIndex(FingerprintSet):
+    """
+    Compact in-memory set of sent links with the time each was first seen.
+
+    The history is kept in two parallel arrays sorted by fingerprint, 16 bytes per link,
+    and looked up by binary search. Links added since the last `compact` sit in a small
+    dict; `compact` (called before eviction and saving) merges them in.
+    """
+
+    def __init__(self, fingerprints: array = None, first_seen: array = None):
+        self.fingerprints = fingerprints if fingerprints is not None else array('q')
+        self.first_seen = first_seen if first_seen is not None else array('d')
+        self.pending = {}  # fingerprint -> first_seen
+
+    @classmethod
+    def from_items(cls, items) -> "FingerprintIndex":
+        """
+        Builds an index from (link or fingerprint, first_seen) pairs in any order.
+        """
+        merged = {}
+        for item, first_seen in items:
+            merged.setdefault(cls.key(item), first_seen)
+        keys = sorted(merged)
+        return cls(array('q', keys), array('d', (merged[key] for key in keys)))
+
+    def _position(self, fingerprint: int):
+        i = bisect_left(self.fingerprints, fingerprint)
+        return i if i < len(self.fingerprints) and self.fingerprints[i] == fingerprint else None
+
+    def __contains__(self, item):
+        fingerprint = self.key(item)
+        return fingerprint in self.pending or self._position(fingerprint) is not None
+
+    def __iter__(self):
+        yield from self.fingerprints
+        yield from self.pending
+
+    def __len__(self):
+        return len(self.fingerprints) + len(self.pending)
+
+    def add(self, link, now: float = None):
+        fingerprint = self.key(link)
+        if fingerprint not in self:
+            self.pending[fingerprint] = time.time() if now is None else now
+
+    def discard(self, link):
+        fingerprint = self.key(link)
+        if self.pending.pop(fingerprint, None) is None:
+            i = self._position(fingerprint)
+            if i is not None:
+                del self.fingerprints[i]
+                del self.first_seen[i]
+
+    def items(self):
+        """
+        Yields (fingerprint, first_seen) pairs.
+        """
+        yield from zip(self.fingerprints, self.first_seen)
+        yield from self.pending.items()
+
+    def compact(self):
+        """
+        Merges the pending links into the sorted arrays.
+        """
+        if self.pending:
+            merged = FingerprintIndex.from_items(self.items())
+            self.fingerprints, self.first_seen = merged.fingerprints, merged.first_seen
+            self.pending = {}
+
+    def evict(self, retention, now: float = None) -> int:
+        """
+        Drops the links that fall outside the retention policy (see state_store.Retention).
+
+        Returns:
+            The number of evicted links.
+        """
+        now = time.time() if now is None else now
+        self.compact()
+        cutoff = retention.cutoff(now)
+        if retention.max_entries is not None and len(self) > retention.max_entries:
+            # Keep the max_entries most recent links
+            newest = sorted(self.first_seen)[len(self) - retention.max_entries]
+            cutoff = newest if cutoff is None else max(cutoff, newest)
+        if cutoff is None:
+            return 0
+        keep = [i for i, first_seen in enumerate(self.first_seen) if first_seen >= cutoff]
+        if retention.max_entries is not None and len(keep) > retention.max_entries:
+            keep = keep[len(keep) - retention.max_entries:]  # Ties at the cutoff
+        evicted = len(self) - len(keep)
+        if evicted:
+            self.fingerprints = array('q', (self.fingerprints[i] for i in keep))
+            self.first_seen = array('d', (self.first_seen[i] for i in keep))
+        return evicted
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "awwwwards_bot"
+
+# Help texts for the Prometheus output; counters not listed here get a generic one
+COUNTER_HELP = {
+    "feeds_fetched": "Feeds requested in the last run.",
+    "feeds_not_modified": "Feeds that answered 304 Not Modified in the last run.",
+    "bytes_received": "Feed bytes downloaded in the last run.",
+    "entries_parsed": "Feed entries turned into articles in the last run.",
+    "new_articles": "New articles found in the last run.",
+    "articles_sent": "Articles delivered to Telegram in the last run.",
+    "articles_failed": "Articles that failed to deliver in the last run.",
+    "articles_claimed_elsewhere": "New articles skipped in the last run because another worker claimed them.",
+    "claim_failures": "Claims of new articles in the shared state that failed in the last run.",
+    "articles_pushed": "Articles received from WebSub hubs in the last run.",
+    "articles_enriched": "Article pages fetched for a preview image and reading time in the last run.",
+    "enrichment_cache_hits": "New articles enriched from the cache in the last run.",
+    "enrichment_failures": "Article pages that could not be fetched for enrichment in the last run.",
+}
+
+
+class PipelineMetrics:
+    """
+    Collects the numbers for one pipeline run: the wall time of each stage, counters
+    (bytes, entries, articles) and observed values such as Telegram call latencies.
+
+    The result can be logged, or written as JSON or in the Prometheus text format (for
+    node_exporter's textfile collector), chosen by the file extension in `write`.
+    """
+
+    def __init__(self):
+        self.stages = {}        # stage -> seconds
+        self.counters = {}      # name -> value
+        self.observations = {}  # name -> list of values
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the enclosed block and adds it to the stage's total.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def timed(self, name: str, iterable):
+        """
+        Yields from `iterable`, adding only the time spent producing each item to the
+        stage, not the time the caller spends on it in between.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_time(self, name: str, seconds: float):
+        """
+        Adds time measured elsewhere, e.g. in worker threads, to a stage.
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add(self, name: str, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, values):
+        self.observations.setdefault(name, []).extend(values)
+
+    @staticmethod
+    def _summary(values) -> dict:
+        values = sorted(values)
+
+        def quantile(q):
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        summary = {"count": len(values), "sum": sum(values)}
+        if values:
+            summary.update({"0.5": quantile(0.5), "0.9": quantile(0.9), "0.99": quantile(0.99)})
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.started,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "observations": {name: self._summary(values) for name, values in self.observations.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_duration_seconds Wall time of each pipeline stage in the last run.",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds gauge",
+        ]
+        for stage, seconds in self.stages.items():
+            lines.append(f'{METRIC_PREFIX}_stage_duration_seconds{{stage="{stage}"}} {seconds:.6f}')
+        for name, value in self.counters.items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {COUNTER_HELP.get(name, name.replace('_', ' ') + '.')}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        for name, values in self.observations.items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            summary = self._summary(values)
+            lines.append(f"# TYPE {metric} summary")
+            for q in ("0.5", "0.9", "0.99"):
+                if q in summary:
+                    lines.append(f'{metric}{{quantile="{q}"}} {summary[q]:.6f}')
+            lines.append(f"{metric}_sum {summary['sum']:.6f}")
+            lines.append(f"{metric}_count {summary['count']}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath: str):
+        """
+        Writes the metrics to `filepath`: Prometheus text format for .prom files, JSON
+        otherwise. The file is replaced atomically, so a scraper never reads half of it.
+        """
+        if filepath.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=4) + "\n"
+        directory = os.path.dirname(os.path.abspath(filepath))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, filepath)
+        except OSError as e:
+            logger.error(f"Could not write metrics to '{filepath}': {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def log_summary(self):
+        stages = ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in self.stages.items())
+        logger.info(f"Stage timings: {stages}")
+        if self.counters:
+            logger.info("Counters: " + ", ".join(f"{name}={value}" for name, value in self.counters.items()))
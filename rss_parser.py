@@ -1,22 +1,386 @@
-import feedparser
+import calendar
+import copy
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
 
-def fetch_rss_feed(url):
+from feed_backends import BACKENDS, UnsupportedFeed
+from feed_transport import FeedHTTPError, FeedTransport, parse_link_header
+
+logger = logging.getLogger(__name__)
+
+# Concurrency limits for fetch_many
+MAX_CONCURRENT_FETCHES = 8  # Feeds fetched at the same time overall
+MAX_FETCHES_PER_HOST = 2    # Feeds fetched at the same time from one host
+
+# Entries taken from a feed that has no watermark yet (first run), so it doesn't flood the chat
+INITIAL_ENTRIES = 5
+
+# Shared by every fetch of the process, so feeds of one host reuse keep-alive connections.
+# feedparser is only imported once a feed has to be parsed with it (see feed_backends).
+TRANSPORT = FeedTransport(user_agent="awwwwards-bot")
+
+class FeedCache:
+    """
+    Remembers per-feed state between runs: the ETag / Last-Modified validators for
+    conditional GET requests, the watermark of the newest processed entry and the
+    WebSub hub the feed advertises.
+
+    The state is a plain dict keyed by feed URL so it can be persisted as JSON next to
+    the sent-articles state. `hits` counts 304 Not Modified responses, `misses` counts
+    feeds that had to be downloaded and parsed again, `bytes_received`, `entries_parsed`
+    and `parse_seconds` what those downloads amounted to.
+    """
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_received = 0  # On the wire, before decompression
+        self.entries_parsed = 0
+        self.parse_seconds = 0.0  # Summed over the feeds, which may be parsed concurrently
+        self.dirty = False  # True once the state differs from what was loaded
+        self._lock = threading.Lock()
+
+    def validators(self, url):
+        """
+        Returns the (etag, modified) validators stored for a feed, or (None, None).
+        """
+        entry = self.state.get(url, {})
+        return entry.get("etag"), entry.get("modified")
+
+    def record_not_modified(self, url):
+        with self._lock:
+            self.hits += 1
+
+    def record_modified(self, url, content_length=0):
+        with self._lock:
+            self.misses += 1
+            self.bytes_received += content_length
+
+    def record_validators(self, url, etag, modified):
+        """
+        Stores the validators of a downloaded feed, once it was parsed: a feed that failed
+        to parse is downloaded in full again instead of answering 304.
+        """
+        with self._lock:
+            entry = self.state.setdefault(url, {})
+            if entry.get("etag") != etag or entry.get("modified") != modified:
+                entry["etag"] = etag
+                entry["modified"] = modified
+                self.dirty = True
+
+    def watermark(self, url):
+        """
+        Returns the watermark stored for a feed ({"id": ..., "published": ...}), or None.
+        """
+        return self.state.get(url, {}).get("watermark")
+
+    def record_watermark(self, url, watermark):
+        with self._lock:
+            entry = self.state.setdefault(url, {})
+            if entry.get("watermark") != watermark:
+                entry["watermark"] = watermark
+                self.dirty = True
+
+    def record_hints(self, url, hints):
+        """
+        Stores the feed's polling hints as read by the parser: "ttl", its <ttl> in minutes,
+        and "skip_hours", its <skipHours> (UTC). Hints missing from `hints` weren't read
+        and keep their stored value.
+        """
+        with self._lock:
+            entry = self.state.setdefault(url, {})
+            for name in ("ttl", "skip_hours"):
+                if name in hints and entry.get(name) != hints[name]:
+                    entry[name] = hints[name]
+                    self.dirty = True
+
+    def hub(self, url):
+        """
+        Returns the (hub, topic) the feed advertised for WebSub when it was last
+        downloaded, hub being None if it has none, or None if that isn't known yet.
+        """
+        entry = self.state.get(url, {})
+        return (entry["hub"], entry.get("topic")) if "hub" in entry else None
+
+    def record_hub(self, url, hub, topic):
+        with self._lock:
+            entry = self.state.setdefault(url, {})
+            if "hub" not in entry or entry["hub"] != hub or entry.get("topic") != topic:
+                entry["hub"] = hub
+                entry["topic"] = topic
+                self.dirty = True
+
+    def record_entries(self, count, parse_seconds=0.0):
+        with self._lock:
+            self.entries_parsed += count
+            self.parse_seconds += parse_seconds
+
+    def snapshot(self):
+        """
+        Returns a copy of the state, for `restore`.
+        """
+        with self._lock:
+            return copy.deepcopy(self.state), self.dirty
+
+    def restore(self, snapshot):
+        """
+        Puts the state of a `snapshot` back, in place since the daemon's scheduler shares
+        the dict. Validators and watermarks recorded since then are forgotten, so those
+        feeds are downloaded and read again by their next fetch.
+        """
+        state, dirty = snapshot
+        with self._lock:
+            self.state.clear()
+            self.state.update(state)
+            self.dirty = dirty
+
+    def stats(self):
+        """
+        Returns the hit/miss counters as a dict.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+def _entry_watermark(entry):
+    """
+    Builds the watermark for a feed entry: its guid (falling back to the link) and its
+    publication time as a UTC timestamp, if the feed provides one.
+    """
+    published = getattr(entry, "published_parsed", None) or getattr(entry, "updated_parsed", None)
+    return {
+        "id": getattr(entry, "id", None) or entry.link,
+        "published": calendar.timegm(published) if published else None,
+    }
+
+def _is_at_or_below(entry_watermark, watermark):
+    """
+    Tells whether an entry was processed by an earlier run: it is the watermark entry, or
+    strictly older. Entries published in the same second as the watermark entry (several
+    posts at once, date-only feeds) are taken, the sent-articles dedup drops repeats.
+    """
+    if entry_watermark["id"] == watermark.get("id"):
+        return True
+    published, watermark_published = entry_watermark["published"], watermark.get("published")
+    return published is not None and watermark_published is not None and published < watermark_published
+
+def _select_articles(entries, watermark, track_watermark):
+    """
+    Turns feed entries (newest first) into article dicts, stopping at the first entry at
+    or below the watermark (see _is_at_or_below), or after INITIAL_ENTRIES when there is
+    no watermark. Entries without a link can't be sent and are skipped; a missing title
+    or summary is empty.
+
+    Returns:
+        (articles, newest), where newest is the watermark of the first entry taken, if
+        `track_watermark` is set.
+    """
     articles = []
+    newest = None
+    for entry in entries:
+        if watermark is None and len(articles) >= INITIAL_ENTRIES:
+            break
+        if not getattr(entry, "link", None):
+            continue
+        if track_watermark:
+            entry_watermark = _entry_watermark(entry)
+            if watermark is not None and _is_at_or_below(entry_watermark, watermark):
+                break  # Everything from here on was processed by an earlier run
+            newest = newest or entry_watermark
+        articles.append({
+            "title": getattr(entry, "title", ""),
+            "link": entry.link,
+            "summary": getattr(entry, "summary", "")
+        })
+    return articles, newest
+
+def parse_feed(body: bytes, headers: dict = None, watermark=None, track_watermark=True,
+               parser: str = "feedparser") -> dict:
+    """
+    Parses a downloaded feed. Runs in a parse pool worker, so it takes and returns only
+    small picklable values: the raw bytes go in, the article dicts come out.
+
+    Args:
+        body: The feed document.
+        headers: The HTTP response headers (lowercase keys), used to detect the encoding.
+        watermark: The feed's watermark, see _select_articles.
+        track_watermark: Whether to compute the new watermark.
+        parser: The backend to parse with (see feed_backends.BACKENDS). Feeds the backend
+            can't read, malformed XML in particular, are parsed again with feedparser.
+
+    Returns:
+        A dict with "articles", "newest" (the new watermark or None), "hints" (the
+        polling hints) and "links" (the feed's WebSub links); see ParsedFeed for the
+        last two, which leave out what wasn't read.
+    """
+    backend = BACKENDS[parser]
+    if backend.name != "feedparser":
+        try:
+            feed = backend.parse(body, headers)
+            articles, newest = _select_articles(feed.entries, watermark, track_watermark)
+            return {"articles": articles, "newest": newest, "hints": feed.hints(), "links": feed.links()}
+        except (ET.ParseError, UnsupportedFeed) as e:
+            logger.debug(f"{backend.name} parser gave up, falling back to feedparser: {e}")
+    feed = BACKENDS["feedparser"].parse(body, headers)
+    articles, newest = _select_articles(feed.entries, watermark, track_watermark)
+    return {"articles": articles, "newest": newest, "hints": feed.hints(), "links": feed.links()}
+
+def download_feed(url, etag=None, modified=None, transport=None):
+    """
+    Downloads a feed with a conditional GET through the feed transport (timeouts, size
+    limit, compression, pooled connections; see feed_transport.FeedTransport).
+
+    Returns:
+        A feed_transport.FeedResponse; its body is empty for 304.
+
+    Raises:
+        FeedHTTPError: The server answered with an error status.
+    """
+    response = (transport or TRANSPORT).get(url, etag, modified)
+    if response.status != 304 and not 200 <= response.status < 300:
+        raise FeedHTTPError(response.status, url)
+    return response
+
+def make_parse_pool(workers: int):
+    """
+    Creates the process pool that fetch_rss_feed hands downloaded feeds to, or returns
+    None if `workers` is 0 (parse in the fetching threads). Workers are started with
+    forkserver (spawn where that isn't available), never by forking the threaded parent.
+    """
+    if workers <= 0:
+        return None
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def fetch_rss_feed(url, cache=None, parse_pool=None, parser="feedparser", transport=None):
+    """
+    Fetches a feed and returns its new articles as dicts with 'title', 'link' and 'summary'.
+
+    The feed is downloaded by the feed transport, so a hung server times out and an
+    oversized feed is cut off instead of stalling or bloating the run, and the parser
+    only gets the downloaded bytes.
+
+    With a FeedCache, the stored validators are sent so an unchanged feed costs a single
+    304 response, and entries are processed newest-first until the feed's watermark entry
+    or an older one, so the work scales with the number of new items. Without a
+    watermark (first run, or no cache) only the latest INITIAL_ENTRIES are returned.
+
+    With a parse pool (see make_parse_pool), the bytes are parsed in a worker process,
+    so parsing many feeds uses all cores instead of taking turns on the GIL.
+
+    Args:
+        url: The feed URL (or a local path).
+        cache: Optional FeedCache holding the per-feed state; updated in place.
+        parse_pool: Optional concurrent.futures executor to run parse_feed in.
+        parser: The parser backend, see feed_backends.BACKENDS.
+        transport: Optional FeedTransport, the shared TRANSPORT by default.
+
+    Returns:
+        A list of article dicts, or an empty list on error or 304 Not Modified.
+    """
     try:
-        feed = feedparser.parse(url)
-        for entry in feed.entries[:5]:  # Последние 5 записей
-            articles.append({
-                "title": entry.title,
-                "link": entry.link,
-                "summary": entry.summary
-            })
+        etag, modified = cache.validators(url) if cache is not None else (None, None)
+        response = download_feed(url, etag, modified, transport)
+        headers = response.headers
+        if cache is not None:
+            if response.status == 304:
+                cache.record_not_modified(url)
+                return []
+            cache.record_modified(url, response.bytes_received)
+        elif response.status == 304:
+            return []
+        watermark = cache.watermark(url) if cache is not None else None
+        args = (response.body, headers, watermark, cache is not None, parser)
+        started = time.perf_counter()
+        result = parse_pool.submit(parse_feed, *args).result() if parse_pool is not None else parse_feed(*args)
+        parse_seconds = time.perf_counter() - started
+        if cache is not None:
+            cache.record_validators(url, headers.get("etag"), headers.get("last-modified"))
+            cache.record_hints(url, result["hints"])
+            # The WebSub hub, from the Link headers or else the feed (see websub.py), unless
+            # the parser stopped before it could tell
+            links = {**result["links"], **parse_link_header(headers.get("link", ""))}
+            if "hub" in links:
+                _, topic = cache.hub(url) or (None, None)
+                cache.record_hub(url, links["hub"], links.get("self", topic))
+            if result["newest"] is not None:
+                cache.record_watermark(url, result["newest"])
+            cache.record_entries(len(result["articles"]), parse_seconds)
+        return result["articles"]
     except Exception as e:
         print(f"Error fetching RSS feed: {e}")
-        # articles is already []
-    return articles
+        return []
+
+def fetch_many(urls, fetch=fetch_rss_feed, max_workers=MAX_CONCURRENT_FETCHES,
+               per_host=MAX_FETCHES_PER_HOST):
+    """
+    Fetches several feeds concurrently and yields the results as each feed finishes.
+
+    At most `max_workers` feeds are in flight overall and at most `per_host` of them
+    target the same host. Feeds waiting on a busy host don't occupy a worker, so one
+    slow host can't hold up feeds from the others.
+
+    Args:
+        urls: Iterable of feed URLs. Duplicates are fetched once.
+        fetch: Callable taking a URL and returning a list of articles.
+        max_workers: Global cap on concurrent fetches.
+        per_host: Cap on concurrent fetches against a single host.
+
+    Yields:
+        (url, articles) tuples in completion order. A feed whose fetch raised
+        yields an empty list.
+    """
+    if max_workers < 1 or per_host < 1:
+        raise ValueError("max_workers and per_host must be at least 1")
+
+    # Group URLs by host, keeping the caller's order within each host
+    queues = {}
+    for url in dict.fromkeys(urls):
+        queues.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+    if not queues:
+        return
+
+    in_flight_per_host = dict.fromkeys(queues, 0)
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_ready():
+            # Round-robin over hosts so a host with many feeds doesn't starve the others
+            submitted = True
+            while submitted and len(futures) < max_workers:
+                submitted = False
+                for host, queue in queues.items():
+                    if len(futures) >= max_workers:
+                        break
+                    if queue and in_flight_per_host[host] < per_host:
+                        url = queue.pop(0)
+                        futures[executor.submit(fetch, url)] = (host, url)
+                        in_flight_per_host[host] += 1
+                        submitted = True
+
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                host, url = futures.pop(future)
+                in_flight_per_host[host] -= 1
+                try:
+                    articles = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching RSS feed '{url}': {e}")
+                    articles = []
+                submit_ready()
+                yield url, articles
 
 if __name__ == "__main__":
     rss_url = "https://www.awwwards.com/blog/feed/"
     articles = fetch_rss_feed(rss_url)
     for article in articles:
-        print(f"{article['title']} - {article['link']}")
\ No newline at end of file
+        print(f"{article['title']} - {article['link']}")
@@ -0,0 +1,59 @@
+import glob
+import hashlib
+import os
+import re
+
+from link_index import canonical_link
+
+
+def _weight(url: str, index: int) -> int:
+    digest = hashlib.blake2b(f"{index}:{canonical_link(url)}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_of(url: str, count: int) -> int:
+    """
+    Returns the worker (0 to count - 1) that owns a feed.
+
+    Uses rendezvous hashing: every worker gets a pseudo-random weight for the feed and the
+    highest one wins. The choice only depends on the URL (compared in canonical form), so
+    every worker computes the same split without talking to the others, and going from n
+    to n + 1 workers moves only the ~1/(n + 1) of the feeds that the new worker wins.
+    """
+    return max(range(count), key=lambda index: _weight(url, index))
+
+
+def shard_urls(urls, index: int, count: int) -> list:
+    """
+    Returns the feeds owned by worker `index` of `count`, in their original order.
+    """
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid worker {index} of {count}")
+    if count == 1:
+        return list(urls)
+    return [url for url in urls if shard_of(url, count) == index]
+
+
+def shard_path(filepath: str, index: int) -> str:
+    """
+    Returns worker `index`'s own copy of a state file, e.g. outbox.2.json; worker 0 keeps
+    the plain name. The name doesn't depend on the worker count, so a resize only leaves
+    behind the files of the workers it removes (see stray_shard_paths).
+    """
+    if index == 0:
+        return filepath
+    root, extension = os.path.splitext(filepath)
+    return f"{root}.{index}{extension}"
+
+
+def stray_shard_paths(filepath: str, count: int) -> list:
+    """
+    Returns the existing copies of a state file that none of `count` workers uses: those
+    of workers removed by a resize, and those named after the worker count
+    (outbox.1-of-3.json) by earlier versions.
+    """
+    root, extension = os.path.splitext(filepath)
+    live = {shard_path(filepath, index) for index in range(count)}
+    pattern = re.compile(re.escape(root) + r"\.\d+(-of-\d+)?" + re.escape(extension))
+    return sorted(path for path in glob.glob(glob.escape(root) + ".*" + glob.escape(extension))
+                  if pattern.fullmatch(path) and path not in live)
@@ -0,0 +1,528 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from array import array
+from itertools import islice
+
+from link_index import FingerprintIndex, FingerprintSet, canonical_link, link_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+SECONDS_PER_DAY = 24 * 60 * 60
+SQLITE_BUSY_TIMEOUT = 30.0  # Seconds to wait for another process's write transaction
+
+
+class Retention:
+    """
+    Eviction policy for sent article links, applied when the state is saved (also used
+    by the enrichment cache).
+
+    Args:
+        max_age_days: Drop links first seen more than this many days ago (None keeps all).
+        max_entries: Keep at most this many of the most recently seen links (None keeps all).
+    """
+
+    def __init__(self, max_age_days: float = None, max_entries: int = None):
+        self.max_age_days = max_age_days or None
+        self.max_entries = max_entries or None
+
+    def cutoff(self, now: float):
+        """
+        Returns the first-seen timestamp below which links are evicted, or None.
+        """
+        return now - self.max_age_days * SECONDS_PER_DAY if self.max_age_days else None
+
+
+class FileLock:
+    """
+    Exclusive inter-process lock on `<filepath>.lock`, held while the context is active.
+
+    Uses POSIX record locks (lockf), which also work across hosts on a shared NFS mount.
+    The lock is released by the OS if the holder dies, so a crash never leaves it stuck.
+    """
+
+    def __init__(self, filepath: str):
+        self.lock_path = filepath + ".lock"
+        self._file = None
+
+    def __enter__(self):
+        import fcntl
+
+        self._file = open(self.lock_path, "a")
+        fcntl.lockf(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import fcntl
+
+        fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class JsonStateBackend:
+    """
+    Stores the sent articles in a JSON file as two parallel lists, the links'
+    fingerprints (see link_index) and their first-seen timestamps, and loads them into a
+    FingerprintIndex. The older formats, a {link: first_seen} object and a plain list of
+    links, are still read; links from a plain list count as first seen at load time.
+
+    Loading parses the whole file and saving rewrites it, so both are O(total history).
+    Writes go to a temporary file that is atomically renamed over the old one, so a crash
+    mid-write leaves the previous state intact.
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, filepath: str, retention: Retention = None):
+        self.filepath = filepath
+        self.retention = retention or Retention()
+
+    def load(self) -> FingerprintIndex:
+        try:
+            return self._read()
+        except FileNotFoundError:
+            logger.warning(f"Sent articles file '{self.filepath}' not found. Starting with an empty set.")
+            return FingerprintIndex()
+        except json.JSONDecodeError:
+            logger.warning(f"Error decoding JSON from '{self.filepath}'. Starting with an empty set.")
+            return FingerprintIndex()
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while loading sent articles from '{self.filepath}': {e}")
+            return FingerprintIndex()
+
+    def save(self, article_links, now: float = None):
+        try:
+            self._write(article_links, now)
+        except IOError:
+            logger.error(f"Could not write sent articles to file '{self.filepath}'.")
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while saving sent articles to '{self.filepath}': {e}")
+
+    def _read(self) -> FingerprintIndex:
+        with open(self.filepath, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data.get("version") == self.FORMAT_VERSION:
+            fingerprints = array('q', data["fingerprints"])
+            if all(a < b for a, b in zip(fingerprints, islice(fingerprints, 1, None))):
+                # Written by save, already sorted and unique: no need to rebuild
+                return FingerprintIndex(fingerprints, array('d', data["first_seen"]))
+            return FingerprintIndex.from_items(zip(data["fingerprints"], data["first_seen"]))
+        if isinstance(data, dict):
+            return FingerprintIndex.from_items(data.items())
+        now = time.time()
+        return FingerprintIndex.from_items((link, now) for link in data)
+
+    def _write(self, article_links, now: float = None):
+        if not isinstance(article_links, FingerprintIndex):
+            links = FingerprintIndex()
+            for link in article_links:
+                links.add(link, now)
+            article_links = links
+        evicted = article_links.evict(self.retention, now)
+        if evicted:
+            logger.info(f"Evicted {evicted} sent articles past the retention limit.")
+        write_json_atomic(self.filepath, {"version": self.FORMAT_VERSION,
+                                          "fingerprints": article_links.fingerprints.tolist(),
+                                          "first_seen": article_links.first_seen.tolist()})
+        logger.info(f"Sent articles saved to '{self.filepath}'.")
+
+    def claim(self, links, now: float = None) -> list:
+        """
+        Records links as sent on behalf of one of several workers sharing the file.
+
+        The file is re-read, merged and saved under a FileLock, so concurrent workers
+        never overwrite each other's links and each link is claimed by exactly one of
+        them. Costs a load and a save of the whole history.
+
+        Unlike `load` and `save`, errors are raised: the shared history is left as it was
+        instead of being replaced by a partial one, and nothing counts as claimed.
+
+        Returns:
+            The links that weren't recorded yet, i.e. the ones this worker now owns.
+        """
+        with FileLock(self.filepath):
+            try:
+                article_links = self._read()
+            except FileNotFoundError:
+                article_links = FingerprintIndex()
+            claimed = []
+            for link in links:
+                if link not in article_links:  # Also skips variants of a link claimed just before
+                    article_links.add(link, now)
+                    claimed.append(link)
+            self._write(article_links, now)
+        return claimed
+
+
+class SqliteSentArticles(FingerprintSet):
+    """
+    Set-like view of the link fingerprints stored in a SQLite database.
+
+    Membership checks are primary-key lookups and `add` only buffers the fingerprint in
+    memory, so a run costs O(new articles) no matter how long the history is. The
+    buffered fingerprints are written by `flush` (called from SqliteStateBackend.save).
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self.pending = {}  # fingerprint -> first_seen
+
+    def __contains__(self, item):
+        fingerprint = self.key(item)
+        if fingerprint in self.pending:
+            return True
+        row = self._conn.execute("SELECT 1 FROM sent_fingerprints WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for (fingerprint,) in self._conn.execute("SELECT fingerprint FROM sent_fingerprints"):
+            if fingerprint not in self.pending:
+                yield fingerprint
+        yield from self.pending
+
+    def __len__(self):
+        stored = self._conn.execute("SELECT COUNT(*) FROM sent_fingerprints").fetchone()[0]
+        return stored + len(self.pending)
+
+    def add(self, link, now: float = None):
+        if link not in self:
+            self.pending[self.key(link)] = time.time() if now is None else now
+
+    def discard(self, link):
+        fingerprint = self.key(link)
+        self.pending.pop(fingerprint, None)
+        with self._conn:
+            self._conn.execute("DELETE FROM sent_fingerprints WHERE fingerprint = ?", (fingerprint,))
+
+    def flush(self, retention: Retention = None, now: float = None) -> int:
+        """
+        Inserts the buffered fingerprints and applies the retention policy in a single transaction.
+
+        Returns:
+            The number of evicted links.
+        """
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO sent_fingerprints (fingerprint, first_seen) VALUES (?, ?)",
+                                   self.pending.items())
+            evicted = evict_sqlite(self._conn, retention, now) if retention else 0
+        self.pending.clear()
+        return evicted
+
+
+class SqliteStateBackend:
+    """
+    Stores the fingerprints of the sent links (see link_index) in SQLite, as the integer
+    primary key, with an indexed first_seen timestamp so retention deletes are range scans.
+
+    On first use the links from the legacy JSON file (same path with a .json extension,
+    if it exists) are imported once, in the same transaction that creates the table.
+    Databases from before fingerprints, which kept the full links in a sent_articles
+    table, are converted the same way.
+    """
+
+    def __init__(self, filepath: str, legacy_json_path: str = None, retention: Retention = None):
+        self.filepath = filepath
+        self.legacy_json_path = legacy_json_path or os.path.splitext(filepath)[0] + ".json"
+        self.retention = retention or Retention()
+
+    def connect(self) -> sqlite3.Connection:
+        # Concurrent workers wait for each other's write transactions instead of failing
+        conn = sqlite3.connect(self.filepath, timeout=SQLITE_BUSY_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # Only one process at a time creates or migrates the table
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "sent_fingerprints" not in tables:
+                conn.execute(
+                    "CREATE TABLE sent_fingerprints (fingerprint INTEGER PRIMARY KEY, first_seen REAL NOT NULL)"
+                )
+                if "sent_articles" in tables:
+                    self._migrate_link_table(conn)
+                else:
+                    self._migrate_legacy_json(conn)
+            conn.execute("CREATE INDEX IF NOT EXISTS sent_fingerprints_first_seen ON sent_fingerprints (first_seen)")
+        return conn
+
+    def _migrate_link_table(self, conn):
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sent_articles)")}
+        # Databases created before retention existed have no first_seen: their links count as seen now
+        first_seen = "first_seen" if "first_seen" in columns else repr(time.time())
+        rows = conn.execute(f"SELECT link, {first_seen} FROM sent_articles").fetchall()
+        conn.executemany("INSERT OR IGNORE INTO sent_fingerprints (fingerprint, first_seen) VALUES (?, ?)",
+                         ((link_fingerprint(link), seen) for link, seen in rows))
+        conn.execute("DROP TABLE sent_articles")
+        logger.info(f"Converted the sent articles in '{self.filepath}' to fingerprints.")
+
+    def _migrate_legacy_json(self, conn):
+        if not os.path.exists(self.legacy_json_path):
+            return
+        links = JsonStateBackend(self.legacy_json_path).load()
+        conn.executemany("INSERT OR IGNORE INTO sent_fingerprints (fingerprint, first_seen) VALUES (?, ?)",
+                         links.items())
+        logger.info(f"Migrated {len(links)} sent articles from '{self.legacy_json_path}' to '{self.filepath}'.")
+
+    def load(self) -> SqliteSentArticles:
+        return SqliteSentArticles(self.connect())
+
+    def save(self, article_links, now: float = None):
+        try:
+            if isinstance(article_links, SqliteSentArticles):
+                evicted = article_links.flush(self.retention, now)
+            else:
+                conn = self.connect()
+                try:
+                    links = SqliteSentArticles(conn)
+                    for link in article_links:
+                        links.add(link, now)
+                    evicted = links.flush(self.retention, now)
+                finally:
+                    conn.close()
+            if evicted:
+                logger.info(f"Evicted {evicted} sent articles past the retention limit.")
+            logger.info(f"Sent articles saved to '{self.filepath}'.")
+        except sqlite3.Error as e:
+            logger.error(f"Could not write sent articles to database '{self.filepath}': {e}")
+
+    def claim(self, links, now: float = None) -> list:
+        """
+        Records links as sent on behalf of one of several workers sharing the database.
+
+        Each link is inserted in one write transaction (BEGIN IMMEDIATE), and the links
+        whose insert didn't hit an existing row are this worker's. Retention is applied in
+        the same transaction.
+
+        Returns:
+            The links that weren't recorded yet, i.e. the ones this worker now owns.
+        """
+        now = time.time() if now is None else now
+        conn = self.connect()
+        try:
+            conn.isolation_level = None  # Manage the transaction explicitly
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = []
+                for link in links:
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO sent_fingerprints (fingerprint, first_seen) VALUES (?, ?)",
+                        (link_fingerprint(link), now)).rowcount
+                    if inserted:
+                        claimed.append(link)
+                evict_sqlite(conn, self.retention, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return claimed
+
+
+class Outbox:
+    """
+    Durable queue of articles waiting to be delivered, stored as JSON keyed by link.
+
+    Each entry has a state ("pending", "sent" or "failed"), an attempt count and, for
+    failed entries, the time of the next attempt (exponential backoff). Only outstanding
+    articles are kept, so draining it costs O(pending + failed). Sent entries stay until
+    `pop_sent` hands them over to the sent-articles state.
+
+    When a digest goes to several chats, the chats an article has already reached are
+    recorded under "delivered_to", so a retry only goes to the chats that still miss it.
+
+    Entries are keyed by the article's link as published; membership tests compare
+    canonical links (see link_index), so a variant of a queued link counts as queued.
+    """
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    def __init__(self, filepath: str, entries: dict = None, base_delay: float = 60.0,
+                 max_delay: float = 6 * 60 * 60, max_attempts: int = 10):
+        self.filepath = filepath
+        self.entries = entries if entries is not None else {}
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.abandoned = []  # Links dropped after max_attempts, see mark_failed
+        self._canonical = {canonical_link(link) for link in self.entries}
+
+    @classmethod
+    def load(cls, filepath: str, **kwargs) -> "Outbox":
+        try:
+            with open(filepath, 'r') as f:
+                entries = json.load(f)
+            return cls(filepath, entries if isinstance(entries, dict) else {}, **kwargs)
+        except FileNotFoundError:
+            return cls(filepath, **kwargs)
+        except json.JSONDecodeError:
+            logger.warning(f"Error decoding JSON from '{filepath}'. Starting with an empty outbox.")
+            return cls(filepath, **kwargs)
+
+    def save(self):
+        try:
+            write_json_atomic(self.filepath, self.entries)
+        except Exception as e:
+            logger.error(f"Could not write outbox to file '{self.filepath}': {e}")
+
+    def __contains__(self, link):
+        return link in self.entries or canonical_link(link) in self._canonical
+
+    def __len__(self):
+        return len(self.entries)
+
+    def enqueue(self, articles, now: float = None) -> int:
+        """
+        Adds articles as pending, skipping links that are already queued.
+
+        Returns:
+            The number of articles added.
+        """
+        now = time.time() if now is None else now
+        added = 0
+        for article in articles:
+            if article['link'] not in self:
+                self.entries[article['link']] = {"article": article, "state": self.PENDING,
+                                                 "attempts": 0, "next_attempt_at": now}
+                self._canonical.add(canonical_link(article['link']))
+                added += 1
+        return added
+
+    def adopt(self, other: "Outbox") -> int:
+        """
+        Takes over the entries of another outbox, with their state and attempts, skipping
+        links that are already queued here.
+
+        Returns:
+            The number of entries taken over.
+        """
+        adopted = 0
+        for link, entry in other.entries.items():
+            if link not in self:
+                self.entries[link] = entry
+                self._canonical.add(canonical_link(link))
+                adopted += 1
+        return adopted
+
+    def due(self, now: float = None) -> list:
+        """
+        Returns the articles to send now (pending ones and failed ones past their backoff),
+        in the order they were queued.
+        """
+        now = time.time() if now is None else now
+        return [entry["article"] for entry in self.entries.values()
+                if entry["state"] != self.SENT and entry["next_attempt_at"] <= now]
+
+    def mark_sent(self, articles):
+        for article in articles:
+            entry = self.entries.get(article['link'])
+            if entry is not None:
+                entry["state"] = self.SENT
+
+    def mark_delivered(self, articles, chat_id):
+        """
+        Records that the articles reached one chat; they stay outstanding until `mark_sent`.
+        """
+        for article in articles:
+            entry = self.entries.get(article['link'])
+            if entry is not None and chat_id not in entry.setdefault("delivered_to", []):
+                entry["delivered_to"].append(chat_id)
+
+    def delivered(self) -> dict:
+        """
+        Returns a dict mapping the links of partially delivered articles to the chats they reached.
+        """
+        return {link: entry["delivered_to"] for link, entry in self.entries.items() if entry.get("delivered_to")}
+
+    def mark_failed(self, articles, now: float = None):
+        """
+        Records a failed attempt and schedules the next one. Articles that have used up
+        `max_attempts` are removed and their links collected in `abandoned`.
+        """
+        now = time.time() if now is None else now
+        for article in articles:
+            entry = self.entries.get(article['link'])
+            if entry is None or entry["state"] == self.SENT:
+                continue
+            entry["attempts"] += 1
+            if entry["attempts"] >= self.max_attempts:
+                logger.error(f"Giving up on '{article['link']}' after {entry['attempts']} failed attempts.")
+                self._remove(article['link'])
+                self.abandoned.append(article['link'])
+                continue
+            entry["state"] = self.FAILED
+            entry["next_attempt_at"] = now + min(self.base_delay * 2 ** (entry["attempts"] - 1), self.max_delay)
+
+    def sent_links(self) -> list:
+        """
+        Returns the links of the sent entries.
+        """
+        return [link for link, entry in self.entries.items() if entry["state"] == self.SENT]
+
+    def pop_sent(self) -> list:
+        """
+        Removes the sent entries and returns their links.
+        """
+        sent = self.sent_links()
+        for link in sent:
+            self._remove(link)
+        return sent
+
+    def _remove(self, link):
+        del self.entries[link]
+        self._canonical.discard(canonical_link(link))
+
+
+def evict_sqlite(conn: sqlite3.Connection, retention: Retention, now: float = None) -> int:
+    """
+    Deletes the fingerprints outside the retention policy, oldest first, using the first_seen index.
+
+    Returns:
+        The number of deleted links.
+    """
+    now = time.time() if now is None else now
+    evicted = 0
+    cutoff = retention.cutoff(now)
+    if cutoff is not None:
+        evicted += conn.execute("DELETE FROM sent_fingerprints WHERE first_seen < ?", (cutoff,)).rowcount
+    if retention.max_entries is not None:
+        excess = conn.execute("SELECT COUNT(*) FROM sent_fingerprints").fetchone()[0] - retention.max_entries
+        if excess > 0:
+            evicted += conn.execute(
+                "DELETE FROM sent_fingerprints WHERE fingerprint IN "
+                "(SELECT fingerprint FROM sent_fingerprints ORDER BY first_seen LIMIT ?)", (excess,)
+            ).rowcount
+    return evicted
+
+
+def write_json_atomic(filepath: str, data):
+    """
+    Writes `data` as JSON to a temporary file next to `filepath` and renames it into place.
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_backend(filepath: str, retention: Retention = None):
+    """
+    Picks the state backend from the file extension: .db/.sqlite/.sqlite3 use SQLite,
+    anything else the JSON file.
+    """
+    if filepath.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteStateBackend(filepath, retention=retention)
+    return JsonStateBackend(filepath, retention=retention)
@@ -1,8 +1,14 @@
 import os
+import asyncio
+import inspect
+import json
 import logging
+import time
+import httpx
 from dotenv import load_dotenv
 from telegram import Bot
-from telegram.error import TelegramError
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
 
 # Configure logging
 logging.basicConfig(
@@ -16,39 +22,438 @@ load_dotenv()
 
 # Get credentials from environment variables
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-CHAT_ID = os.getenv("CHAT_ID")  # e.g., "@your_channel" or chat ID number
+CHAT_ID = os.getenv("CHAT_ID")  # e.g., "@your_channel" or chat ID number; comma-separate several chats
+# Optional JSON file listing the chats to deliver to, each with its own filters (see load_targets)
+TARGETS_FILE = os.getenv("TARGETS_FILE")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Optional Bot API base URL, e.g. a local fake server
 
+# Delivery limits (see https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+MAX_CONCURRENT_SENDS = 8         # Requests in flight at once
+GLOBAL_RATE_LIMIT = 30.0         # Messages per second across all chats
+PRIVATE_CHAT_RATE_LIMIT = 1.0    # Messages per second in one private chat
+GROUP_CHAT_RATE_LIMIT = 20 / 60  # Messages per second in one group or channel (20 per minute)
+MAX_SEND_ATTEMPTS = 5            # Attempts per message before giving up
+NETWORK_RETRY_DELAY = 1.0        # Base delay in seconds between retries after network errors
 
-def send_digest(articles, bot_token=None, chat_id=None):
+# Digest layout: "packed" combines as many articles as fit into each message,
+# "single" sends one message per article
+DIGEST_MODE = os.getenv("DIGEST_MODE", "packed")
+TELEGRAM_MESSAGE_LIMIT = 4096    # Maximum message length, in UTF-16 code units
+PACKED_SUMMARY_LIMIT = 400       # Summaries are shortened to this many characters when packing
+ARTICLE_SEPARATOR = "\n\n———\n\n"
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket: allows bursts of up to `capacity` messages, refilled at `rate`
+    tokens per second. `pause` blocks all acquirers until a deadline, for 429 responses.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def chat_rate_limit(chat_id) -> tuple:
+    """
+    Returns the (rate, burst) limits for a chat. Channel usernames and negative (group)
+    ids get the group limit, which may be used up in a burst within its minute.
+    """
+    if str(chat_id).startswith(("@", "-")):
+        return GROUP_CHAT_RATE_LIMIT, GROUP_CHAT_RATE_LIMIT * 60
+    return PRIVATE_CHAT_RATE_LIMIT, 1.0
+
+
+async def _maybe_await(result):
+    # Lets the engine drive both the real coroutine API and plain (mocked) callables
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class DeliveryEngine:
+    """
+    Sends Telegram messages over one shared Bot (and HTTP connection pool).
+
+    Messages for one chat go out in order, while different chats are served concurrently,
+    with at most `max_concurrency` requests in flight. Every send waits for a token from
+    the global bucket and from the chat's own bucket; a 429 pauses the chat for the
+    `retry_after` Telegram asks for and the message is retried.
+
+    Use as an async context manager, or call `start` / `close` explicitly.
+    """
+
+    def __init__(self, bot_token: str = None, bot=None, max_concurrency: int = MAX_CONCURRENT_SENDS,
+                 global_rate: float = GLOBAL_RATE_LIMIT, api_url: str = None):
+        if bot is None:
+            kwargs = {"token": bot_token, "request": HTTPXRequest(connection_pool_size=max_concurrency)}
+            if api_url or TELEGRAM_API_URL:
+                kwargs["base_url"] = api_url or TELEGRAM_API_URL
+            bot = Bot(**kwargs)
+        self.bot = bot
+        self.max_concurrency = max_concurrency
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = []  # Seconds per successful send_message call
+        self._semaphore = None
+
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await _maybe_await(self.bot.initialize())
+
+    async def close(self):
+        await _maybe_await(self.bot.shutdown())
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            rate, burst = chat_rate_limit(chat_id)
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, capacity=burst)
+        return bucket
+
+    async def send_message(self, chat_id, text: str, **kwargs) -> bool:
+        """
+        Sends one message, retrying after 429s and network errors. A timeout while Telegram
+        may already have the request isn't retried, since the message may have been
+        delivered: it fails, and whether to try again is left to the caller (the outbox).
+
+        Returns:
+            True if the message was delivered, False otherwise.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    await _maybe_await(self.bot.send_message(chat_id=chat_id, text=text, **kwargs))
+                    self.latencies.append(time.perf_counter() - started)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                logger.warning(f"Rate limited by Telegram in chat {chat_id}, retrying in {retry_after}s.")
+                chat_bucket.pause(retry_after)
+            except NetworkError as e:
+                if isinstance(e, TimedOut) and not _request_not_sent(e):
+                    logger.error(f"Timed out waiting for Telegram in chat {chat_id}, not retrying in case "
+                                 f"the message was delivered: {e}")
+                    break
+                logger.warning(f"Network error sending to chat {chat_id} (attempt {attempt}): {e}")
+                await asyncio.sleep(NETWORK_RETRY_DELAY * 2 ** (attempt - 1))
+            except TelegramError as e:
+                logger.error(f"Telegram error: {e}")
+                break
+            if attempt < MAX_SEND_ATTEMPTS:
+                self.retries += 1
+        self.failed += 1
+        return False
+
+    async def send_messages(self, chat_id, texts, **kwargs) -> list:
+        """
+        Sends messages to one chat in order.
+
+        Returns:
+            A list of booleans, one per message, telling whether it was delivered.
+        """
+        return [await self.send_message(chat_id, text, **kwargs) for text in texts]
+
+    async def deliver(self, messages_by_chat: dict, **kwargs) -> dict:
+        """
+        Sends messages to several chats concurrently, in order within each chat.
+
+        Args:
+            messages_by_chat: Mapping of chat id -> list of message texts.
+
+        Returns:
+            Mapping of chat id -> list of per-message delivery results.
+        """
+        chats = list(messages_by_chat)
+        results = await asyncio.gather(*(self.send_messages(chat, messages_by_chat[chat], **kwargs)
+                                         for chat in chats))
+        return dict(zip(chats, results))
+
+    def stats(self) -> dict:
+        """
+        Returns delivery counters and send_message latency percentiles in seconds.
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+        return {"sent": self.sent, "failed": self.failed, "retries": self.retries,
+                "latency_p50": percentile(0.5), "latency_p99": percentile(0.99)}
+
+
+def _request_not_sent(error: TimedOut) -> bool:
+    """
+    Tells whether a timeout happened before the request reached Telegram: connecting, or
+    waiting for a free pooled connection. Read and write timeouts are ambiguous.
+    """
+    return isinstance(error.__cause__, (httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def message_length(text: str) -> int:
+    """
+    Returns the length of a message the way Telegram counts it (UTF-16 code units).
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def truncate_text(text: str, limit: int) -> str:
+    """
+    Shortens text to at most `limit` characters (as counted by message_length), cutting
+    at a word boundary where possible and ending with an ellipsis.
+    """
+    if message_length(text) <= limit:
+        return text
+    cut = text[:max(limit - 1, 0)]
+    while cut and message_length(cut) > limit - 1:
+        cut = cut[:-1]
+    head, _, _ = cut.rpartition(" ")
+    if len(head) >= len(cut) // 2:  # Don't throw away most of the text to end on a word
+        cut = head
+    return cut.rstrip(" \t\n.,;:-—") + "…"
+
+
+def format_article(article, summary_limit: int = None) -> str:
+    summary = article['summary']
+    if summary_limit is not None:
+        summary = truncate_text(summary, summary_limit)
+    header = f"{article['title']}\n{article['link']}"
+    # Added by the enrichment stage, when it is enabled and the page provided them
+    if article.get('reading_minutes'):
+        header += f"\n{article['reading_minutes']} min read"
+    if article.get('image'):
+        header += f"\nImage: {article['image']}"
+    return f"{header}\n\n{summary}"
+
+
+def build_messages(articles, mode: str = None, limit: int = TELEGRAM_MESSAGE_LIMIT, rendered: dict = None) -> list:
+    """
+    Renders articles into the messages to send.
+
+    In "single" mode every article becomes its own message. In "packed" mode summaries
+    are shortened to PACKED_SUMMARY_LIMIT and consecutive articles are combined while
+    they fit under `limit`. Packing is greedy and keeps the feed order, which gives the
+    fewest messages possible without reordering articles.
+
+    Args:
+        rendered: Optional cache of rendered articles, keyed by (mode, limit, link). Pass the
+            same dict when building the messages for several chats so that every article
+            is formatted only once; packing the cached texts is cheap.
+
+    Returns:
+        A list of (text, articles) tuples, where `articles` are the ones in that message.
+    """
+    mode = mode or DIGEST_MODE
+    if mode not in ("single", "packed"):
+        raise ValueError(f"Unknown digest mode: {mode!r}")
+    rendered = rendered if rendered is not None else {}
+
+    def render(article):
+        key = (mode, limit, article['link'])
+        text = rendered.get(key)
+        if text is None:
+            summary_limit = PACKED_SUMMARY_LIMIT if mode == "packed" else None
+            text = rendered[key] = truncate_text(format_article(article, summary_limit), limit)
+        return text
+
+    if mode == "single":
+        return [(render(article), [article]) for article in articles]
+
+    messages = []
+    text, group = "", []
+    separator_length = message_length(ARTICLE_SEPARATOR)
+    for article in articles:
+        rendered_article = render(article)
+        if group and message_length(text) + separator_length + message_length(rendered_article) <= limit:
+            text += ARTICLE_SEPARATOR + rendered_article
+            group.append(article)
+        else:
+            if group:
+                messages.append((text, group))
+            text, group = rendered_article, [article]
+    if group:
+        messages.append((text, group))
+    return messages
+
+
+class DigestTarget:
+    """
+    A chat that receives the digest, with optional keyword filters.
+
+    An article is delivered to the chat if its title or summary contains one of the
+    `include` keywords (any article when there are none) and none of the `exclude`
+    keywords. Keywords are matched case-insensitively. `mode` overrides the digest mode
+    for this chat.
+    """
+
+    def __init__(self, chat_id, include=None, exclude=None, mode: str = None):
+        self.chat_id = str(chat_id)
+        self.include = [keyword.lower() for keyword in include or []]
+        self.exclude = [keyword.lower() for keyword in exclude or []]
+        self.mode = mode
+
+    def wants(self, article) -> bool:
+        text = f"{article.get('title', '')}\n{article.get('summary', '')}".lower()
+        if self.include and not any(keyword in text for keyword in self.include):
+            return False
+        return not any(keyword in text for keyword in self.exclude)
+
+
+def load_targets(filepath: str = None) -> list:
+    """
+    Returns the chats to deliver to.
+
+    If TARGETS_FILE (or `filepath`) is set, it is read as a JSON list of objects with a
+    "chat_id" and optional "include", "exclude" and "mode" keys. Otherwise every chat in
+    the comma-separated CHAT_ID gets the full digest.
+    """
+    filepath = filepath or TARGETS_FILE
+    if filepath:
+        try:
+            with open(filepath, 'r') as f:
+                return [DigestTarget(**target) for target in json.load(f)]
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Could not load delivery targets from '{filepath}': {e}")
+            return []
+    return [DigestTarget(chat_id.strip()) for chat_id in (CHAT_ID or "").split(",") if chat_id.strip()]
+
+
+async def send_digest_async(articles, bot_token=None, chat_id=None, engine=None, mode=None, on_result=None,
+                            latencies=None, targets=None, delivered=None):
+    """
+    Coroutine version of send_digest. Pass a started DeliveryEngine to reuse its Bot
+    across digests (e.g. in a long-running process); otherwise one is created for this call.
+    """
+    bot_token = bot_token or BOT_TOKEN
+    if chat_id:
+        targets = [DigestTarget(chat_id)]
+    elif targets is None:
+        targets = load_targets()
+    delivered = delivered or {}
+
+    if not targets or (engine is None and not bot_token):
+        logger.error("Missing Telegram credentials. Set BOT_TOKEN and CHAT_ID in .env file.")
+        return False
+
+    # What each chat still has to receive: its filters, minus what it already got
+    articles_by_chat = {
+        target.chat_id: [article for article in articles if target.wants(article)
+                         and target.chat_id not in delivered.get(article['link'], ())]
+        for target in targets
+    }
+    if on_result is not None:
+        outstanding = {article['link'] for chat_articles in articles_by_chat.values() for article in chat_articles}
+        unwanted = [article for article in articles if article['link'] not in outstanding]
+        if unwanted:
+            on_result(unwanted, True, None)  # Nothing left to deliver for these
+
+    # Messages are rendered once per article and packed per chat from the shared cache
+    rendered = {}
+    messages_by_chat = {target.chat_id: build_messages(articles_by_chat[target.chat_id],
+                                                       target.mode or mode, rendered=rendered)
+                        for target in targets}
+
+    async def send_chat(engine, chat_id):
+        results = []
+        for text, group in messages_by_chat[chat_id]:
+            ok = await engine.send_message(chat_id, text)
+            if on_result is not None:
+                on_result(group, ok, chat_id)
+            results.append(ok)
+        return results
+
+    async def send_all(engine):
+        first_latency = len(engine.latencies)
+        try:
+            # Chats are served concurrently, each under its own rate limit
+            per_chat = await asyncio.gather(*(send_chat(engine, chat_id) for chat_id in messages_by_chat))
+        finally:
+            if latencies is not None:
+                latencies.extend(engine.latencies[first_latency:])
+        return [ok for results in per_chat for ok in results]
+
+    if engine is not None:
+        results = await send_all(engine)
+    else:
+        async with DeliveryEngine(bot_token) as engine:
+            results = await send_all(engine)
+
+    if not all(results):
+        logger.error(f"Failed to send {results.count(False)} of {len(results)} messages to Telegram")
+        return False
+    logger.info(f"Successfully sent {len(articles)} articles in {len(results)} messages "
+                f"to {len(messages_by_chat)} Telegram chat(s)")
+    return True
+
+
+def send_digest(articles, bot_token=None, chat_id=None, mode=None, on_result=None, latencies=None,
+                targets=None, delivered=None):
     """
     Send articles digest to Telegram chat
-    
+
     Args:
         articles (list): List of articles to send, each with 'title', 'link', and 'summary'
         bot_token (str, optional): Telegram bot token. Defaults to environment variable.
-        chat_id (str, optional): Telegram chat ID. Defaults to environment variable.
-    
+        chat_id (str, optional): Telegram chat ID. Defaults to the targets from load_targets.
+        mode (str, optional): "packed" or "single". Defaults to the DIGEST_MODE environment variable.
+        on_result (callable, optional): Called as on_result(articles, ok, chat_id) after each
+            message, with the articles that message carried and whether it was delivered.
+            Articles no chat needs are reported once with chat_id None.
+        latencies (list, optional): Receives the duration in seconds of each Telegram call.
+        targets (list, optional): DigestTarget objects to deliver to, instead of chat_id.
+        delivered (dict, optional): Maps article links to the chat ids that already have
+            them; those chats are skipped, e.g. when retrying a partially delivered digest.
+
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        # Use provided credentials or fall back to environment variables
-        bot_token = bot_token or BOT_TOKEN
-        chat_id = chat_id or CHAT_ID
-        
-        if not bot_token or not chat_id:
-            logger.error("Missing Telegram credentials. Set BOT_TOKEN and CHAT_ID in .env file.")
-            return False
-
-        bot = Bot(token=bot_token)
-        
-        for article in articles:
-            message = f"{article['title']}\n{article['link']}\n\n{article['summary']}"
-            bot.send_message(chat_id=chat_id, text=message)
-        
-        logger.info(f"Successfully sent {len(articles)} articles to Telegram")
-        return True
-    
+        return asyncio.run(send_digest_async(articles, bot_token=bot_token, chat_id=chat_id, mode=mode,
+                                             on_result=on_result, latencies=latencies, targets=targets,
+                                             delivered=delivered))
     except TelegramError as e:
         logger.error(f"Telegram error: {e}")
         return False
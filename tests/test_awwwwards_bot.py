@@ -1,14 +1,25 @@
 import unittest
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, AsyncMock, MagicMock, ANY, call
 import json
 import os
+import sqlite3
+import subprocess
+import sys
+import time
+from functools import partial
 
 # Import the module to be tested
 import awwwwards_bot 
 from awwwwards_bot import main, load_sent_articles, save_sent_articles # import specific functions
+from awwwwards_bot import load_feed_state, save_feed_state
+from feed_transport import FeedResponse
+from sharding import shard_of, shard_path, shard_urls
 
 # It's good practice to define a test-specific file to avoid conflicts
 TEST_SENT_ARTICLES_FILE = "test_sent_articles.json"
+TEST_FEED_STATE_FILE = "test_feed_state.json"
+TEST_OUTBOX_FILE = "test_outbox.json"
+TEST_ENRICHMENT_CACHE_FILE = "test_enrichment_cache.json"
 
 class TestAwwwwardsBot(unittest.TestCase):
 
@@ -19,16 +30,20 @@ class TestAwwwwardsBot(unittest.TestCase):
         """
         self.test_sent_articles_file = TEST_SENT_ARTICLES_FILE
         # Ensure no old test file is present
-        if os.path.exists(self.test_sent_articles_file):
-            os.remove(self.test_sent_articles_file)
+        for path in (self.test_sent_articles_file, TEST_FEED_STATE_FILE, TEST_FEED_STATE_FILE + ".lock",
+                     TEST_OUTBOX_FILE, TEST_ENRICHMENT_CACHE_FILE):
+            if os.path.exists(path):
+                os.remove(path)
 
     def tearDown(self):
         """
         Clean up after test methods.
         This method is called after each test method.
         """
-        if os.path.exists(self.test_sent_articles_file):
-            os.remove(self.test_sent_articles_file)
+        for path in (self.test_sent_articles_file, TEST_FEED_STATE_FILE, TEST_FEED_STATE_FILE + ".lock",
+                     TEST_OUTBOX_FILE, TEST_ENRICHMENT_CACHE_FILE):
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_load_sent_articles_file_not_found(self):
         """
@@ -73,6 +88,8 @@ class TestAwwwwardsBot(unittest.TestCase):
         #     self.assertTrue(mock_log_warning.called)
 
 
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
     @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE) # Ensure main uses the test file
     @patch('awwwwards_bot.save_sent_articles')
     @patch('awwwwards_bot.load_sent_articles')
@@ -96,20 +113,81 @@ class TestAwwwwardsBot(unittest.TestCase):
 
         main()
 
-        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL)
+        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL, cache=ANY)
         mock_load_sent.assert_called_once_with(TEST_SENT_ARTICLES_FILE)
         
         expected_articles_to_send = [
             {'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'},
             {'title': 'Article 3', 'link': 'link3', 'summary': 'Summary 3'}
         ]
-        mock_send_digest.assert_called_once_with(expected_articles_to_send)
+        mock_send_digest.assert_called_once_with(expected_articles_to_send, on_result=ANY, latencies=ANY, delivered=ANY)
         
         # The save_sent_articles function in awwwwards_bot.py expects a set
         expected_saved_links_set = {"link1", "link2", "link3"}
         mock_save_sent.assert_called_once_with(TEST_SENT_ARTICLES_FILE, expected_saved_links_set)
 
 
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.save_sent_articles')
+    @patch('awwwwards_bot.load_sent_articles')
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_main_writes_metrics_file(self, mock_fetch_rss, mock_send_digest,
+                                      mock_load_sent, mock_save_sent):
+        """
+        Test that main records stage timings, counters and Telegram latencies.
+        """
+        mock_load_sent.return_value = {"link1"}
+        mock_fetch_rss.return_value = [
+            {'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'},
+            {'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'},
+        ]
+
+        def deliver(articles, on_result, latencies, **kwargs):
+            latencies.extend([0.05, 0.15])
+            on_result(articles, True)
+            return True
+        mock_send_digest.side_effect = deliver
+
+        metrics_file = "test_metrics.json"
+        self.addCleanup(lambda: os.path.exists(metrics_file) and os.remove(metrics_file))
+        main(metrics_file=metrics_file)
+
+        with open(metrics_file) as f:
+            metrics = json.load(f)
+        self.assertEqual(set(metrics["stages"]), {"state_load", "fetch", "dedup", "save", "send"})
+        self.assertEqual(metrics["counters"]["feeds_fetched"], 1)
+        self.assertEqual(metrics["counters"]["new_articles"], 1)
+        self.assertEqual(metrics["counters"]["articles_sent"], 1)
+        self.assertEqual(metrics["observations"]["telegram_request_seconds"]["count"], 2)
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('rss_parser.download_feed')
+    def test_parse_stage_is_timed_apart_from_fetch(self, mock_download):
+        """
+        Test that parsing downloaded and pushed feeds is recorded as its own stage.
+        """
+        body = b"""<rss version="2.0"><channel><item><title>Article 1</title><link>https://example.com/a1</link>
+            <description>Summary</description></item></channel></rss>"""
+        mock_download.return_value = FeedResponse(200, {}, body, len(body), "http://a.example/rss")
+        state = awwwwards_bot.BotState(set(), awwwwards_bot.FeedCache(), awwwwards_bot.Outbox(TEST_OUTBOX_FILE))
+        send = MagicMock(return_value=True)
+
+        polled, pushed = awwwwards_bot.PipelineMetrics(), awwwwards_bot.PipelineMetrics()
+        awwwwards_bot.run_cycle(state, ["http://a.example/rss"], send=send, metrics=polled)
+        awwwwards_bot.run_cycle(state, [], send=send, metrics=pushed, pushed=[("http://b.example/rss", body, {})])
+
+        self.assertGreater(polled.stages["parse"], 0)
+        self.assertIn("fetch", polled.stages)
+        self.assertGreater(pushed.stages["parse"], 0)
+        self.assertEqual(pushed.counters["articles_pushed"], 1)
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
     @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
     @patch('awwwwards_bot.save_sent_articles')
     @patch('awwwwards_bot.load_sent_articles')
@@ -130,12 +208,14 @@ class TestAwwwwardsBot(unittest.TestCase):
 
         main()
 
-        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL)
+        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL, cache=ANY)
         mock_load_sent.assert_called_once_with(TEST_SENT_ARTICLES_FILE)
         mock_send_digest.assert_not_called()
         mock_save_sent.assert_not_called() # save should not be called if no new articles were sent
 
 
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
     @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
     @patch('awwwwards_bot.save_sent_articles')
     @patch('awwwwards_bot.load_sent_articles')
@@ -151,12 +231,14 @@ class TestAwwwwardsBot(unittest.TestCase):
 
         main()
 
-        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL)
+        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL, cache=ANY)
         mock_load_sent.assert_called_once_with(TEST_SENT_ARTICLES_FILE) # load is still called
         mock_send_digest.assert_not_called()
         mock_save_sent.assert_not_called()
 
 
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
     @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
     @patch('awwwwards_bot.save_sent_articles')
     @patch('awwwwards_bot.load_sent_articles')
@@ -179,16 +261,577 @@ class TestAwwwwardsBot(unittest.TestCase):
 
         main()
 
-        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL)
+        mock_fetch_rss.assert_called_once_with(awwwwards_bot.RSS_URL, cache=ANY)
         mock_load_sent.assert_called_once_with(TEST_SENT_ARTICLES_FILE)
         
         expected_articles_to_send = [
             {'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'}
         ]
-        mock_send_digest.assert_called_once_with(expected_articles_to_send)
+        mock_send_digest.assert_called_once_with(expected_articles_to_send, on_result=ANY, latencies=ANY, delivered=ANY)
         
         # Crucially, save should not be called if sending the digest failed
         mock_save_sent.assert_not_called()
 
+    def test_load_and_save_feed_state(self):
+        """
+        Test saving the per-feed validators and loading them back.
+        """
+        feed_state = {"http://example.com/feed": {"etag": '"abc"', "modified": "Mon, 01 Jan 2024 00:00:00 GMT"}}
+
+        save_feed_state(TEST_FEED_STATE_FILE, feed_state)
+
+        self.assertEqual(load_feed_state(TEST_FEED_STATE_FILE), feed_state)
+        self.assertEqual(load_feed_state("non_existent_feed_state.json"), {})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.save_feed_state')
+    @patch('awwwwards_bot.save_sent_articles')
+    @patch('awwwwards_bot.load_sent_articles')
+    @patch('awwwwards_bot.send_digest')
+    @patch('rss_parser.download_feed')
+    def test_main_flow_not_modified_short_circuits(self, mock_download, mock_send_digest,
+                                                   mock_load_sent, mock_save_sent, mock_save_feed_state):
+        """
+        Test that a 304 Not Modified response stops the run before parsing or sending.
+        """
+        mock_load_sent.return_value = {"link1"}
+        save_feed_state(TEST_FEED_STATE_FILE, {awwwwards_bot.RSS_URL: {"etag": '"v1"', "modified": None}})
+        mock_download.return_value = FeedResponse(304, {}, b"", 0, awwwwards_bot.RSS_URL)
+
+        with self.assertLogs(level='INFO') as logs:
+            main()
+
+        mock_download.assert_called_once_with(awwwwards_bot.RSS_URL, '"v1"', None, None)
+        mock_send_digest.assert_not_called()
+        mock_save_sent.assert_not_called()
+        mock_save_feed_state.assert_not_called()
+        self.assertIn("Feed cache: 1 not modified, 0 downloaded.", "\n".join(logs.output))
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.ENRICHMENT_CACHE_FILE', TEST_ENRICHMENT_CACHE_FILE)
+    @patch('awwwwards_bot.ENRICH_ARTICLES', True)
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_main_flow_enriches_new_articles_once(self, mock_fetch_rss, mock_send_digest):
+        """
+        Test that new articles are sent with their enrichment, which is cached so a
+        retry of the outbox doesn't fetch the page again.
+        """
+        mock_fetch_rss.return_value = [{'title': 'Article 1', 'link': 'https://example.com/1', 'summary': 'S'}]
+        mock_send_digest.return_value = False
+        pages = []
+
+        def fetch(url):
+            pages.append(url)
+            return {"image": "https://example.com/1.jpg", "reading_minutes": 3}
+
+        with patch('awwwwards_bot.enrich_articles', side_effect=partial(awwwwards_bot.enrich_articles, fetch=fetch)):
+            main()
+            mock_fetch_rss.return_value = mock_fetch_rss.return_value + \
+                [{'title': 'Article 1 again', 'link': 'https://example.com/1?utm_source=rss', 'summary': 'S'}]
+            main()
+
+        self.assertEqual(pages, ["https://example.com/1"])
+        sent = mock_send_digest.call_args_list[0].args[0]
+        self.assertEqual(sent[0]['image'], "https://example.com/1.jpg")
+        self.assertEqual(sent[0]['reading_minutes'], 3)
+        with open(TEST_OUTBOX_FILE) as f:
+            self.assertEqual(json.load(f)['https://example.com/1']['article']['reading_minutes'], 3)
+        with open(TEST_ENRICHMENT_CACHE_FILE) as f:
+            self.assertEqual(len(json.load(f)), 1)
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_main_flow_partial_failure_only_resends_failed(self, mock_fetch_rss, mock_send_digest):
+        """
+        Test that after a partial failure only the failed article is sent again, and only
+        once its backoff has passed.
+        """
+        fetched_articles_data = [
+            {'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'},
+            {'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'}
+        ]
+        mock_fetch_rss.return_value = fetched_articles_data
+
+        def deliver_first_only(articles, on_result, **kwargs):
+            on_result(articles[:1], True)
+            on_result(articles[1:], False)
+            return False
+        mock_send_digest.side_effect = deliver_first_only
+
+        main()
+
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1"})
+        with open(TEST_OUTBOX_FILE) as f:
+            outbox = json.load(f)
+        self.assertEqual(list(outbox), ["link2"])
+        self.assertEqual(outbox["link2"]["state"], "failed")
+        self.assertEqual(outbox["link2"]["attempts"], 1)
+
+        # Still backing off: nothing is sent, and link2 isn't queued twice
+        mock_send_digest.reset_mock(side_effect=True)
+        mock_send_digest.return_value = True
+        main()
+        mock_send_digest.assert_not_called()
+
+        # Once the backoff has passed only the failed article is retried
+        with patch('state_store.time.time', return_value=time.time() + 3600):
+            main()
+        mock_send_digest.assert_called_once_with([fetched_articles_data[1]], on_result=ANY, latencies=ANY, delivered=ANY)
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1", "link2"})
+        with open(TEST_OUTBOX_FILE) as f:
+            self.assertEqual(json.load(f), {})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_main_flow_retries_only_chats_that_missed_an_article(self, mock_fetch_rss, mock_send_digest):
+        """
+        Test that an article delivered to one chat but not another stays queued, and that
+        the retry tells send which chats already have it.
+        """
+        mock_fetch_rss.return_value = [{'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'}]
+
+        def deliver_to_one_chat(articles, on_result, **kwargs):
+            on_result(articles, True, "@a")
+            on_result(articles, False, "@b")
+            return False
+        mock_send_digest.side_effect = deliver_to_one_chat
+
+        main()
+
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), set())
+        with open(TEST_OUTBOX_FILE) as f:
+            entry = json.load(f)["link1"]
+        self.assertEqual((entry["state"], entry["attempts"], entry["delivered_to"]), ("failed", 1, ["@a"]))
+
+        mock_send_digest.reset_mock(side_effect=True)
+        mock_send_digest.return_value = True
+        with patch('state_store.time.time', return_value=time.time() + 3600):
+            main()
+
+        self.assertEqual(mock_send_digest.call_args.kwargs["delivered"], {"link1": ["@a"]})
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1"})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_main_flow_crash_during_send_keeps_articles_queued(self, mock_fetch_rss, mock_send_digest):
+        """
+        Test that articles survive a crash mid-send and that the ones already delivered
+        are not sent again.
+        """
+        mock_fetch_rss.return_value = [
+            {'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'},
+            {'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'}
+        ]
+
+        def crash_after_first(articles, on_result, **kwargs):
+            on_result(articles[:1], True)
+            raise KeyboardInterrupt  # Not caught by main, like the process being killed
+        mock_send_digest.side_effect = crash_after_first
+
+        with self.assertRaises(KeyboardInterrupt):
+            main()
+
+        mock_fetch_rss.return_value = []  # Feed moved on, nothing new
+        mock_send_digest.reset_mock(side_effect=True)
+        mock_send_digest.return_value = True
+        main()
+
+        mock_send_digest.assert_called_once_with(
+            [{'title': 'Article 2', 'link': 'link2', 'summary': 'Summary 2'}], on_result=ANY, latencies=ANY, delivered=ANY)
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1", "link2"})
+
+    @patch('awwwwards_bot.WORKER_COUNT', 2)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_workers_sharing_state_send_an_article_once(self, mock_fetch_rss):
+        """
+        Test that two workers that both found an article, with state loaded before either
+        of them sent it, send it only once and keep each other's links.
+        """
+        mock_fetch_rss.side_effect = lambda url, **kwargs: [
+            {'title': 'Shared', 'link': 'https://example.com/shared', 'summary': 'S'},
+            {'title': url, 'link': f'{url}/own', 'summary': 'O'},
+        ]
+        outbox_files = [TEST_OUTBOX_FILE, "test_outbox.1-of-2.json"]
+        for path in (outbox_files[1], TEST_SENT_ARTICLES_FILE + ".lock"):
+            self.addCleanup(lambda path=path: os.path.exists(path) and os.remove(path))
+        workers = [awwwwards_bot.BotState(load_sent_articles(TEST_SENT_ARTICLES_FILE), awwwwards_bot.FeedCache(),
+                                          awwwwards_bot.Outbox(path)) for path in outbox_files]
+        sends = []
+
+        def send(articles, on_result, **kwargs):
+            sends.append([article['link'] for article in articles])
+            on_result(articles, True)
+            return True
+
+        metrics = [awwwwards_bot.PipelineMetrics() for _ in workers]
+        for state, url, worker_metrics in zip(workers, ["http://a.example", "http://b.example"], metrics):
+            awwwwards_bot.run_cycle(state, [url], send=send, metrics=worker_metrics)
+
+        self.assertEqual(sends, [["https://example.com/shared", "http://a.example/own"], ["http://b.example/own"]])
+        self.assertEqual(metrics[1].counters["articles_claimed_elsewhere"], 1)
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE),
+                         {"https://example.com/shared", "http://a.example/own", "http://b.example/own"})
+
+    @patch('awwwwards_bot.WORKER_COUNT', 2)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('state_store.SQLITE_BUSY_TIMEOUT', 0.1)
+    @patch('rss_parser.download_feed')
+    def test_claim_failure_leaves_the_articles_to_the_next_fetch(self, mock_download):
+        """
+        Test that when the shared SQLite state stays locked by another worker, the new
+        articles are neither queued nor lost: the feed's validators are not kept, and
+        the next cycle fetches and sends them.
+        """
+        db_path = "test_sent_articles.db"
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            self.addCleanup(lambda path=path: os.path.exists(path) and os.remove(path))
+        body = b"""<rss version="2.0"><channel><item><title>Article 1</title><link>https://example.com/a1</link>
+            <description>Summary</description></item></channel></rss>"""
+        mock_download.side_effect = lambda url, etag, modified, transport: (
+            FeedResponse(304, {}, b"", 0, url) if etag == '"v2"' else FeedResponse(200, {"etag": '"v2"'}, body, len(body), url))
+        sends = []
+
+        def send(articles, on_result, **kwargs):
+            sends.append([article['link'] for article in articles])
+            on_result(articles, True)
+            return True
+
+        with patch('awwwwards_bot.SENT_ARTICLES_FILE', db_path), \
+                patch('awwwwards_bot.WORKER_INDEX', shard_of("http://a.example/rss", 2)):
+            state = awwwwards_bot.BotState(load_sent_articles(db_path), awwwwards_bot.FeedCache(),
+                                           awwwwards_bot.Outbox(TEST_OUTBOX_FILE))
+            other_worker = sqlite3.connect(db_path, isolation_level=None)
+            other_worker.execute("BEGIN IMMEDIATE")
+            metrics = awwwwards_bot.PipelineMetrics()
+            with self.assertLogs(level='ERROR') as logs:
+                awwwwards_bot.run_cycle(state, ["http://a.example/rss"], send=send, metrics=metrics)
+            other_worker.execute("ROLLBACK")
+            other_worker.close()
+
+            self.assertIn("Could not claim 1 new articles", "\n".join(logs.output))
+            self.assertEqual(metrics.counters["claim_failures"], 1)
+            self.assertEqual((sends, len(state.outbox)), ([], 0))
+            self.assertEqual(state.feed_cache.validators("http://a.example/rss"), (None, None))
+            self.assertFalse(os.path.exists(TEST_FEED_STATE_FILE))
+
+            awwwwards_bot.run_cycle(state, ["http://a.example/rss"], send=send)
+
+            self.assertEqual(sends, [["https://example.com/a1"]])
+            self.assertIn("https://example.com/a1", load_sent_articles(db_path))
+            self.assertEqual(load_feed_state(TEST_FEED_STATE_FILE)["http://a.example/rss"]["etag"], '"v2"')
+
+    @patch('awwwwards_bot.WORKER_COUNT', 2)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    def test_sent_articles_stay_in_the_outbox_until_stored(self):
+        """
+        Test that sent articles that can't be stored in the shared state stay in the
+        outbox, as sent, until a later call stores them.
+        """
+        outbox = awwwwards_bot.Outbox(TEST_OUTBOX_FILE)
+        article = {'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'}
+        outbox.enqueue([article])
+        outbox.mark_sent([article])
+
+        with patch('awwwwards_bot.claim_links', side_effect=OSError("locked")), self.assertLogs(level='ERROR'):
+            awwwwards_bot.store_sent_articles(outbox, set())
+        self.assertEqual(outbox.sent_links(), ["link1"])
+
+        awwwwards_bot.store_sent_articles(outbox, set())
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1"})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    def test_changing_the_worker_count_keeps_feed_state_and_outboxes(self):
+        """
+        Test that two workers share the feed state without overwriting each other's feeds,
+        and that a single worker started afterwards gets the state of every feed and the
+        articles left in the outbox of the worker that is gone.
+        """
+        urls = [f"http://feeds{i}.example/rss" for i in range(12)]
+        first, second = (shard_urls(urls, index, 2)[0] for index in range(2))
+        stray_outbox = shard_path(TEST_OUTBOX_FILE, 1)
+        self.addCleanup(lambda: os.path.exists(stray_outbox) and os.remove(stray_outbox))
+        with patch('awwwwards_bot.WORKER_COUNT', 2):
+            with patch('awwwwards_bot.WORKER_INDEX', 1):
+                awwwwards_bot.store_feed_state({second: {"etag": '"second"'}})
+                outbox = awwwwards_bot.Outbox(stray_outbox)
+                outbox.enqueue([{'title': 'Queued', 'link': 'http://example.com/queued', 'summary': 'S'}])
+                outbox.save()
+            # Worker 0 still has the state of the second feed it loaded before worker 1 saved
+            awwwwards_bot.store_feed_state({first: {"etag": '"first"'}, second: {"etag": '"stale"'}})
+
+        state = awwwwards_bot.load_state()
+
+        self.assertEqual(state.feed_cache.validators(first), ('"first"', None))
+        self.assertEqual(state.feed_cache.validators(second), ('"second"', None))
+        self.assertEqual([article['link'] for article in state.outbox.due()], ['http://example.com/queued'])
+        self.assertFalse(os.path.exists(stray_outbox))
+
+    @patch('awwwwards_bot.WORKER_INDEX', 1)
+    @patch('awwwwards_bot.WORKER_COUNT', 3)
+    @patch('awwwwards_bot.RSS_URLS', [f"http://feeds{i}.example/rss" for i in range(12)])
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.send_digest')
+    @patch('awwwwards_bot.fetch_rss_feed', return_value=[])
+    def test_main_only_fetches_the_workers_shard(self, mock_fetch_rss, mock_send_digest):
+        main()
+
+        fetched = sorted(call.args[0] for call in mock_fetch_rss.call_args_list)
+        self.assertEqual(fetched, sorted(shard_urls(awwwwards_bot.RSS_URLS, 1, 3)))
+        self.assertTrue(0 < len(fetched) < 12)
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.time.sleep')
+    @patch('telegram_messege.send_digest_async')
+    @patch('telegram_messege.DeliveryEngine')
+    @patch('awwwwards_bot.load_sent_articles')
+    @patch('awwwwards_bot.fetch_rss_feed')
+    def test_daemon_keeps_state_and_bot_across_cycles(self, mock_fetch_rss, mock_load_sent, mock_engine_class,
+                                                      mock_send_async, mock_sleep):
+        """
+        Test that the daemon loads the state once, reuses one delivery engine and retries
+        queued articles without polling the feed again.
+        """
+        mock_load_sent.return_value = set()
+        mock_fetch_rss.return_value = [{'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'}]
+        mock_engine = mock_engine_class.return_value
+        mock_engine.start = AsyncMock()
+        mock_engine.close = AsyncMock()
+        # First attempt fails, the retry succeeds
+        mock_send_async.side_effect = [False, True]
+        # Each sleep advances a fake clock past the outbox backoff (60s) but well before
+        # the next feed poll; the third one stops the daemon
+        clock = [time.time()]
+
+        def sleep(seconds):
+            if mock_sleep.call_count >= 3:
+                raise KeyboardInterrupt
+            clock[0] += 120
+        mock_sleep.side_effect = sleep
+
+        with patch('time.time', side_effect=lambda: clock[0]):
+            awwwwards_bot.run_daemon()
+
+        mock_load_sent.assert_called_once()
+        mock_fetch_rss.assert_called_once()  # Retry didn't wait for the next feed poll
+        mock_engine_class.assert_called_once()
+        mock_engine.start.assert_awaited_once()
+        mock_engine.close.assert_awaited_once()
+        self.assertEqual(mock_send_async.call_count, 2)
+        self.assertEqual(mock_send_async.call_args.kwargs['engine'], mock_engine)
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"link1"})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.time.sleep')
+    @patch('telegram_messege.send_digest_async')
+    @patch('telegram_messege.DeliveryEngine')
+    @patch('rss_parser.download_feed')
+    def test_daemon_fetches_the_feed_again_after_a_failed_cycle(self, mock_download, mock_engine_class,
+                                                                mock_send_async, mock_sleep):
+        """
+        Test that a cycle failing after the fetch doesn't keep the feed's new validators
+        and watermark, so the next poll downloads and reads the feed again instead of
+        getting a 304 and losing its articles.
+        """
+        body = b"""<rss version="2.0"><channel><item><title>Article 1</title><link>https://example.com/a1</link>
+            <description>Summary</description></item></channel></rss>"""
+        mock_download.side_effect = lambda url, etag, modified, transport: (
+            FeedResponse(304, {}, b"", 0, url) if etag == '"v2"' else FeedResponse(200, {"etag": '"v2"'}, body, len(body), url))
+        mock_engine = mock_engine_class.return_value
+        mock_engine.start = AsyncMock()
+        mock_engine.close = AsyncMock()
+        mock_send_async.return_value = True
+        clock = [time.time()]
+
+        def sleep(seconds):
+            if mock_sleep.call_count >= 2:
+                raise KeyboardInterrupt
+            clock[0] += 24 * 60 * 60  # Past the next poll
+        mock_sleep.side_effect = sleep
+        filter_new_articles = awwwwards_bot.filter_new_articles
+        failures = [OSError("simulated failure")]
+
+        def fail_once(*args):
+            if failures:
+                raise failures.pop()
+            return filter_new_articles(*args)
+
+        with patch('time.time', side_effect=lambda: clock[0]), \
+                patch('awwwwards_bot.filter_new_articles', side_effect=fail_once), \
+                self.assertLogs(level='ERROR') as logs:
+            awwwwards_bot.run_daemon()
+
+        self.assertIn("Cycle failed", "\n".join(logs.output))
+        self.assertEqual([call.args[1] for call in mock_download.call_args_list], [None, None])
+        self.assertEqual([article['link'] for article in mock_send_async.call_args.args[0]], ["https://example.com/a1"])
+        feed_state = load_feed_state(TEST_FEED_STATE_FILE)[awwwwards_bot.RSS_URL]
+        self.assertEqual(feed_state["etag"], '"v2"')
+        self.assertEqual(feed_state["watermark"]["id"], "https://example.com/a1")
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.WEBSUB_CALLBACK_URL', "https://bot.example.com/websub")
+    @patch('websub.WebSubSubscriber')
+    @patch('telegram_messege.send_digest_async')
+    @patch('telegram_messege.DeliveryEngine')
+    @patch('awwwwards_bot.fetch_rss_feed', return_value=[])
+    def test_daemon_sends_pushed_articles_when_woken_up(self, mock_fetch_rss, mock_engine_class, mock_send_async,
+                                                         mock_subscriber_class):
+        """
+        Test that in push mode the daemon waits on the subscriber instead of sleeping, and
+        sends pushed articles in the cycle right after the push.
+        """
+        mock_engine = mock_engine_class.return_value
+        mock_engine.start = AsyncMock()
+        mock_engine.close = AsyncMock()
+        mock_send_async.return_value = True
+        subscriber = mock_subscriber_class.load.return_value
+        subscriber.is_active.return_value = True
+        body = b"""<rss version="2.0"><channel><item><title>Pushed</title><link>https://example.com/pushed</link>
+            <description>Summary</description></item></channel></rss>"""
+        subscriber.drain.side_effect = [[], [(awwwwards_bot.RSS_URL, body, {})], []]
+        subscriber.wait.side_effect = [True, KeyboardInterrupt]
+
+        with patch('awwwwards_bot.time.sleep') as mock_sleep:
+            awwwwards_bot.run_daemon()
+
+        mock_sleep.assert_not_called()
+        subscriber.start.assert_called_once()
+        subscriber.maintain.assert_called_with(awwwwards_bot.RSS_URLS, ANY)
+        subscriber.stop.assert_called_once()
+        mock_fetch_rss.assert_called_once()  # Only the startup poll, the push needed none
+        pushed = mock_send_async.call_args.args[0]
+        self.assertEqual([article['link'] for article in pushed], ["https://example.com/pushed"])
+        self.assertEqual(load_sent_articles(TEST_SENT_ARTICLES_FILE), {"https://example.com/pushed"})
+
+    @patch('awwwwards_bot.OUTBOX_FILE', TEST_OUTBOX_FILE)
+    @patch('awwwwards_bot.FEED_STATE_FILE', TEST_FEED_STATE_FILE)
+    @patch('awwwwards_bot.SENT_ARTICLES_FILE', TEST_SENT_ARTICLES_FILE)
+    @patch('awwwwards_bot.WEBSUB_CALLBACK_URL', "https://bot.example.com/websub")
+    @patch('websub.WebSubSubscriber')
+    @patch('telegram_messege.send_digest_async')
+    @patch('telegram_messege.DeliveryEngine')
+    @patch('awwwwards_bot.fetch_rss_feed', return_value=[])
+    def test_daemon_reads_pushed_content_again_after_a_failed_cycle(self, mock_fetch_rss, mock_engine_class,
+                                                                    mock_send_async, mock_subscriber_class):
+        """
+        Test that pushed content whose cycle failed keeps neither its watermark nor goes
+        missing: the next cycle reads it again and sends its articles.
+        """
+        mock_engine = mock_engine_class.return_value
+        mock_engine.start = AsyncMock()
+        mock_engine.close = AsyncMock()
+        mock_send_async.return_value = True
+        subscriber = mock_subscriber_class.load.return_value
+        subscriber.is_active.return_value = True
+        body = b"""<rss version="2.0"><channel><item><title>Pushed</title><link>https://example.com/pushed</link>
+            <description>Summary</description></item></channel></rss>"""
+        subscriber.drain.side_effect = [[], [(awwwwards_bot.RSS_URL, body, {})], []]
+        subscriber.wait.side_effect = [True, False, KeyboardInterrupt]
+        filter_new_articles = awwwwards_bot.filter_new_articles
+        calls = []
+
+        def fail_on_pushed(articles, *args):
+            calls.append(articles)
+            if len(calls) == 2:  # The startup poll, then the push
+                raise OSError("simulated failure")
+            return filter_new_articles(articles, *args)
+
+        with patch('awwwwards_bot.filter_new_articles', side_effect=fail_on_pushed), self.assertLogs(level='ERROR'):
+            awwwwards_bot.run_daemon()
+
+        self.assertEqual(mock_send_async.call_count, 1)
+        self.assertEqual([article['link'] for article in mock_send_async.call_args.args[0]],
+                         ["https://example.com/pushed"])
+        feed_state = load_feed_state(TEST_FEED_STATE_FILE)[awwwwards_bot.RSS_URL]
+        self.assertEqual(feed_state["watermark"]["id"], "https://example.com/pushed")
+
+    def test_filter_new_articles(self):
+        """
+        Test that sent, queued and repeated links are filtered out.
+        """
+        articles = [
+            {'title': 'Sent', 'link': 'link1', 'summary': ''},
+            {'title': 'Queued', 'link': 'link2', 'summary': ''},
+            {'title': 'New', 'link': 'link3', 'summary': ''},
+            {'title': 'New again', 'link': 'link3', 'summary': ''},
+            {'title': 'No link', 'summary': ''},
+        ]
+        outbox = awwwwards_bot.Outbox(TEST_OUTBOX_FILE)
+        outbox.enqueue([articles[1]])
+        seen_links = set()
+
+        new_articles = awwwwards_bot.filter_new_articles(articles, {"link1"}, outbox, seen_links)
+
+        self.assertEqual(new_articles, [articles[2]])
+        self.assertEqual(seen_links, {"link3"})
+
+    def test_filter_new_articles_matches_link_variants(self):
+        """
+        Test that tracking parameters, trailing slashes and http vs https don't make a
+        sent, queued or already seen article look new.
+        """
+        sent = awwwwards_bot.load_sent_articles(TEST_SENT_ARTICLES_FILE)
+        sent.add("https://example.com/sent")
+        outbox = awwwwards_bot.Outbox(TEST_OUTBOX_FILE)
+        outbox.enqueue([{'title': 'Queued', 'link': 'https://example.com/queued?id=1', 'summary': ''}])
+        articles = [
+            {'title': 'Sent', 'link': 'http://example.com/sent/?utm_source=rss', 'summary': ''},
+            {'title': 'Queued', 'link': 'https://EXAMPLE.com/queued?id=1&utm_medium=feed#top', 'summary': ''},
+            {'title': 'New', 'link': 'https://example.com/new?id=2', 'summary': ''},
+            {'title': 'New again', 'link': 'http://example.com/new/?id=2&fbclid=x', 'summary': ''},
+            {'title': 'Other', 'link': 'https://example.com/new?id=3', 'summary': ''},
+        ]
+
+        new_articles = awwwwards_bot.filter_new_articles(articles, sent, outbox, set())
+
+        self.assertEqual(new_articles, [articles[2], articles[4]])
+
+    def test_import_defers_telegram_dependencies(self):
+        """
+        Test that importing the entry point doesn't load python-telegram-bot, dotenv or
+        asyncio, which are only needed once there is something to send, or feedparser,
+        which is only needed once a feed has changed.
+        """
+        code = ("import sys, awwwwards_bot; "
+                "print(sorted(m for m in ('telegram', 'telegram_messege', 'dotenv', 'httpx', 'asyncio', "
+                "'feedparser') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    @patch('telegram_messege.send_digest')
+    def test_send_digest_delegates_to_telegram_module(self, mock_telegram_send_digest):
+        mock_telegram_send_digest.return_value = True
+        articles = [{'title': 'Article 1', 'link': 'link1', 'summary': 'Summary 1'}]
+
+        self.assertTrue(awwwwards_bot.send_digest(articles, on_result=None))
+        mock_telegram_send_digest.assert_called_once_with(articles, on_result=None)
+
 if __name__ == '__main__':
     unittest.main()
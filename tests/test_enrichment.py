@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from enrichment import EnrichmentCache, enrich_articles, extract_metadata, fetch_metadata
+from feed_transport import FeedHTTPError, FeedTransport
+from state_store import Retention
+
+PAGE = """<!DOCTYPE html>
+<html><head>
+<meta charset="utf-8">
+<title>Article</title>
+<meta property="og:image" content="/images/cover.jpg">
+<meta name="twitter:image" content="https://cdn.example.com/twitter.jpg">
+<script>var ignored = "these words are not counted";</script>
+</head><body>
+<nav>Home About Contact</nav>
+<article><h1>Title</h1><p>{text}</p></article>
+</body></html>
+"""
+
+
+def make_page(words):
+    return PAGE.format(text=" ".join(["word"] * words)).encode("utf-8")
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves an article page per path; /missing is a 404."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = make_page(450)
+        self.send_response(404 if self.path == "/missing" else 200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestExtractMetadata(unittest.TestCase):
+
+    def test_prefers_og_image_and_counts_article_words(self):
+        metadata = extract_metadata(make_page(500), url="https://example.com/blog/post")
+
+        self.assertEqual(metadata, {"image": "https://example.com/images/cover.jpg", "reading_minutes": 3})
+
+    def test_whole_page_without_article_and_charset_from_meta(self):
+        body = ('<html><head><meta charset="iso-8859-1"><meta name="twitter:image" content="https://x/i.png">'
+                '</head><body><p>Caf\xe9 ' + "mot " * 10 + '</p></body></html>').encode("iso-8859-1")
+
+        metadata = extract_metadata(body)
+
+        self.assertEqual(metadata, {"image": "https://x/i.png", "reading_minutes": 1})
+
+    def test_page_without_text_or_image(self):
+        self.assertEqual(extract_metadata(b"<html><body><script>x()</script></body></html>"),
+                         {"image": None, "reading_minutes": None})
+
+
+class TestEnrichmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "enrichment_cache.json")
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = EnrichmentCache(self.path, retention=Retention(max_age_days=1))
+        now = time.time()
+        cache.put("https://example.com/a", {"image": "i", "reading_minutes": 2}, now=now - 2 * 86400)
+        cache.put("https://example.com/b", {"image": "j", "reading_minutes": 3}, now=now)
+
+        self.assertIsNone(cache.get("https://example.com/a", now=now))
+        self.assertEqual(cache.get("https://example.com/b", now=now)["reading_minutes"], 3)
+        self.assertEqual(cache.evict(now=now), 1)
+
+    def test_keeps_the_most_recent_entries_and_round_trips(self):
+        cache = EnrichmentCache(self.path, retention=Retention(max_entries=2))
+        for n in range(4):
+            cache.put(f"https://example.com/{n}", {"image": None, "reading_minutes": n + 1}, now=time.time() + n)
+        cache.save()
+
+        loaded = EnrichmentCache.load(self.path)
+        self.assertEqual(sorted(entry["reading_minutes"] for entry in loaded.entries.values()), [3, 4])
+        self.assertFalse(loaded.dirty)
+
+    def test_links_are_compared_in_canonical_form(self):
+        cache = EnrichmentCache(self.path)
+        cache.put("https://example.com/post?utm_source=rss", {"image": "i", "reading_minutes": 1})
+
+        self.assertIsNotNone(cache.get("https://example.com/post"))
+
+    def test_invalid_file_gives_an_empty_cache(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(EnrichmentCache.load(self.path).entries, {})
+
+
+class TestEnrichArticles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = EnrichmentCache(os.path.join(self.tmpdir.name, "enrichment_cache.json"))
+
+    def test_fetches_each_link_once_with_bounded_concurrency(self):
+        lock = threading.Lock()
+        active = {"now": 0, "max": 0}
+        fetched = []
+
+        def fetch(url):
+            with lock:
+                fetched.append(url)
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.05)
+            with lock:
+                active["now"] -= 1
+            return {"image": url + ".jpg", "reading_minutes": 4}
+
+        articles = [{"title": str(n), "link": f"https://example.com/{n}", "summary": ""} for n in range(8)]
+        articles.append({"title": "Variant", "link": "https://example.com/0?utm_source=rss", "summary": ""})
+
+        stats = enrich_articles(articles, self.cache, fetch=fetch, max_workers=4, per_host=3)
+
+        self.assertEqual(len(fetched), 8)
+        self.assertEqual(active["max"], 3)
+        self.assertEqual(stats, {"cached": 0, "fetched": 8, "failed": 0})
+        self.assertEqual(articles[0]["image"], "https://example.com/0.jpg")
+        self.assertEqual(articles[-1]["reading_minutes"], 4)
+
+        # A later run (or a retry) is served from the cache
+        again = [{"title": "0", "link": "https://example.com/0", "summary": ""}]
+        self.assertEqual(enrich_articles(again, self.cache, fetch=fetch), {"cached": 1, "fetched": 0, "failed": 0})
+        self.assertEqual(len(fetched), 8)
+        self.assertEqual(again[0]["reading_minutes"], 4)
+
+    def test_failures_are_cached_and_leave_the_article_alone(self):
+        def fetch(url):
+            raise OSError("unreachable")
+
+        articles = [{"title": "A", "link": "https://example.com/a", "summary": ""},
+                    {"title": "B", "link": "link-without-scheme", "summary": ""}]
+
+        stats = enrich_articles(articles, self.cache, fetch=fetch)
+
+        self.assertEqual(stats, {"cached": 0, "fetched": 0, "failed": 1})
+        self.assertEqual(articles[0], {"title": "A", "link": "https://example.com/a", "summary": ""})
+        self.assertNotIn("link-without-scheme", json.dumps(self.cache.entries))
+        self.assertEqual(enrich_articles(articles, self.cache, fetch=fetch)["cached"], 1)
+
+    def test_fetch_metadata_from_a_local_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        with FeedTransport() as transport:
+            metadata = fetch_metadata(base + "/post", transport=transport)
+            with self.assertRaises(FeedHTTPError):
+                fetch_metadata(base + "/missing", transport=transport)
+
+        self.assertEqual(metadata, {"image": base + "/images/cover.jpg", "reading_minutes": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import calendar
+import unittest
+
+from feed_scheduler import (
+    DEFAULT_POLL_INTERVAL,
+    MAX_POLL_INTERVAL,
+    MIN_POLL_INTERVAL,
+    FeedScheduler,
+)
+
+class TestFeedScheduler(unittest.TestCase):
+
+    def test_all_feeds_are_due_on_startup(self):
+        scheduler = FeedScheduler(["http://a/feed", "http://b/feed", "http://a/feed"], {}, now=100.0)
+
+        self.assertEqual(sorted(scheduler.due(now=100.0)), ["http://a/feed", "http://b/feed"])
+        self.assertEqual(scheduler.due(now=100.0), [])
+        self.assertIsNone(scheduler.next_poll_at())
+
+    def test_busy_feeds_speed_up_and_quiet_feeds_slow_down(self):
+        feed_state = {}
+        scheduler = FeedScheduler(["http://hot/feed", "http://dead/feed"], feed_state, now=0.0)
+        scheduler.due(now=0.0)
+
+        hot = scheduler.record("http://hot/feed", new_articles=3, now=0.0)
+        dead = scheduler.record("http://dead/feed", new_articles=0, now=0.0)
+
+        self.assertEqual(hot, DEFAULT_POLL_INTERVAL / 2)
+        self.assertEqual(dead, DEFAULT_POLL_INTERVAL * 1.5)
+        self.assertEqual(scheduler.due(now=hot), ["http://hot/feed"])
+        self.assertEqual(feed_state["http://dead/feed"]["poll_interval"], DEFAULT_POLL_INTERVAL * 1.5)
+
+    def test_interval_stays_within_bounds(self):
+        feed_state = {}
+        scheduler = FeedScheduler([], feed_state)
+
+        for _ in range(50):
+            scheduler.record("http://hot/feed", new_articles=1, now=0.0)
+            scheduler.record("http://dead/feed", new_articles=0, now=0.0)
+
+        self.assertEqual(feed_state["http://hot/feed"]["poll_interval"], MIN_POLL_INTERVAL)
+        self.assertEqual(feed_state["http://dead/feed"]["poll_interval"], MAX_POLL_INTERVAL)
+
+    def test_ttl_sets_a_floor_on_the_interval(self):
+        feed_state = {"http://a/feed": {"ttl": 120}}
+        scheduler = FeedScheduler([], feed_state)
+
+        next_poll = scheduler.record("http://a/feed", new_articles=5, now=0.0)
+
+        self.assertEqual(next_poll, 120 * 60)
+
+    def test_skip_hours_move_the_poll_to_the_next_allowed_hour(self):
+        midnight = calendar.timegm((2024, 1, 1, 0, 0, 0))
+        feed_state = {"http://a/feed": {"poll_interval": 3600 / 1.5, "skip_hours": [1, 2]}}
+        scheduler = FeedScheduler([], feed_state)
+
+        next_poll = scheduler.record("http://a/feed", new_articles=0, now=midnight + 10 * 60)
+
+        self.assertEqual(next_poll, midnight + 3 * 3600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from feed_transport import FeedHTTPError, FeedTooLarge, FeedTransport
+from rss_parser import FeedCache, download_feed, fetch_rss_feed
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Feed</title>
+<item><title>Article</title><link>http://example.com/article</link><description>Summary</description></item>
+</channel></rss>
+"""
+
+
+class TransportHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive server: /feed plain, /gzip and /deflate compressed, /big over the limit,
+    /bomb a small gzip body that inflates past it, /slow and /trickle too slow,
+    /redirect to /gzip, /drop closes the connection after answering, /missing a 404,
+    /br a brotli body for FakeBrotli that inflates past the limit.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == "/redirect":
+            return self.respond(301, b"", Location="/gzip")
+        if self.path == "/missing":
+            return self.respond(404, b"Not found")
+        if self.path == "/feed" and self.headers.get("If-None-Match") == '"v1"':
+            return self.respond(304, b"")
+        if self.path == "/slow":
+            time.sleep(0.5)
+        if self.path == "/trickle":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(FEED)))
+            self.end_headers()
+            for byte in FEED:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.05)
+            return
+        if self.path == "/gzip":
+            return self.respond(200, gzip.compress(FEED), **{"Content-Encoding": "gzip"})
+        if self.path == "/deflate":
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)  # Raw deflate, no zlib header
+            return self.respond(200, compressor.compress(FEED) + compressor.flush(), **{"Content-Encoding": "deflate"})
+        if self.path == "/big":
+            return self.respond(200, b" " * 2048)
+        if self.path == "/br":
+            return self.respond(200, b"x" * 100, **{"Content-Encoding": "br"})
+        if self.path == "/bomb":
+            return self.respond(200, gzip.compress(b" " * 1_000_000), **{"Content-Encoding": "gzip"})
+        self.respond(200, FEED, ETag='"v1"')
+        if self.path == "/drop":
+            self.close_connection = True  # Without telling the client, like an idle timeout
+
+    def respond(self, status, body, **headers):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBrotli:
+    """
+    Stands in for the optional brotli module: every compressed byte inflates to 1000, and
+    the output limit of brotli 1.2+ is honoured unless `output_limit` is False.
+    """
+
+    def __init__(self, output_limit=True):
+        self.output_limit = output_limit
+        self.largest_output = 0
+        fake = self
+
+        class Decompressor:
+            def __init__(self):
+                self.pending = 0
+
+            def process(self, data, **kwargs):
+                if not fake.output_limit and kwargs:
+                    raise TypeError("process() takes no keyword arguments")
+                self.pending += 1000 * len(data)
+                size = min(self.pending, kwargs.get("output_buffer_limit", self.pending))
+                self.pending -= size
+                fake.largest_output = max(fake.largest_output, size)
+                return b" " * size
+
+        self.Decompressor = Decompressor
+
+    @staticmethod
+    def compress(data):
+        return b""
+
+
+class TestFeedTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), TransportHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.transport = FeedTransport(read_timeout=0.2, total_timeout=1, max_bytes=1024)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_the_connection_for_a_host(self):
+        for path in ("/feed", "/gzip", "/deflate"):
+            response = self.transport.get(self.base + path)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body, FEED)
+        self.assertEqual(self.transport.connections_opened, 1)
+
+    def test_decompresses_and_counts_wire_bytes(self):
+        response = self.transport.get(self.base + "/gzip")
+
+        self.assertEqual(response.body, FEED)
+        self.assertEqual(response.bytes_received, len(gzip.compress(FEED)))
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertIn("gzip", self.server.requests[0][1]["Accept-Encoding"])
+
+    def test_conditional_get(self):
+        response = self.transport.get(self.base + "/feed", etag='"v1"', modified="Mon, 01 Jan 2024 00:00:00 GMT")
+
+        self.assertEqual((response.status, response.body), (304, b""))
+        self.assertEqual(self.server.requests[0][1]["If-Modified-Since"], "Mon, 01 Jan 2024 00:00:00 GMT")
+
+    def test_follows_redirects(self):
+        response = self.transport.get(self.base + "/redirect")
+
+        self.assertEqual(response.body, FEED)
+        self.assertEqual(response.url, self.base + "/gzip")
+
+    def test_rejects_feeds_over_the_size_limit(self):
+        for path in ("/big", "/bomb"):
+            with self.subTest(path=path), self.assertRaises(FeedTooLarge):
+                self.transport.get(self.base + path)
+        # The aborted connections are not reused
+        self.assertEqual(self.transport.get(self.base + "/feed").body, FEED)
+
+    def test_brotli_output_stays_under_the_size_limit(self):
+        with patch("feed_transport.brotli", FakeBrotli()) as brotli:
+            transport = FeedTransport(max_bytes=1024)
+            with transport, self.assertRaises(FeedTooLarge):
+                transport.get(self.base + "/br")
+
+        self.assertIn("br", self.server.requests[0][1]["Accept-Encoding"])
+        self.assertEqual(brotli.largest_output, 1025)  # Not the 100 000 bytes the chunk inflates to
+
+    def test_brotli_without_an_output_limit_is_not_used(self):
+        with patch("feed_transport.brotli", FakeBrotli(output_limit=False)):
+            transport = FeedTransport(max_bytes=1024)
+            with transport, self.assertRaises(ValueError):
+                transport.get(self.base + "/br")
+
+        self.assertNotIn("br", self.server.requests[0][1]["Accept-Encoding"])
+
+    def test_times_out_on_a_slow_server(self):
+        for path in ("/slow", "/trickle"):
+            started = time.monotonic()
+            with self.subTest(path=path), self.assertRaises(TimeoutError):
+                self.transport.get(self.base + path)
+            self.assertLess(time.monotonic() - started, 2)
+
+    def test_retries_once_when_an_idle_connection_was_closed(self):
+        self.transport.get(self.base + "/drop")
+
+        self.assertEqual(self.transport.get(self.base + "/feed").body, FEED)
+        self.assertEqual(self.transport.connections_opened, 2)
+
+    def test_reads_local_files_under_the_limit(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "feed.xml")
+            with open(path, "wb") as f:
+                f.write(FEED)
+            self.assertEqual(self.transport.get(path).body, FEED)
+            self.assertEqual(self.transport.get("file://" + path).body, FEED)
+            with open(path, "wb") as f:
+                f.write(b" " * 2048)
+            with self.assertRaises(FeedTooLarge):
+                self.transport.get(path)
+
+    def test_download_feed_raises_on_error_status(self):
+        with self.assertRaises(FeedHTTPError) as raised:
+            download_feed(self.base + "/missing", transport=self.transport)
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_fetch_rss_feed_parses_the_downloaded_bytes(self):
+        cache = FeedCache()
+
+        articles = fetch_rss_feed(self.base + "/feed", cache=cache, transport=self.transport)
+        again = fetch_rss_feed(self.base + "/feed", cache=cache, transport=self.transport)
+
+        self.assertEqual([article["link"] for article in articles], ["http://example.com/article"])
+        self.assertEqual(again, [])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+        self.assertEqual(cache.bytes_received, len(FEED))
+        self.assertEqual(fetch_rss_feed(self.base + "/big", transport=self.transport), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from array import array
+
+from link_index import FingerprintIndex, canonical_link, link_fingerprint
+from state_store import Retention
+
+class TestCanonicalLink(unittest.TestCase):
+
+    def test_variants_share_one_canonical_form(self):
+        variants = [
+            "https://example.com/post",
+            "http://example.com/post",
+            "https://example.com/post/",
+            "https://EXAMPLE.com:443/post#comments",
+            "https://example.com/post?utm_source=rss&utm_medium=feed",
+            "  http://example.com:80/post/?fbclid=abc  ",
+        ]
+
+        self.assertEqual({canonical_link(link) for link in variants}, {"https://example.com/post"})
+
+    def test_keeps_meaningful_differences(self):
+        self.assertEqual(canonical_link("https://example.com/post?id=2&utm_campaign=x&page=1"),
+                         "https://example.com/post?id=2&page=1")
+        self.assertEqual(canonical_link("https://example.com:8443/"), "https://example.com:8443/")
+        self.assertNotEqual(link_fingerprint("https://example.com/a"), link_fingerprint("https://example.com/A"))
+
+    def test_leaves_non_http_links_alone(self):
+        for link in ("link1", "mailto:someone@example.com", "https://[bad", "/relative/path/"):
+            with self.subTest(link=link):
+                self.assertEqual(canonical_link(link), link)
+
+    def test_fingerprint_is_signed_64_bit(self):
+        fingerprints = [link_fingerprint(f"https://example.com/{i}") for i in range(1000)]
+
+        self.assertEqual(len(set(fingerprints)), 1000)
+        self.assertTrue(all(-2 ** 63 <= fingerprint < 2 ** 63 for fingerprint in fingerprints))
+
+class TestFingerprintIndex(unittest.TestCase):
+
+    def test_membership_for_stored_and_pending_links(self):
+        index = FingerprintIndex.from_items((f"https://example.com/{i}", float(i)) for i in range(100))
+        index.add("https://example.com/new", now=500.0)
+
+        self.assertIsInstance(index.fingerprints, array)
+        self.assertEqual(len(index), 101)
+        self.assertIn("http://example.com/42/", index)
+        self.assertIn(link_fingerprint("https://example.com/new"), index)
+        self.assertNotIn("https://example.com/100", index)
+
+        index.compact()
+        self.assertEqual(index.pending, {})
+        self.assertEqual(list(index.fingerprints), sorted(index.fingerprints))
+        self.assertIn("https://example.com/new", index)
+
+    def test_add_and_discard(self):
+        index = FingerprintIndex.from_items([("https://example.com/1", 1.0)])
+        index.add("http://example.com/1/", now=2.0)  # Same article
+        index.add("https://example.com/2", now=2.0)
+
+        index.discard("https://example.com/1")
+        index.discard("https://example.com/2")
+
+        self.assertEqual(len(index), 0)
+
+    def test_evict_by_count_keeps_most_recent(self):
+        index = FingerprintIndex.from_items((f"https://example.com/{i}", float(i)) for i in range(10))
+
+        evicted = index.evict(Retention(max_entries=3), now=100.0)
+
+        self.assertEqual(evicted, 7)
+        self.assertEqual(index, {"https://example.com/7", "https://example.com/8", "https://example.com/9"})
+
+    def test_compares_equal_to_a_set_of_links(self):
+        index = FingerprintIndex.from_items([("https://example.com/1", 1.0)])
+
+        self.assertEqual(index, {"http://example.com/1"})
+        self.assertNotEqual(index, {"https://example.com/2"})
+        self.assertNotEqual(index, set())
+
+if __name__ == '__main__':
+    unittest.main()
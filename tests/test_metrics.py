@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from metrics import PipelineMetrics
+
+class TestPipelineMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stage_accumulates_time(self):
+        metrics = PipelineMetrics()
+        with patch('metrics.time.perf_counter', side_effect=[1.0, 1.5, 2.0, 2.25]):
+            with metrics.stage("dedup"):
+                pass
+            with metrics.stage("dedup"):
+                pass
+
+        self.assertEqual(metrics.stages, {"dedup": 0.75})
+
+    def test_timed_excludes_time_spent_by_the_consumer(self):
+        metrics = PipelineMetrics()
+        # Producing each item takes 1s, consuming it 10s; the final next() takes 1s too
+        with patch('metrics.time.perf_counter', side_effect=[0.0, 1.0, 11.0, 12.0, 22.0, 23.0]):
+            items = list(metrics.timed("fetch", ["a", "b"]))
+
+        self.assertEqual(items, ["a", "b"])
+        self.assertEqual(metrics.stages, {"fetch": 3.0})
+
+    def test_add_time_to_a_stage(self):
+        metrics = PipelineMetrics()
+        metrics.add_time("parse", 0.5)
+        metrics.add_time("parse", 0.25)
+
+        self.assertEqual(metrics.stages, {"parse": 0.75})
+
+    def test_counters_and_observations(self):
+        metrics = PipelineMetrics()
+        metrics.add("articles_sent", 2)
+        metrics.add("articles_sent")
+        metrics.observe("telegram_request_seconds", [0.3, 0.1, 0.2])
+
+        data = metrics.to_dict()
+
+        self.assertEqual(data["counters"], {"articles_sent": 3})
+        summary = data["observations"]["telegram_request_seconds"]
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["0.5"], 0.2)
+        self.assertEqual(summary["0.99"], 0.3)
+
+    def test_write_json(self):
+        metrics = PipelineMetrics()
+        metrics.add("new_articles", 4)
+        filepath = os.path.join(self.tmpdir.name, "metrics.json")
+
+        metrics.write(filepath)
+
+        with open(filepath) as f:
+            self.assertEqual(json.load(f)["counters"], {"new_articles": 4})
+        self.assertEqual(os.listdir(self.tmpdir.name), ["metrics.json"])
+
+    def test_write_prometheus_textfile(self):
+        metrics = PipelineMetrics()
+        metrics.stages["fetch"] = 1.25
+        metrics.add("bytes_received", 2048)
+        metrics.observe("telegram_request_seconds", [0.5])
+        filepath = os.path.join(self.tmpdir.name, "awwwwards_bot.prom")
+
+        metrics.write(filepath)
+
+        with open(filepath) as f:
+            lines = f.read().splitlines()
+        self.assertIn('awwwwards_bot_stage_duration_seconds{stage="fetch"} 1.250000', lines)
+        self.assertIn("# TYPE awwwwards_bot_bytes_received gauge", lines)
+        self.assertIn("awwwwards_bot_bytes_received 2048", lines)
+        self.assertIn('awwwwards_bot_telegram_request_seconds{quantile="0.5"} 0.500000', lines)
+        self.assertIn("awwwwards_bot_telegram_request_seconds_count 1", lines)
+        self.assertTrue(any(line.startswith("awwwwards_bot_last_run_timestamp_seconds ") for line in lines))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,83 @@
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
-from rss_parser import fetch_rss_feed
+from xml.etree.ElementTree import ParseError
+from feedparser import FeedParserDict
+from functools import partial
+from feed_backends import BACKENDS
+from feed_transport import FeedResponse
+from rss_parser import FeedCache, fetch_many, fetch_rss_feed, make_parse_pool, parse_feed
+
+SAMPLE_RSS = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>{name}</title>
+    <item>
+      <title>{name} article</title>
+      <link>http://example.com/{name}</link>
+      <description>Summary of {name}</description>
+    </item>
+  </channel>
+</rss>
+"""
+
+def make_entry(n):
+    """Builds a feedparser-style entry; higher numbers are newer."""
+    return FeedParserDict(
+        id=f"guid-{n}",
+        title=f"Test Title {n}",
+        link=f"http://example.com/test{n}",
+        summary=f"Test Summary {n}",
+        published_parsed=time.gmtime(1700000000 + n * 3600),
+    )
+
+def make_feed(entries):
+    feed = MagicMock()
+    feed.get.side_effect = {}.get
+    feed.entries = entries
+    return feed
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves a one-item feed per path; /slow-* paths answer after a delay."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            name = self.path.strip("/")
+            time.sleep(server.slow_delay if name.startswith("slow") else server.delay)
+            etag = f'"{name}-v1"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = SAMPLE_RSS.format(name=name).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
 
 class TestRssParser(unittest.TestCase):
 
-    @patch('rss_parser.feedparser.parse')
+    def setUp(self):
+        # Parsing is mocked per test; the download returns a placeholder document
+        patcher = patch('rss_parser.download_feed', return_value=FeedResponse(200, {}, b"<rss/>", 6, "dummy_url"))
+        self.download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('feedparser.parse')
     def test_fetch_rss_feed_success(self, mock_parse):
         # Configure the mock_parse return_value
         mock_entry1 = MagicMock()
@@ -31,7 +104,7 @@ class TestRssParser(unittest.TestCase):
         self.assertEqual(articles[1]['link'], "http://example.com/test2")
         self.assertEqual(articles[1]['summary'], "Test Summary 2")
 
-    @patch('rss_parser.feedparser.parse')
+    @patch('feedparser.parse')
     def test_fetch_rss_feed_parsing_error(self, mock_parse):
         # Configure mock_parse to raise an exception
         mock_parse.side_effect = Exception("Simulated parsing error")
@@ -48,5 +121,375 @@ class TestRssParser(unittest.TestCase):
         # If we were mocking print:
         # mock_print.assert_called_with("Error fetching RSS feed: Simulated parsing error")
 
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_parsing_error_keeps_validators(self, mock_parse):
+        self.download.return_value = FeedResponse(200, {"etag": '"v2"'}, b"<rss/>", 6, "dummy_url")
+        mock_parse.side_effect = Exception("Simulated parsing error")
+        cache = FeedCache({"dummy_url": {"etag": '"v1"', "modified": None}})
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(articles, [])
+        self.assertEqual(cache.validators("dummy_url"), ('"v1"', None))  # The next fetch downloads it again
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 1})
+        self.assertFalse(cache.dirty)
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_not_modified_skips_parsing(self, mock_parse):
+        self.download.return_value = FeedResponse(304, {}, b"", 0, "dummy_url")
+        cache = FeedCache({"dummy_url": {"etag": '"v1"', "modified": "Mon, 01 Jan 2024 00:00:00 GMT"}})
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(articles, [])
+        self.download.assert_called_once_with("dummy_url", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT", None)
+        mock_parse.assert_not_called()
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 0})
+        self.assertFalse(cache.dirty)
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_stores_new_validators(self, mock_parse):
+        self.download.return_value = FeedResponse(200, {"etag": '"v2"'}, b"<rss/>", 6, "dummy_url")
+        mock_parse.return_value = make_feed([make_entry(1)])
+        cache = FeedCache()
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(len(articles), 1)
+        self.download.assert_called_once_with("dummy_url", None, None, None)
+        mock_parse.assert_called_once_with(b"<rss/>", response_headers={"etag": '"v2"'})
+        self.assertEqual(cache.validators("dummy_url"), ('"v2"', None))
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 1})
+        self.assertTrue(cache.dirty)
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_first_run_takes_latest_entries_and_sets_watermark(self, mock_parse):
+        mock_parse.return_value = make_feed([make_entry(n) for n in range(20, 0, -1)])
+        cache = FeedCache()
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual([a['link'] for a in articles],
+                         [f"http://example.com/test{n}" for n in range(20, 15, -1)])
+        self.assertEqual(cache.watermark("dummy_url"),
+                         {"id": "guid-20", "published": 1700000000 + 20 * 3600})
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_stops_at_watermark_without_cap(self, mock_parse):
+        # A burst of 8 new entries on top of the ones seen last run
+        mock_parse.return_value = make_feed([make_entry(n) for n in range(30, 0, -1)])
+        cache = FeedCache({"dummy_url": {"watermark": {"id": "guid-22", "published": 1700000000 + 22 * 3600}}})
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(len(articles), 8)
+        self.assertEqual(articles[-1]['link'], "http://example.com/test23")
+        self.assertEqual(cache.watermark("dummy_url")["id"], "guid-30")
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_stops_at_older_date_when_guid_is_gone(self, mock_parse):
+        # The watermark entry itself has dropped out of the feed
+        entries = [make_entry(n) for n in range(10, 0, -1) if n != 6]
+        mock_parse.return_value = make_feed(entries)
+        cache = FeedCache({"dummy_url": {"watermark": {"id": "guid-6", "published": 1700000000 + 6 * 3600}}})
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual([a['link'] for a in articles],
+                         [f"http://example.com/test{n}" for n in range(10, 6, -1)])
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_nothing_new_keeps_watermark(self, mock_parse):
+        mock_parse.return_value = make_feed([make_entry(n) for n in range(5, 0, -1)])
+        watermark = {"id": "guid-5", "published": 1700000000 + 5 * 3600}
+        cache = FeedCache({"dummy_url": {"etag": None, "modified": None, "ttl": None, "skip_hours": [],
+                                         "hub": None, "topic": None, "watermark": dict(watermark)}})
+
+        articles = fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(articles, [])
+        self.assertEqual(cache.watermark("dummy_url"), watermark)
+        self.assertFalse(cache.dirty)
+
+    @patch('feedparser.parse')
+    def test_fetch_rss_feed_records_polling_hints(self, mock_parse):
+        feed = make_feed([make_entry(1)])
+        feed.get.side_effect = {"feed": {"ttl": "120", "hour": "3"}}.get
+        mock_parse.return_value = feed
+        cache = FeedCache()
+
+        fetch_rss_feed("dummy_url", cache=cache)
+
+        self.assertEqual(cache.state["dummy_url"]["ttl"], 120)
+        self.assertEqual(cache.state["dummy_url"]["skip_hours"], [3])
+
+    def test_streaming_keeps_the_hints_and_hub_it_did_not_read(self):
+        def serve(count):
+            body = ('<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom"><channel><title>Feed</title>' +
+                    rss_items(count) + '<ttl>120</ttl><skipHours><hour>3</hour></skipHours>'
+                    '<atom:link rel="hub" href="https://hub.example.com/"/></channel></rss>').encode("utf-8")
+            self.download.return_value = FeedResponse(200, {}, body, len(body), "dummy_url")
+        cache = FeedCache()
+        serve(3)
+        fetch_rss_feed("dummy_url", cache=cache, parser="streaming")  # Read to the end
+
+        # Stops at the watermark, before the channel elements that follow the items
+        serve(5)
+        articles = fetch_rss_feed("dummy_url", cache=cache, parser="streaming")
+
+        self.assertEqual(len(articles), 2)
+        self.assertEqual((cache.state["dummy_url"]["ttl"], cache.state["dummy_url"]["skip_hours"]), (120, [3]))
+        self.assertEqual(cache.hub("dummy_url"), ("https://hub.example.com/", None))
+
+class TestFetchMany(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.delay = 0.05
+        self.server.slow_delay = 0.5
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_many_streams_results_as_feeds_finish(self):
+        urls = [f"{self.base_url}/slow-feed"] + [f"{self.base_url}/feed{i}" for i in range(3)]
+
+        results = list(fetch_many(urls, max_workers=4, per_host=4))
+
+        self.assertEqual(len(results), 4)
+        # The slow feed was requested first but must not hold up the others
+        self.assertEqual(results[-1][0], f"{self.base_url}/slow-feed")
+        for url, articles in results:
+            name = url.rsplit("/", 1)[1]
+            self.assertEqual(articles[0]['link'], f"http://example.com/{name}")
+
+    def test_fetch_many_respects_per_host_cap(self):
+        urls = [f"{self.base_url}/feed{i}" for i in range(6)]
+
+        results = list(fetch_many(urls, max_workers=6, per_host=2))
+
+        self.assertEqual({url for url, _ in results}, set(urls))
+        self.assertLessEqual(self.server.max_active, 2)
+
+    def test_fetch_many_runs_feeds_concurrently(self):
+        self.server.delay = 0.3
+        urls = [f"{self.base_url}/feed{i}" for i in range(4)]
+
+        start = time.perf_counter()
+        results = list(fetch_many(urls, max_workers=4, per_host=4))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(results), 4)
+        self.assertLess(elapsed, 4 * 0.3)
+
+    def test_conditional_get_against_local_server(self):
+        url = f"{self.base_url}/feed0"
+        cache = FeedCache()
+
+        first = fetch_rss_feed(url, cache=cache)
+        second = fetch_rss_feed(url, cache=cache)
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertEqual(cache.validators(url)[0], '"feed0-v1"')
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+        self.assertEqual(cache.entries_parsed, 1)
+        self.assertGreater(cache.bytes_received, 0)  # Only the first response had a body
+
+    def test_parse_pool_matches_in_thread_parsing(self):
+        urls = [f"{self.base_url}/feed{i}" for i in range(4)]
+        pool = make_parse_pool(2)
+        self.addCleanup(pool.shutdown)
+        cache = FeedCache()
+
+        pooled = dict(fetch_many(urls, fetch=partial(fetch_rss_feed, cache=cache, parse_pool=pool)))
+        in_thread = dict(fetch_many(urls, fetch=partial(fetch_rss_feed, cache=FeedCache())))
+        again = dict(fetch_many(urls, fetch=partial(fetch_rss_feed, cache=cache, parse_pool=pool)))
+
+        self.assertEqual(pooled, in_thread)
+        self.assertEqual(pooled[urls[0]][0]["link"], "http://example.com/feed0")
+        self.assertEqual(set(map(len, again.values())), {0})  # Validators were stored: all 304
+        self.assertEqual(cache.stats(), {"hits": 4, "misses": 4})
+        self.assertIsNotNone(cache.watermark(urls[0]))
+
+    def test_parse_feed_stops_at_watermark(self):
+        body = SAMPLE_RSS.format(name="feed0").encode("utf-8")
+
+        first = parse_feed(body)
+        second = parse_feed(body, watermark=first["newest"])
+
+        self.assertEqual(first["articles"], [{"title": "feed0 article", "link": "http://example.com/feed0",
+                                              "summary": "Summary of feed0"}])
+        self.assertEqual(second["articles"], [])
+        self.assertEqual(first["hints"], {"ttl": None, "skip_hours": []})
+
+    def test_entries_published_with_the_watermark_entry_are_taken(self):
+        pub_date = "<pubDate>Mon, 01 Jan 2024 00:00:00 +0000</pubDate>"
+        item = "<item><title>{n}</title><link>http://example.com/{n}</link><guid>g{n}</guid>{date}</item>"
+        body = ('<rss version="2.0"><channel><title>Feed</title>' +
+                item.format(n="b", date=pub_date) + item.format(n="a", date=pub_date) +
+                item.format(n="old", date="<pubDate>Sun, 31 Dec 2023 00:00:00 +0000</pubDate>") +
+                "</channel></rss>").encode("utf-8")
+        # The watermark entry dropped out of the feed: only strictly older ones are skipped
+        stale = {"id": "gone", "published": 1704067200}
+
+        for parser in ("feedparser", "streaming"):
+            with self.subTest(parser=parser):
+                result = parse_feed(body, watermark={"id": "ga", "published": 1704067200}, parser=parser)
+                self.assertEqual([a["link"] for a in result["articles"]], ["http://example.com/b"])
+                self.assertEqual(result["newest"], {"id": "gb", "published": 1704067200})
+                result = parse_feed(body, watermark=stale, parser=parser)
+                self.assertEqual([a["link"] for a in result["articles"]],
+                                 ["http://example.com/b", "http://example.com/a"])
+
+    def test_streaming_parser_against_local_server(self):
+        url = f"{self.base_url}/feed0"
+        cache = FeedCache()
+
+        first = fetch_rss_feed(url, cache=cache, parser="streaming")
+        second = fetch_rss_feed(url, cache=cache, parser="streaming")
+
+        self.assertEqual(first, fetch_rss_feed(url))
+        self.assertEqual(second, [])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+        self.assertIsNotNone(cache.watermark(url))
+
+    def test_fetch_many_yields_empty_list_when_fetch_raises(self):
+        def failing_fetch(url):
+            raise RuntimeError("boom")
+
+        results = list(fetch_many(["http://a.example/feed"], fetch=failing_fetch))
+
+        self.assertEqual(results, [("http://a.example/feed", [])])
+
+def rss_items(count, newest=None):
+    newest = count if newest is None else newest
+    return "".join(
+        f"<item><title>Article {n}</title><link>http://example.com/{n}</link><guid>guid-{n}</guid>"
+        f"<pubDate>{time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1700000000 + n * 3600))}</pubDate>"
+        f"<description>Summary {n}</description></item>"
+        for n in range(newest, newest - count, -1))
+
+class TestFeedBackends(unittest.TestCase):
+    RSS = ('<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title><ttl>45</ttl>'
+           '<skipHours><hour>1</hour><hour>2</hour></skipHours>{items}</channel></rss>')
+    ATOM = ('<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom"><title>Feed</title>'
+            '<entry><title>Article 2</title><link rel="replies" href="http://example.com/2#comments"/>'
+            '<link href="http://example.com/2"/><id>urn:2</id><updated>2024-01-02T00:00:00Z</updated>'
+            '<summary>Summary 2</summary></entry>'
+            '<entry><title>Article 1</title><link rel="alternate" href="http://example.com/1"/><id>urn:1</id>'
+            '<published>2024-01-01T00:00:00+01:00</published><content>Content 1</content></entry></feed>')
+
+    def test_streaming_matches_feedparser_on_rss(self):
+        body = self.RSS.format(items=rss_items(8)).encode("utf-8")
+        watermark = {"id": "guid-3", "published": None}
+
+        streaming = parse_feed(body, watermark=watermark, parser="streaming")
+        reference = parse_feed(body, watermark=watermark)
+
+        self.assertEqual(streaming["articles"], reference["articles"])
+        self.assertEqual(streaming["newest"], reference["newest"])
+        self.assertEqual([a["link"] for a in streaming["articles"]],
+                         [f"http://example.com/{n}" for n in (8, 7, 6, 5, 4)])
+        self.assertEqual(streaming["hints"], {"ttl": 45, "skip_hours": [1, 2]})  # feedparser only keeps the last hour
+
+    def test_streaming_matches_feedparser_on_atom(self):
+        body = self.ATOM.encode("utf-8")
+        watermark = {"id": None, "published": 0}
+
+        streaming = parse_feed(body, watermark=watermark, parser="streaming")
+        reference = parse_feed(body, watermark=watermark)
+
+        self.assertEqual(streaming, reference)
+        self.assertEqual(streaming["articles"][1],
+                         {"title": "Article 1", "link": "http://example.com/1", "summary": "Content 1"})
+        self.assertEqual(streaming["newest"], {"id": "urn:2", "published": 1704153600})
+
+    def test_streaming_stops_reading_after_the_entries_it_needs(self):
+        # Cut off where the 7th item starts, which a first run never reaches
+        document = self.RSS.format(items=rss_items(10))
+        body = document[:document.index("<item><title>Article 4")].encode("utf-8")
+
+        result = parse_feed(body, parser="streaming")
+
+        self.assertEqual(len(result["articles"]), 5)
+        with self.assertRaises(ParseError):
+            list(BACKENDS["streaming"].parse(body).entries)
+
+    def test_falls_back_to_feedparser_on_malformed_xml(self):
+        body = self.RSS.format(items=rss_items(2)).replace("Summary 2", "Summary&nbsp;2").encode("utf-8")
+
+        with patch.object(BACKENDS["feedparser"], "parse", wraps=BACKENDS["feedparser"].parse) as fallback:
+            result = parse_feed(body, parser="streaming")
+
+        fallback.assert_called_once()
+        self.assertEqual(result["articles"][0]["summary"], "Summary\xa02")
+        self.assertEqual(len(result["articles"]), 2)
+
+    def test_falls_back_to_feedparser_on_other_formats(self):
+        body = ('<?xml version="1.0"?><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+                'xmlns="http://purl.org/rss/1.0/"><channel><title>Feed</title></channel>'
+                '<item><title>Article 1</title><link>http://example.com/1</link>'
+                '<description>Summary 1</description></item></rdf:RDF>').encode("utf-8")
+
+        result = parse_feed(body, parser="streaming")
+
+        self.assertEqual(result["articles"], [{"title": "Article 1", "link": "http://example.com/1",
+                                               "summary": "Summary 1"}])
+
+    def test_streaming_takes_the_permalink_guid_without_a_link(self):
+        body = self.RSS.format(items='<item><title>Article 1</title><guid>http://example.com/1</guid>'
+                                     '<description>Summary 1</description></item>').encode("utf-8")
+
+        with patch.object(BACKENDS["feedparser"], "parse") as fallback:
+            result = parse_feed(body, parser="streaming")
+
+        fallback.assert_not_called()
+        reference = parse_feed(body)
+        self.assertEqual((result["articles"], result["newest"]), (reference["articles"], reference["newest"]))
+        self.assertEqual(result["articles"], [{"title": "Article 1", "link": "http://example.com/1",
+                                               "summary": "Summary 1"}])
+
+    def test_entries_without_a_link_are_skipped(self):
+        body = self.RSS.format(items='<item><title>Article 2</title><guid isPermaLink="false">g2</guid>'
+                                     '<description>Summary 2</description></item>' + rss_items(1)).encode("utf-8")
+
+        with patch.object(BACKENDS["feedparser"], "parse", wraps=BACKENDS["feedparser"].parse) as fallback:
+            result = parse_feed(body, parser="streaming")
+
+        fallback.assert_called_once()
+        self.assertEqual([a["link"] for a in result["articles"]], ["http://example.com/1"])
+
+    def test_missing_title_or_description_is_empty(self):
+        body = self.RSS.format(items='<item><title>Article 2</title><link>http://example.com/2</link></item>'
+                                     '<item><link>http://example.com/1</link><description>Summary 1</description>'
+                                     '</item>').encode("utf-8")
+
+        for parser in ("feedparser", "streaming"):
+            with self.subTest(parser=parser):
+                self.assertEqual(parse_feed(body, parser=parser)["articles"], [
+                    {"title": "Article 2", "link": "http://example.com/2", "summary": ""},
+                    {"title": "", "link": "http://example.com/1", "summary": "Summary 1"}])
+
+    def test_streaming_serializes_atom_xhtml_like_feedparser(self):
+        body = ('<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom"><title>Feed</title><entry>'
+                '<title type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">Rich <i>title</i></div></title>'
+                '<link href="http://example.com/1"/><id>urn:1</id><content type="xhtml">'
+                '<div xmlns="http://www.w3.org/1999/xhtml"><p>Hello <b>world</b></p> tail &amp; more</div>'
+                '</content></entry></feed>').encode("utf-8")
+
+        streaming = parse_feed(body, parser="streaming")
+
+        self.assertEqual(streaming, parse_feed(body))
+        self.assertEqual(streaming["articles"], [{"title": "Rich <i>title</i>", "link": "http://example.com/1",
+                                                  "summary": "<p>Hello <b>world</b></p> tail &amp; more"}])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from sharding import shard_of, shard_path, shard_urls, stray_shard_paths
+
+URLS = [f"https://feeds{i}.example.com/rss" for i in range(200)]
+
+class TestSharding(unittest.TestCase):
+
+    def test_every_feed_has_exactly_one_worker(self):
+        shards = [shard_urls(URLS, index, 4) for index in range(4)]
+
+        self.assertEqual(sorted(url for shard in shards for url in shard), sorted(URLS))
+        self.assertTrue(all(30 < len(shard) < 70 for shard in shards))  # Roughly even
+        self.assertEqual(shards[0], [url for url in URLS if url in shards[0]])  # Original order
+
+    def test_assignment_is_stable_and_ignores_link_variants(self):
+        url = "https://feeds7.example.com/rss"
+        self.assertEqual(shard_of(url, 5), shard_of("http://FEEDS7.example.com/rss/", 5))
+        self.assertEqual([shard_of(url, 5) for _ in range(3)], [shard_of(url, 5)] * 3)
+
+    def test_adding_a_worker_only_moves_feeds_to_it(self):
+        moved = [url for url in URLS if shard_of(url, 4) != shard_of(url, 5)]
+
+        self.assertTrue(all(shard_of(url, 5) == 4 for url in moved))
+        self.assertLess(len(moved), len(URLS) / 3)
+
+    def test_single_worker_keeps_everything(self):
+        self.assertEqual(shard_urls(URLS, 0, 1), URLS)
+        self.assertEqual(shard_path("outbox.json", 0), "outbox.json")
+        self.assertEqual(shard_path("outbox.json", 2), "outbox.2.json")
+
+    def test_stray_files_of_removed_workers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outbox = os.path.join(tmpdir, "outbox.json")
+            names = ["outbox.json", "outbox.1.json", "outbox.2.json", "outbox.1-of-3.json", "outbox.json.lock",
+                     "outbox.old.json", "feed_state.2.json"]
+            for name in names:
+                open(os.path.join(tmpdir, name), "w").close()
+
+            self.assertEqual(stray_shard_paths(outbox, 2), [os.path.join(tmpdir, "outbox.1-of-3.json"),
+                                                            os.path.join(tmpdir, "outbox.2.json")])
+            self.assertEqual(stray_shard_paths(outbox, 3), [os.path.join(tmpdir, "outbox.1-of-3.json")])
+
+    def test_rejects_invalid_workers(self):
+        with self.assertRaises(ValueError):
+            shard_urls(URLS, 3, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,362 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from link_index import FingerprintIndex, link_fingerprint
+from state_store import (
+    SECONDS_PER_DAY,
+    JsonStateBackend,
+    Outbox,
+    Retention,
+    SqliteSentArticles,
+    SqliteStateBackend,
+    get_backend,
+    write_json_atomic,
+)
+
+class TestJsonStateBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, "sent_articles.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_and_load(self):
+        backend = JsonStateBackend(self.filepath)
+        backend.save({"http://example.com/1", "http://example.com/2"})
+
+        self.assertEqual(backend.load(), {"http://example.com/1", "http://example.com/2"})
+        self.assertEqual(os.listdir(self.tmpdir.name), ["sent_articles.json"])  # No temp files left
+
+    def test_failed_write_keeps_previous_state(self):
+        backend = JsonStateBackend(self.filepath)
+        backend.save({"http://example.com/1"})
+
+        with patch('state_store.json.dump', side_effect=IOError("disk full")):
+            backend.save({"http://example.com/1", "http://example.com/2"})
+
+        self.assertEqual(backend.load(), {"http://example.com/1"})
+        self.assertEqual(os.listdir(self.tmpdir.name), ["sent_articles.json"])
+
+    def test_reads_legacy_list_format(self):
+        with open(self.filepath, 'w') as f:
+            json.dump(["http://example.com/1"], f)
+
+        links = JsonStateBackend(self.filepath).load()
+
+        self.assertIsInstance(links, FingerprintIndex)
+        self.assertEqual(links, {"http://example.com/1"})
+
+    def test_reads_link_dict_format_and_saves_fingerprints(self):
+        with open(self.filepath, 'w') as f:
+            json.dump({"http://example.com/1": 1000.0, "http://example.com/2?utm_source=x": 2000.0}, f)
+
+        backend = JsonStateBackend(self.filepath)
+        backend.save(backend.load(), now=3000.0)
+
+        with open(self.filepath) as f:
+            data = json.load(f)
+        self.assertEqual(data["version"], 2)
+        self.assertNotIn("http://example.com/1", json.dumps(data))
+        links = backend.load()
+        self.assertEqual(links, {"https://example.com/1", "https://example.com/2"})
+        self.assertEqual(dict(links.items())[link_fingerprint("http://example.com/2")], 2000.0)
+
+    def test_save_evicts_links_past_max_age(self):
+        now = 1700000000.0
+        links = FingerprintIndex()
+        links.add("http://example.com/old", now - 100 * SECONDS_PER_DAY)
+        links.add("http://example.com/recent", now - 10 * SECONDS_PER_DAY)
+        links.add("http://example.com/new", now)
+
+        JsonStateBackend(self.filepath, retention=Retention(max_age_days=30)).save(links, now=now)
+
+        reloaded = JsonStateBackend(self.filepath).load()
+        self.assertEqual(reloaded, {"http://example.com/recent", "http://example.com/new"})
+        self.assertEqual(dict(reloaded.items())[link_fingerprint("http://example.com/new")], now)
+
+    def test_save_keeps_most_recent_max_entries(self):
+        links = FingerprintIndex()
+        for i in range(10):
+            links.add(f"http://example.com/{i}", 1000.0 + i)
+
+        JsonStateBackend(self.filepath, retention=Retention(max_entries=3)).save(links, now=2000.0)
+
+        self.assertEqual(JsonStateBackend(self.filepath).load(),
+                         {"http://example.com/7", "http://example.com/8", "http://example.com/9"})
+
+    def test_evict_drops_links_seen_before_the_cutoff(self):
+        links = FingerprintIndex.from_items({"a": 1.0, "b": 2.0, "c": 50.0, "d": 46.0}.items())
+
+        evicted = links.evict(Retention(max_age_days=10 / SECONDS_PER_DAY), now=55.0)
+
+        self.assertEqual(evicted, 2)
+        self.assertEqual(links, {"c", "d"})
+
+    def test_write_json_atomic_replaces_file(self):
+        write_json_atomic(self.filepath, ["a"])
+        write_json_atomic(self.filepath, ["b"])
+
+        with open(self.filepath) as f:
+            self.assertEqual(json.load(f), ["b"])
+
+class TestSqliteStateBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, "sent_articles.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def stored_links(self):
+        conn = sqlite3.connect(self.filepath)
+        try:
+            return {fingerprint for (fingerprint,) in conn.execute("SELECT fingerprint FROM sent_fingerprints")}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def fingerprints(*links):
+        return {link_fingerprint(link) for link in links}
+
+    def test_get_backend_picks_by_extension(self):
+        self.assertIsInstance(get_backend("state.json"), JsonStateBackend)
+        self.assertIsInstance(get_backend("state.db"), SqliteStateBackend)
+        self.assertIsInstance(get_backend("state.SQLITE3"), SqliteStateBackend)
+
+    def test_load_add_and_save(self):
+        backend = SqliteStateBackend(self.filepath)
+        links = backend.load()
+        self.assertIsInstance(links, SqliteSentArticles)
+        self.assertEqual(len(links), 0)
+
+        links.add("http://example.com/1")
+        self.assertIn("http://example.com/1", links)
+        self.assertEqual(self.stored_links(), set())  # Buffered until save
+
+        backend.save(links)
+
+        self.assertEqual(self.stored_links(), self.fingerprints("http://example.com/1"))
+        reloaded = backend.load()
+        self.assertIn("http://example.com/1", reloaded)
+        self.assertNotIn("http://example.com/2", reloaded)
+        self.assertEqual(reloaded, {"http://example.com/1"})
+
+    def test_save_only_inserts_new_links(self):
+        backend = SqliteStateBackend(self.filepath)
+        backend.save({f"http://example.com/{i}" for i in range(100)})
+
+        links = backend.load()
+        links.add("http://example.com/5")  # Already stored
+        links.add("http://example.com/new")
+        self.assertEqual(set(links.pending), self.fingerprints("http://example.com/new"))
+
+        backend.save(links)
+
+        self.assertEqual(len(self.stored_links()), 101)
+        self.assertEqual(links.pending, {})
+
+    def test_save_evicts_by_age_and_count(self):
+        now = 1700000000.0
+        links = SqliteStateBackend(self.filepath).load()
+        links.add("http://example.com/expired", now - 100 * SECONDS_PER_DAY)
+        for i in range(5):
+            links.add(f"http://example.com/{i}", now - i)
+
+        retention = Retention(max_age_days=30, max_entries=3)
+        SqliteStateBackend(self.filepath, retention=retention).save(links, now=now)
+
+        self.assertEqual(self.stored_links(),
+                         self.fingerprints("http://example.com/0", "http://example.com/1", "http://example.com/2"))
+
+    def test_converts_link_tables_of_older_databases(self):
+        for create in ("CREATE TABLE sent_articles (link TEXT PRIMARY KEY) WITHOUT ROWID",
+                       "CREATE TABLE sent_articles (link TEXT PRIMARY KEY, first_seen REAL NOT NULL) WITHOUT ROWID"):
+            with self.subTest(create=create):
+                if os.path.exists(self.filepath):
+                    os.remove(self.filepath)
+                conn = sqlite3.connect(self.filepath)
+                with conn:
+                    conn.execute(create)
+                    if "first_seen" in create:
+                        conn.execute("INSERT INTO sent_articles VALUES ('http://example.com/1', 1.0)")
+                    else:
+                        conn.execute("INSERT INTO sent_articles (link) VALUES ('http://example.com/1')")
+                conn.close()
+
+                backend = SqliteStateBackend(self.filepath, retention=Retention(max_age_days=30))
+                links = backend.load()
+                self.assertIn("https://example.com/1/", links)
+                links.add("http://example.com/2")
+                backend.save(links, now=40 * SECONDS_PER_DAY)
+
+                # A link first seen long ago is evicted, one without a timestamp counts as seen now
+                expected = ("http://example.com/2",) if "first_seen" in create \
+                    else ("http://example.com/1", "http://example.com/2")
+                self.assertEqual(self.stored_links(), self.fingerprints(*expected))
+
+    def test_migrates_legacy_json_once(self):
+        legacy_path = os.path.join(self.tmpdir.name, "sent_articles.json")
+        with open(legacy_path, 'w') as f:
+            json.dump(["http://example.com/old1", "http://example.com/old2"], f)
+
+        links = SqliteStateBackend(self.filepath).load()
+        self.assertEqual(links, {"http://example.com/old1", "http://example.com/old2"})
+
+        # Later changes to the JSON file are not imported again
+        with open(legacy_path, 'w') as f:
+            json.dump(["http://example.com/other"], f)
+        self.assertNotIn("http://example.com/other", SqliteStateBackend(self.filepath).load())
+
+def claim_in_worker(filepath, links):
+    return get_backend(filepath).claim(links)
+
+class TestClaim(unittest.TestCase):
+    """claim() on both backends, as used by several workers sharing one state."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        # One directory per backend, so SQLite doesn't import the JSON file as legacy state
+        directory = os.path.join(self.tmpdir.name, os.path.splitext(name)[1][1:])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def test_each_link_is_claimed_once(self):
+        for name in ("sent_articles.json", "sent_articles.db"):
+            with self.subTest(backend=name):
+                backend = get_backend(self.path(name))
+
+                first = backend.claim(["http://example.com/1", "http://example.com/2"])
+                second = backend.claim(["http://example.com/2", "https://example.com/1/", "http://example.com/3"])
+
+                self.assertEqual(first, ["http://example.com/1", "http://example.com/2"])
+                self.assertEqual(second, ["http://example.com/3"])  # Variants of claimed links count as claimed
+                self.assertEqual(backend.load(), {"http://example.com/1", "http://example.com/2",
+                                                  "http://example.com/3"})
+
+    def test_claim_keeps_links_saved_by_others(self):
+        filepath = os.path.join(self.tmpdir.name, "sent_articles.json")
+        backend = JsonStateBackend(filepath)
+        stale = backend.load()
+        backend.save({"http://example.com/1"})  # Another worker, after this one loaded
+
+        backend.claim(["http://example.com/2"])
+
+        self.assertEqual(backend.load(), {"http://example.com/1", "http://example.com/2"})
+        self.assertEqual(len(stale), 0)
+
+    def test_failed_claim_raises_and_keeps_the_history(self):
+        filepath = os.path.join(self.tmpdir.name, "sent_articles.json")
+        backend = JsonStateBackend(filepath)
+        backend.save({f"http://example.com/{n}" for n in range(100)})
+        with open(filepath, "rb") as f:
+            before = f.read()
+
+        for failure in ("read", "write"):
+            with self.subTest(failure=failure):
+                target = "state_store.json.load" if failure == "read" else "state_store.write_json_atomic"
+                with patch(target, side_effect=OSError(5, "Input/output error")), self.assertRaises(OSError):
+                    backend.claim(["http://example.com/1", "http://example.com/new"])
+
+                with open(filepath, "rb") as f:
+                    self.assertEqual(f.read(), before)
+        self.assertEqual(backend.claim(["http://example.com/1", "http://example.com/new"]), ["http://example.com/new"])
+
+    def test_concurrent_workers_never_claim_the_same_link(self):
+        links = [f"http://example.com/{n}" for n in range(40)]
+        for name in ("sent_articles.json", "sent_articles.db"):
+            with self.subTest(backend=name):
+                filepath = self.path(name)
+                # Four workers start on a missing state and claim overlapping links at the same time
+                batches = [links[i * 10:i * 10 + 20] + links[:5] for i in range(4)]
+                with ProcessPoolExecutor(max_workers=4) as pool:
+                    claimed = list(pool.map(claim_in_worker, [filepath] * 4, batches))
+
+                everything = [link for worker in claimed for link in worker]
+                self.assertEqual(len(everything), len(set(everything)))
+                self.assertEqual(set(everything), set(links))
+                self.assertEqual(get_backend(filepath).load(), set(links))
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, "outbox.json")
+        self.articles = [{"title": f"T{i}", "link": f"http://example.com/{i}", "summary": "S"} for i in range(3)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_enqueue_skips_queued_links_and_persists(self):
+        outbox = Outbox(self.filepath)
+        self.assertEqual(outbox.enqueue(self.articles, now=100.0), 3)
+        self.assertEqual(outbox.enqueue(self.articles[:1], now=100.0), 0)
+        outbox.save()
+
+        reloaded = Outbox.load(self.filepath)
+
+        self.assertEqual(reloaded.due(now=100.0), self.articles)
+        self.assertIn("http://example.com/0", reloaded)
+
+    def test_failed_articles_back_off_exponentially(self):
+        outbox = Outbox(self.filepath, base_delay=10.0)
+        outbox.enqueue(self.articles, now=0.0)
+
+        outbox.mark_sent(self.articles[:1])
+        outbox.mark_failed(self.articles[1:2], now=0.0)
+
+        self.assertEqual(outbox.due(now=5.0), [self.articles[2]])
+        self.assertEqual(outbox.due(now=10.0), self.articles[1:])
+        outbox.mark_failed(self.articles[1:2], now=10.0)
+        self.assertEqual(outbox.entries["http://example.com/1"]["next_attempt_at"], 30.0)
+        self.assertEqual(outbox.entries["http://example.com/1"]["attempts"], 2)
+
+    def test_mark_failed_ignores_sent_articles(self):
+        outbox = Outbox(self.filepath)
+        outbox.enqueue(self.articles[:1], now=0.0)
+        outbox.mark_sent(self.articles[:1])
+
+        outbox.mark_failed(self.articles[:1], now=0.0)
+
+        self.assertEqual(outbox.pop_sent(), ["http://example.com/0"])
+        self.assertEqual(len(outbox), 0)
+
+    def test_records_chats_reached_until_sent(self):
+        outbox = Outbox(self.filepath)
+        outbox.enqueue(self.articles[:2], now=0.0)
+
+        outbox.mark_delivered(self.articles[:1], "@a")
+        outbox.mark_delivered(self.articles[:1], "@a")
+        outbox.mark_failed(self.articles[:1], now=0.0)
+        outbox.save()
+
+        reloaded = Outbox.load(self.filepath)
+        self.assertEqual(reloaded.delivered(), {"http://example.com/0": ["@a"]})
+        reloaded.mark_sent(self.articles[:1])
+        self.assertEqual(reloaded.pop_sent(), ["http://example.com/0"])
+        self.assertEqual(reloaded.delivered(), {})
+
+    def test_gives_up_after_max_attempts(self):
+        outbox = Outbox(self.filepath, max_attempts=2)
+        outbox.enqueue(self.articles[:1], now=0.0)
+
+        outbox.mark_failed(self.articles[:1], now=0.0)
+        outbox.mark_failed(self.articles[:1], now=1000.0)
+
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.abandoned, ["http://example.com/0"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,58 @@
+import asyncio
+import json
+import tempfile
+import time
 import unittest
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, AsyncMock, MagicMock, ANY, call
 import os
-from telegram.error import TelegramError # Import TelegramError
+import httpx
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut # Import TelegramError
 
+import telegram_messege
 # Important: Import the function from the module with the typo in its filename
-from telegram_messege import send_digest 
+from telegram_messege import (
+    ARTICLE_SEPARATOR,
+    PACKED_SUMMARY_LIMIT,
+    TELEGRAM_MESSAGE_LIMIT,
+    DeliveryEngine,
+    DigestTarget,
+    TokenBucket,
+    build_messages,
+    chat_rate_limit,
+    load_targets,
+    message_length,
+    send_digest,
+    send_digest_async,
+    truncate_text,
+)
+
+
+class FakeBot:
+    """Stand-in for telegram.Bot: records sends, answers after `delay`, raises queued errors."""
+
+    def __init__(self, delay=0.0, errors=None):
+        self.delay = delay
+        self.errors = list(errors or [])
+        self.sent = []
+        self.active = 0
+        self.max_active = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append((chat_id, text, time.monotonic()))
+        finally:
+            self.active -= 1
 
 class TestTelegramMessage(unittest.TestCase):
 
@@ -19,16 +67,16 @@ class TestTelegramMessage(unittest.TestCase):
             {"title": "Article 2", "link": "http://example.com/2", "summary": "Summary 2"}
         ]
 
-        result = send_digest(sample_articles, bot_token="fake_token", chat_id="fake_chat_id")
+        result = send_digest(sample_articles, bot_token="fake_token", chat_id="fake_chat_id", mode="single")
 
-        mock_bot_constructor.assert_called_once_with(token="fake_token")
+        mock_bot_constructor.assert_called_once_with(token="fake_token", request=ANY)
         self.assertEqual(mock_bot_instance.send_message.call_count, len(sample_articles))
 
         expected_calls = []
         for article in sample_articles:
-            message_text = f"<b>{article['title']}</b>\n<a href='{article['link']}'>Read more</a>\n{article['summary']}"
+            message_text = f"{article['title']}\n{article['link']}\n\n{article['summary']}"
             expected_calls.append(
-                call(chat_id="fake_chat_id", text=message_text, parse_mode='HTML')
+                call(chat_id="fake_chat_id", text=message_text)
             )
         
         mock_bot_instance.send_message.assert_has_calls(expected_calls, any_order=False)
@@ -51,7 +99,7 @@ class TestTelegramMessage(unittest.TestCase):
 
         result = send_digest(sample_articles, bot_token="fake_token", chat_id="fake_chat_id")
 
-        mock_bot_constructor.assert_called_once_with(token="fake_token")
+        mock_bot_constructor.assert_called_once_with(token="fake_token", request=ANY)
         mock_bot_instance.send_message.assert_called_once() # Check it was called
         self.assertFalse(result)
         # If logging was mocked:
@@ -59,20 +107,302 @@ class TestTelegramMessage(unittest.TestCase):
 
 
     @patch.dict(os.environ, {}, clear=True)
-    @patch('telegram_messege.logging.error') # Mock logger to check output
+    @patch('telegram_messege.TARGETS_FILE', None)
+    @patch('telegram_messege.CHAT_ID', None)
+    @patch('telegram_messege.BOT_TOKEN', None)
+    @patch('telegram_messege.logger.error') # Mock logger to check output
     def test_send_digest_missing_credentials(self, mock_logging_error):
         # No need to mock Bot here as it shouldn't be called if credentials are None
         
         result_token_none = send_digest([], bot_token=None, chat_id="fake_chat_id")
         self.assertFalse(result_token_none)
-        mock_logging_error.assert_any_call("BOT_TOKEN or CHAT_ID is not set. Please check your .env file or environment variables.")
+        mock_logging_error.assert_any_call("Missing Telegram credentials. Set BOT_TOKEN and CHAT_ID in .env file.")
 
         # Reset mock for next call if necessary, or use separate tests
         mock_logging_error.reset_mock() 
         
         result_chat_id_none = send_digest([], bot_token="fake_token", chat_id=None)
         self.assertFalse(result_chat_id_none)
-        mock_logging_error.assert_any_call("BOT_TOKEN or CHAT_ID is not set. Please check your .env file or environment variables.")
+        mock_logging_error.assert_any_call("Missing Telegram credentials. Set BOT_TOKEN and CHAT_ID in .env file.")
+
+
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    @patch('telegram_messege.Bot')
+    def test_send_digest_reuses_one_bot_and_awaits_sends(self, mock_bot_constructor):
+        mock_bot_instance = AsyncMock()
+        mock_bot_constructor.return_value = mock_bot_instance
+        sample_articles = [
+            {"title": f"Article {i}", "link": f"http://example.com/{i}", "summary": f"Summary {i}"}
+            for i in range(3)
+        ]
+
+        result = send_digest(sample_articles, bot_token="fake_token", chat_id="fake_chat_id", mode="single")
+
+        self.assertTrue(result)
+        mock_bot_constructor.assert_called_once()
+        mock_bot_instance.initialize.assert_awaited_once()
+        mock_bot_instance.shutdown.assert_awaited_once()
+        self.assertEqual(mock_bot_instance.send_message.await_count, 3)
+
+
+class TestDigestPacking(unittest.TestCase):
+
+    def make_articles(self, count, summary_words=20):
+        return [
+            {"title": f"Article {i}", "link": f"http://example.com/{i}",
+             "summary": " ".join(["word"] * summary_words)}
+            for i in range(count)
+        ]
+
+    def test_single_mode_keeps_one_message_per_article(self):
+        articles = self.make_articles(3)
+
+        messages = build_messages(articles, mode="single")
+
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[0], (f"Article 0\nhttp://example.com/0\n\n{articles[0]['summary']}", [articles[0]]))
+
+    def test_enriched_article_shows_reading_time_and_image(self):
+        article = dict(self.make_articles(1)[0], reading_minutes=4, image="http://example.com/0.jpg")
+
+        messages = build_messages([article], mode="single")
+
+        self.assertEqual(messages[0][0], "Article 0\nhttp://example.com/0\n4 min read\n"
+                                         f"Image: http://example.com/0.jpg\n\n{article['summary']}")
+
+    def test_packed_mode_combines_articles_under_the_limit(self):
+        articles = self.make_articles(50)
+
+        messages = build_messages(articles, mode="packed")
+
+        self.assertLess(len(messages), len(articles) / 5)
+        self.assertEqual([a for _, group in messages for a in group], articles)  # Order kept, none lost
+        for text, group in messages:
+            self.assertLessEqual(message_length(text), TELEGRAM_MESSAGE_LIMIT)
+            self.assertEqual(text.count(ARTICLE_SEPARATOR), len(group) - 1)
+
+    def test_packed_mode_truncates_long_summaries(self):
+        articles = self.make_articles(2, summary_words=2000)
+
+        messages = build_messages(articles, mode="packed")
+
+        self.assertEqual(len(messages), 1)
+        for part in messages[0][0].split(ARTICLE_SEPARATOR):
+            summary = part.split("\n\n", 1)[1]
+            self.assertLessEqual(len(summary), PACKED_SUMMARY_LIMIT)
+            self.assertTrue(summary.endswith("word…"))
+
+    def test_oversized_article_is_cut_to_the_limit(self):
+        articles = self.make_articles(1, summary_words=5000)
+
+        messages = build_messages(articles, mode="single")
+
+        self.assertLessEqual(message_length(messages[0][0]), TELEGRAM_MESSAGE_LIMIT)
+        self.assertGreater(message_length(messages[0][0]), TELEGRAM_MESSAGE_LIMIT - 10)
+
+    def test_truncate_text_counts_utf16_units(self):
+        text = "😀" * 10  # Each emoji is two UTF-16 code units
+
+        truncated = truncate_text(text, 9)
+
+        self.assertLessEqual(message_length(truncated), 9)
+        self.assertTrue(truncated.endswith("…"))
+
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    @patch('telegram_messege.Bot')
+    def test_send_digest_reports_each_message(self, mock_bot_constructor):
+        mock_bot_instance = AsyncMock()
+        mock_bot_instance.send_message.side_effect = [None, TelegramError("Bad Request"), None]
+        mock_bot_constructor.return_value = mock_bot_instance
+        articles = self.make_articles(3)
+        reported = []
+
+        result = send_digest(articles, bot_token="fake_token", chat_id="fake_chat_id", mode="single",
+                             on_result=lambda group, ok, chat_id: reported.append((group, ok, chat_id)))
+
+        self.assertFalse(result)
+        self.assertEqual(reported, [(articles[:1], True, "fake_chat_id"), (articles[1:2], False, "fake_chat_id"),
+                                    (articles[2:], True, "fake_chat_id")])
+
+    def test_unknown_mode_raises(self):
+        with self.assertRaises(ValueError):
+            build_messages(self.make_articles(1), mode="bogus")
+
+    @patch('telegram_messege.Bot')
+    def test_send_digest_packs_by_default(self, mock_bot_constructor):
+        mock_bot_instance = AsyncMock()
+        mock_bot_constructor.return_value = mock_bot_instance
+
+        with patch('telegram_messege.DIGEST_MODE', "packed"):
+            result = send_digest(self.make_articles(10), bot_token="fake_token", chat_id="fake_chat_id")
+
+        self.assertTrue(result)
+        self.assertEqual(mock_bot_instance.send_message.await_count, 1)
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        self.articles = [
+            {"title": "Python tips", "link": "http://example.com/1", "summary": "About Python"},
+            {"title": "CSS grid", "link": "http://example.com/2", "summary": "Layouts"},
+            {"title": "Python sponsored", "link": "http://example.com/3", "summary": "Ad"},
+        ]
+
+    def test_target_filters(self):
+        target = DigestTarget("@python", include=["PYTHON"], exclude=["sponsored"])
+
+        self.assertEqual([a["link"] for a in self.articles if target.wants(a)], ["http://example.com/1"])
+        self.assertTrue(all(DigestTarget(1).wants(a) for a in self.articles))
+
+    def test_load_targets_from_file_or_chat_ids(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, "targets.json")
+            with open(filepath, 'w') as f:
+                json.dump([{"chat_id": -100, "include": ["python"]}, {"chat_id": "@all", "mode": "single"}], f)
+
+            targets = load_targets(filepath)
+
+        self.assertEqual([(t.chat_id, t.include, t.mode) for t in targets],
+                         [("-100", ["python"], None), ("@all", [], "single")])
+        with patch('telegram_messege.TARGETS_FILE', None), patch('telegram_messege.CHAT_ID', "@a, @b"):
+            self.assertEqual([t.chat_id for t in load_targets()], ["@a", "@b"])
+
+    @patch('telegram_messege.GROUP_CHAT_RATE_LIMIT', 1000.0)
+    def test_fan_out_renders_each_article_once(self):
+        bot = FakeBot(delay=0.05)
+        targets = [DigestTarget("@python", include=["python"]), DigestTarget("@css", include=["css"]),
+                   DigestTarget("@all")] + [DigestTarget(f"@copy{i}") for i in range(5)]
+        reported = []
+
+        async def run():
+            async with DeliveryEngine(bot=bot) as engine:
+                return await send_digest_async(self.articles, engine=engine, targets=targets, mode="single",
+                                               on_result=lambda group, ok, chat: reported.append((chat, group)))
+
+        with patch('telegram_messege.format_article', wraps=telegram_messege.format_article) as format_article:
+            started = time.monotonic()
+            self.assertTrue(asyncio.run(run()))
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(format_article.call_count, len(self.articles))
+        self.assertEqual(len(bot.sent), 2 + 1 + 3 * 6)
+        self.assertEqual([text.split("\n")[0] for chat, text, _ in bot.sent if chat == "@python"],
+                         ["Python tips", "Python sponsored"])
+        self.assertLess(elapsed, 0.05 * 3 * 3)  # Chats are served concurrently
+        self.assertIn(("@css", [self.articles[1]]), reported)
+
+    @patch('telegram_messege.GROUP_CHAT_RATE_LIMIT', 1000.0)
+    def test_already_delivered_chats_are_skipped(self):
+        bot = FakeBot()
+        targets = [DigestTarget("@a"), DigestTarget("@b", include=["css"])]
+        reported = []
+
+        async def run():
+            async with DeliveryEngine(bot=bot) as engine:
+                return await send_digest_async(
+                    self.articles, engine=engine, targets=targets, mode="single",
+                    delivered={"http://example.com/1": ["@a"], "http://example.com/2": ["@a", "@b"]},
+                    on_result=lambda group, ok, chat: reported.append((chat, [a["link"] for a in group])))
+
+        self.assertTrue(asyncio.run(run()))
+
+        self.assertEqual(sorted((chat, text.split("\n")[1]) for chat, text, _ in bot.sent),
+                         [("@a", "http://example.com/3")])
+        # Articles no chat still needs are reported as done
+        self.assertIn((None, ["http://example.com/1", "http://example.com/2"]), reported)
+
+
+class TestDeliveryEngine(unittest.TestCase):
+
+    def test_token_bucket_limits_rate(self):
+        async def acquire_all():
+            bucket = TokenBucket(rate=20.0, capacity=1.0)
+            for _ in range(5):
+                await bucket.acquire()
+
+        start = time.monotonic()
+        asyncio.run(acquire_all())
+
+        # The first token is available immediately, the other four arrive at 20/s
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 20 - 0.01)
+
+    def test_chat_rate_limit_distinguishes_groups(self):
+        self.assertEqual(chat_rate_limit(12345), (1.0, 1.0))
+        self.assertEqual(chat_rate_limit("@channel")[1], 20)
+        self.assertEqual(chat_rate_limit(-100123)[1], 20)
+
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    def test_retry_after_is_honoured(self):
+        bot = FakeBot(errors=[RetryAfter(1)])
+
+        async def run():
+            async with DeliveryEngine(bot=bot) as engine:
+                return await engine.send_messages(42, ["first", "second"]), engine
+
+        start = time.monotonic()
+        results, engine = asyncio.run(run())
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual([text for _, text, _ in bot.sent], ["first", "second"])
+        self.assertGreaterEqual(bot.sent[0][2] - start, 1.0)
+        self.assertEqual(engine.stats()["retries"], 1)
+
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    def test_non_retryable_error_fails_only_that_message(self):
+        bot = FakeBot(errors=[TelegramError("Bad Request: chat not found")])
+
+        async def run():
+            async with DeliveryEngine(bot=bot) as engine:
+                return await engine.send_messages(42, ["first", "second"]), engine
+
+        results, engine = asyncio.run(run())
+
+        self.assertEqual(results, [False, True])
+        self.assertEqual(engine.stats()["failed"], 1)
+        self.assertEqual(engine.stats()["sent"], 1)
+
+    @patch('telegram_messege.NETWORK_RETRY_DELAY', 0.01)
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    def test_only_timeouts_before_sending_are_retried(self):
+        def timed_out(cause):
+            try:
+                raise TimedOut() from cause
+            except TimedOut as e:
+                return e
+
+        bot = FakeBot(errors=[NetworkError("httpx.ConnectError: refused"), timed_out(httpx.ConnectTimeout("connect")),
+                              timed_out(httpx.PoolTimeout("pool")), timed_out(httpx.ReadTimeout("read"))])
+
+        async def run():
+            async with DeliveryEngine(bot=bot) as engine:
+                return await engine.send_messages(42, ["first", "second"]), engine
+
+        results, engine = asyncio.run(run())
+
+        # "first" may have reached Telegram before its last read timed out: it isn't sent again
+        self.assertEqual(results, [False, True])
+        self.assertEqual([text for _, text, _ in bot.sent], ["second"])
+        self.assertEqual(engine.stats()["retries"], 3)
+
+    @patch('telegram_messege.PRIVATE_CHAT_RATE_LIMIT', 1000.0)
+    def test_deliver_sends_chats_concurrently_with_bounded_concurrency(self):
+        bot = FakeBot(delay=0.2)
+        messages = {chat: [f"{chat}-1", f"{chat}-2"] for chat in range(6)}
+
+        async def run():
+            async with DeliveryEngine(bot=bot, max_concurrency=3) as engine:
+                return await engine.deliver(messages)
+
+        start = time.monotonic()
+        results = asyncio.run(run())
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(results, {chat: [True, True] for chat in range(6)})
+        self.assertEqual(bot.max_active, 3)
+        self.assertLess(elapsed, 12 * 0.2)
+        for chat in range(6):  # Order is kept within every chat
+            self.assertEqual([text for c, text, _ in bot.sent if c == chat], [f"{chat}-1", f"{chat}-2"])
 
 
 if __name__ == '__main__':
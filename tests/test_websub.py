@@ -0,0 +1,280 @@
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qsl, urlencode
+
+import awwwwards_bot
+from feed_transport import parse_link_header
+from rss_parser import FeedCache, fetch_rss_feed
+from state_store import Outbox
+from websub import WebSubSubscriber, signature_matches
+
+FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+  <channel>
+    <title>Pushed</title>
+    <atom:link rel="hub" href="{hub}"/>
+    <atom:link rel="self" href="{topic}"/>
+    {items}
+  </channel>
+</rss>
+"""
+ITEM = "<item><title>Article {n}</title><link>http://example.com/{n}</link><description>Summary {n}</description></item>"
+
+
+def make_feed(hub, topic, numbers):
+    return FEED.format(hub=hub, topic=topic, items="".join(ITEM.format(n=n) for n in numbers)).encode("utf-8")
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """
+    Local WebSub hub stand-in that also serves the feed advertising it: GET /feed.xml is
+    the feed, POST /hub takes subscription requests and verifies them by calling the
+    subscriber back, like a real hub (asynchronously, after answering 202).
+    """
+
+    def do_GET(self):
+        hub = self.server.hub
+        hub.feed_downloads += 1
+        body = make_feed(hub.hub_url, hub.topic, [1])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        if hub.link_header:
+            self.send_header("Link", hub.link_header)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        params = dict(parse_qsl(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")))
+        self.server.hub.requests.append(params)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        threading.Thread(target=self.server.hub.verify, args=(params,), daemon=True).start()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeHub:
+    def __init__(self, lease_seconds=7200, deny=False):
+        self.lease_seconds = lease_seconds
+        self.deny = deny
+        self.requests = []
+        self.feed_downloads = 0
+        self.link_header = None  # Link header sent with the feed
+        self.subscribers = {}  # topic -> (callback, secret)
+        self.verified = threading.Event()
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), HubHandler)
+        self.server.daemon_threads = True
+        self.server.hub = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        self.hub_url, self.feed_url, self.topic = base + "/hub", base + "/feed.xml", base + "/topic.xml"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def verify(self, params):
+        if self.deny:
+            query = {"hub.mode": "denied", "hub.topic": params["hub.topic"], "hub.reason": "no"}
+        else:
+            query = {"hub.mode": "subscribe", "hub.topic": params["hub.topic"], "hub.challenge": "c-42",
+                     "hub.lease_seconds": str(self.lease_seconds)}
+        with urllib.request.urlopen(params["hub.callback"] + "?" + urlencode(query), timeout=5) as response:
+            if response.read() == b"c-42":
+                self.subscribers[params["hub.topic"]] = (params["hub.callback"], params["hub.secret"])
+        self.verified.set()
+
+    def publish(self, body, secret=None):
+        """Pushes content to the subscribers of the topic, signed with their secret."""
+        statuses = []
+        for callback, subscriber_secret in self.subscribers.values():
+            signature = hmac.new((secret or subscriber_secret).encode(), body, hashlib.sha256).hexdigest()
+            request = urllib.request.Request(callback, data=body, headers={
+                "Content-Type": "application/rss+xml", "X-Hub-Signature-256": f"sha256={signature}"})
+            with urllib.request.urlopen(request, timeout=5) as response:
+                statuses.append(response.status)
+        return statuses
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def test_link_header(self):
+        links = parse_link_header('<https://hub.example.com/>; rel="hub", <https://example.com/feed>; rel=self')
+
+        self.assertEqual(links, {"hub": "https://hub.example.com/", "self": "https://example.com/feed"})
+
+    def test_polls_record_the_hub_from_headers_or_feed(self):
+        hub = FakeHub()
+        hub.start()
+        self.addCleanup(hub.stop)
+        for parser in ("feedparser", "streaming"):
+            with self.subTest(parser=parser):
+                feed_cache = FeedCache()
+                self.assertIsNone(feed_cache.hub(hub.feed_url))
+
+                hub.link_header = None
+                fetch_rss_feed(hub.feed_url, cache=feed_cache, parser=parser)
+                self.assertEqual(feed_cache.hub(hub.feed_url), (hub.hub_url, hub.topic))
+
+                hub.link_header = '<https://other.example.com/>; rel="hub"'
+                fetch_rss_feed(hub.feed_url, cache=feed_cache, parser=parser)
+                self.assertEqual(feed_cache.hub(hub.feed_url), ("https://other.example.com/", hub.topic))
+
+    def test_feed_without_hub(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "feed.xml")
+            with open(path, "wb") as f:
+                f.write(b"<rss><channel><item><title>A</title><link>http://a</link>"
+                        b"<description>S</description></item></channel></rss>")
+            feed_cache = FeedCache()
+            fetch_rss_feed(path, cache=feed_cache)
+
+        self.assertEqual(feed_cache.hub(path), (None, None))
+
+    def test_signature(self):
+        signature = hmac.new(b"secret", b"body", hashlib.sha1).hexdigest()
+
+        self.assertTrue(signature_matches("secret", b"body", f"sha1={signature}"))
+        self.assertFalse(signature_matches("secret", b"other", f"sha1={signature}"))
+        self.assertFalse(signature_matches("secret", b"body", signature))
+
+
+class TestWebSubSubscriber(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = FakeHub()
+        self.hub.start()
+        self.addCleanup(self.hub.stop)
+        self.subscriber = WebSubSubscriber(host="127.0.0.1", port=0)
+        self.subscriber.start()
+        self.addCleanup(self.subscriber.stop)
+        self.feed_cache = FeedCache()
+
+    def subscribe(self):
+        fetch_rss_feed(self.hub.feed_url, cache=self.feed_cache)  # The poll that finds the hub
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache)
+        self.assertTrue(self.hub.verified.wait(5))
+
+    def test_waits_for_the_first_poll(self):
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache)
+
+        self.assertEqual((self.hub.feed_downloads, self.hub.requests, self.subscriber.state), (0, [], {}))
+
+    def test_subscribes_to_the_advertised_hub(self):
+        self.subscribe()
+
+        request = self.hub.requests[0]
+        self.assertEqual(request["hub.mode"], "subscribe")
+        self.assertEqual(request["hub.topic"], self.hub.topic)
+        self.assertTrue(request["hub.callback"].startswith(self.subscriber.callback_url))
+        self.assertTrue(self.subscriber.is_active(self.hub.feed_url))
+        self.assertGreater(self.subscriber.state[self.hub.feed_url]["lease_expires"], time.time() + 3000)
+        self.assertTrue(self.subscriber.dirty)
+
+        # Nothing is due: no download of the feed or request to the hub
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache)
+        self.assertEqual(len(self.hub.requests), 1)
+        self.assertEqual(self.hub.feed_downloads, 1)
+
+    def test_new_hub_gets_a_new_subscription(self):
+        self.subscribe()
+        self.hub.verified.clear()
+        self.feed_cache.record_hub(self.hub.feed_url, self.hub.hub_url + "?moved", self.hub.topic)
+
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache)
+
+        self.assertEqual(len(self.hub.requests), 2)
+        self.assertTrue(self.hub.verified.wait(5))
+        self.assertEqual(self.subscriber.state[self.hub.feed_url]["hub"], self.hub.hub_url + "?moved")
+        self.assertTrue(self.subscriber.is_active(self.hub.feed_url))
+
+    def test_renews_before_the_lease_ends(self):
+        self.subscribe()
+        self.hub.verified.clear()
+
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache, now=time.time() + 6000)
+
+        self.assertEqual(len(self.hub.requests), 2)
+        self.assertTrue(self.hub.verified.wait(5))
+        self.assertTrue(self.subscriber.is_active(self.hub.feed_url))
+
+    def test_denied_subscription_is_retried_later(self):
+        self.hub.deny = True
+        self.subscribe()
+
+        self.assertEqual(self.subscriber.state[self.hub.feed_url]["status"], "denied")
+        self.assertFalse(self.subscriber.is_active(self.hub.feed_url))
+        self.subscriber.maintain([self.hub.feed_url], self.feed_cache)
+        self.assertEqual(len(self.hub.requests), 1)
+
+    def test_pushed_content_is_queued_within_a_second(self):
+        self.subscribe()
+
+        started = time.monotonic()
+        self.assertEqual(self.hub.publish(make_feed(self.hub.hub_url, self.hub.topic, [2, 1])), [202])
+        self.assertTrue(self.subscriber.wait(5))
+        self.assertLess(time.monotonic() - started, 1)
+
+        [(url, body, headers)] = self.subscriber.drain()
+        self.assertEqual(url, self.hub.feed_url)
+        self.assertIn(b"Article 2", body)
+        self.assertEqual(headers["content-type"], "application/rss+xml")
+        self.assertFalse(self.subscriber.wait(0))
+
+    def test_badly_signed_content_and_unknown_callbacks_are_dropped(self):
+        self.subscribe()
+
+        self.assertEqual(self.hub.publish(b"<rss/>", secret="wrong"), [202])  # Acknowledged, then dropped
+        self.assertEqual(self.subscriber.drain(), [])
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(urllib.request.Request(self.subscriber.callback_url + "/unknown", data=b"x"))
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_state_round_trips(self):
+        self.subscribe()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "websub.json")
+            self.subscriber.save(path)
+
+            loaded = WebSubSubscriber.load(path, host="127.0.0.1", port=0)
+
+        self.assertTrue(loaded.is_active(self.hub.feed_url))
+        self.assertFalse(self.subscriber.dirty)
+
+    def test_pushed_articles_go_through_dedup_and_send(self):
+        self.subscribe()
+        self.hub.publish(make_feed(self.hub.hub_url, self.hub.topic, [3, 2, 1]))
+        self.assertTrue(self.subscriber.wait(5))
+        send = MagicMock(return_value=True)
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                patch('awwwwards_bot.FEED_STATE_FILE', os.path.join(tmpdir, "feed_state.json")), \
+                patch('awwwwards_bot.SENT_ARTICLES_FILE', os.path.join(tmpdir, "sent_articles.json")):
+            feed_cache = FeedCache({self.hub.feed_url: {"watermark": {"id": "http://example.com/1",
+                                                                      "published": None}}})
+            state = awwwwards_bot.BotState({"http://example.com/3"}, feed_cache,
+                                           Outbox(os.path.join(tmpdir, "outbox.json")))
+            awwwwards_bot.run_cycle(state, [], send=send, pushed=self.subscriber.drain())
+
+        # Article 3 was already sent and article 1 is at the watermark
+        self.assertEqual([article['link'] for article in send.call_args.args[0]], ["http://example.com/2"])
+        self.assertEqual(feed_cache.watermark(self.hub.feed_url)["id"], "http://example.com/3")
+        self.assertIn("http://example.com/2", state.sent_article_links)
+
+
+if __name__ == '__main__':
+    unittest.main()
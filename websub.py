@@ -0,0 +1,299 @@
+import hmac
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from feed_transport import MAX_FEED_BYTES
+from state_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 10 * 24 * 60 * 60      # Lease asked from the hub; it may grant another one
+RENEW_BEFORE = 24 * 60 * 60            # Renew a lease this long before it ends (or halfway, if shorter)
+VERIFY_TIMEOUT = 60 * 60               # Subscribe again if the hub hasn't verified within this time
+RETRY_INTERVAL = 60 * 60               # Wait before retrying a failed or denied subscription
+PUSH_FALLBACK_POLL_INTERVAL = 6 * 60 * 60  # Polling interval of feeds with an active subscription
+REQUEST_TIMEOUT = 30                   # Seconds for a subscription request to the hub
+
+
+def signature_matches(secret: str, body: bytes, header: str) -> bool:
+    """
+    Checks an X-Hub-Signature header ("sha1=...", "sha256=...", ...) against the body.
+    """
+    method, _, signature = (header or "").partition("=")
+    if method not in ("sha1", "sha256", "sha384", "sha512"):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, method).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        subscriber = self.server.subscriber
+        token = urlsplit(self.path).path.strip("/").rpartition("/")[2]
+        params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        challenge = subscriber.verify(token, params)
+        if challenge is None:
+            self.respond(404)
+        else:
+            self.respond(200, challenge.encode("utf-8"))
+
+    def do_POST(self):
+        subscriber = self.server.subscriber
+        token = urlsplit(self.path).path.strip("/").rpartition("/")[2]
+        length = self.headers.get("Content-Length", "")
+        if not length.isdigit():
+            return self.respond(411)
+        if int(length) > MAX_FEED_BYTES:
+            return self.respond(413)
+        body = self.rfile.read(int(length))
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        # Hubs expect a 2xx even for content that is dropped, or they keep retrying it
+        self.respond(202 if subscriber.receive(token, body, headers) is not None else 404)
+
+    def respond(self, status: int, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebSubSubscriber:
+    """
+    Subscribes to the WebSub (PubSubHubbub) hubs that feeds advertise and receives what
+    they push, on a small HTTP callback endpoint.
+
+    Each feed gets an entry in `state` (a plain dict keyed by feed URL, saved as JSON):
+    its hub and topic, the callback token and HMAC secret of its subscription, the
+    subscription status ("none" without a hub, "pending", "active", "denied" or
+    "failed") and the lease end. `maintain` subscribes or renews as needed, to the hubs
+    the feed polls found. Pushed content with a valid signature is queued; `wait` blocks until some
+    arrives and `drain` returns it as (feed URL, body, headers) tuples.
+
+    The callback URL must be reachable by the hubs; every subscription gets its own
+    path below it, `<callback_url>/<token>`.
+    """
+
+    def __init__(self, callback_url: str = None, state: dict = None, host: str = "0.0.0.0", port: int = 8080):
+        self.callback_url = callback_url
+        self.state = state if state is not None else {}
+        self.host = host
+        self.port = port
+        self.dirty = False  # True once the state differs from what was loaded
+        self.server = None
+        self._pushed = queue.Queue()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath: str, **kwargs) -> "WebSubSubscriber":
+        try:
+            with open(filepath, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load the WebSub state from '{filepath}', starting empty: {e}")
+            state = {}
+        return cls(state=state if isinstance(state, dict) else {}, **kwargs)
+
+    def save(self, filepath: str):
+        with self._lock:
+            if not self.dirty:
+                return
+            try:
+                write_json_atomic(filepath, self.state)
+                self.dirty = False
+            except Exception as e:
+                logger.error(f"Could not write the WebSub state to '{filepath}': {e}")
+
+    def start(self) -> str:
+        """
+        Starts the callback endpoint in a background thread.
+
+        Returns:
+            The callback URL, by default the local address of the endpoint.
+        """
+        self.server = ThreadingHTTPServer((self.host, self.port), _CallbackHandler)
+        self.server.daemon_threads = True
+        self.server.subscriber = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if not self.callback_url:
+            self.callback_url = f"http://{self.server.server_address[0]}:{self.server.server_port}"
+        logger.info(f"Listening for WebSub pushes on port {self.server.server_port}, as {self.callback_url}.")
+        return self.callback_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def is_active(self, url: str, now: float = None) -> bool:
+        """
+        Returns True if a hub is currently pushing the feed's updates.
+        """
+        entry = self.state.get(url) or {}
+        now = time.time() if now is None else now
+        return entry.get("status") == "active" and entry.get("lease_expires", 0) > now
+
+    def maintain(self, urls, feed_cache, now: float = None):
+        """
+        Subscribes to the hubs of the feeds whose subscription is missing, failed,
+        unverified for too long or near the end of its lease.
+
+        Hubs are found by the polls, which record the one each downloaded feed advertises
+        in `feed_cache` (see rss_parser.FeedCache.hub), so the feeds aren't downloaded
+        again here; a feed waits for its first download. Needs no network access unless
+        a request to a hub is due.
+        """
+        now = time.time() if now is None else now
+        for url in urls:
+            advertised = feed_cache.hub(url)
+            if advertised is None:
+                continue
+            entry = self._update_hub(url, *advertised)
+            if entry["hub"] is not None and self._needs_subscription(entry, now):
+                self._subscribe(url, entry, now)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until pushed content is queued or `timeout` seconds have passed.
+
+        Returns:
+            True if pushed content is waiting to be drained.
+        """
+        try:
+            item = self._pushed.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return False
+        self._pushed.put(item)  # Leave it for drain
+        return True
+
+    def drain(self) -> list:
+        """
+        Removes and returns the pushed content received so far, as (feed URL, body, headers).
+        """
+        items = []
+        while True:
+            try:
+                items.append(self._pushed.get_nowait())
+            except queue.Empty:
+                return items
+
+    def verify(self, token: str, params: dict, now: float = None):
+        """
+        Handles a hub's verification of intent.
+
+        Returns:
+            The challenge to echo if the request matches a subscription this subscriber
+            asked for, otherwise None.
+        """
+        now = time.time() if now is None else now
+        mode, topic = params.get("hub.mode"), params.get("hub.topic")
+        with self._lock:
+            url, entry = self._entry_for(token)
+            if entry is None or topic != entry["topic"]:
+                return None
+            if mode == "denied":
+                logger.warning(f"WebSub hub denied the subscription to {topic}: {params.get('hub.reason', '')}")
+                entry["status"] = "denied"
+                self.dirty = True
+                return ""
+            if mode != "subscribe" or entry["status"] not in ("pending", "active") or "hub.challenge" not in params:
+                return None
+            lease = params.get("hub.lease_seconds", "")
+            entry["lease_seconds"] = int(lease) if lease.isdigit() else LEASE_SECONDS
+            entry["lease_expires"] = now + entry["lease_seconds"]
+            entry["status"] = "active"
+            self.dirty = True
+        logger.info(f"WebSub subscription to {topic} verified for {entry['lease_seconds']}s.")
+        return params["hub.challenge"]
+
+    def receive(self, token: str, body: bytes, headers: dict):
+        """
+        Handles pushed content: queues it if it is for a known subscription and correctly
+        signed with its secret, and drops it otherwise.
+
+        Returns:
+            The feed URL the content belongs to (even when dropped), or None for an unknown token.
+        """
+        with self._lock:
+            url, entry = self._entry_for(token)
+        if entry is None:
+            return None
+        if not signature_matches(entry["secret"], body, headers.get("x-hub-signature-256")
+                                 or headers.get("x-hub-signature", "")):
+            logger.warning(f"Dropped WebSub content for {url} with a missing or invalid signature.")
+            return url
+        self._pushed.put((url, body, headers))
+        return url
+
+    def _entry_for(self, token):
+        for url, entry in self.state.items():
+            if entry.get("token") == token:
+                return url, entry
+        return None, None
+
+    def _update_hub(self, url, hub, topic):
+        """
+        Returns the feed's entry, created or updated for the hub it advertises. A new
+        hub or topic starts over with a new subscription.
+        """
+        topic = topic or url
+        with self._lock:
+            entry = self.state.get(url)
+            if entry is not None and entry["hub"] == hub and entry["topic"] == topic:
+                return entry
+            if entry is None:
+                entry = {"token": secrets.token_hex(16), "secret": secrets.token_hex(32),
+                         "lease_seconds": 0, "lease_expires": 0, "requested": 0}
+                self.state[url] = entry
+            entry.update(hub=hub, topic=topic, status="none")
+            self.dirty = True
+        if hub is not None:
+            logger.info(f"Feed {url} advertises the WebSub hub {hub}.")
+        return entry
+
+    @staticmethod
+    def _needs_subscription(entry, now):
+        status, since_request = entry["status"], now - entry["requested"]
+        if status == "active":
+            # A renewal keeps the status until the hub verifies it again
+            remaining = entry["lease_expires"] - now
+            return remaining < min(RENEW_BEFORE, entry["lease_seconds"] / 2) and since_request >= VERIFY_TIMEOUT
+        if status == "pending":
+            return since_request >= VERIFY_TIMEOUT
+        if status in ("denied", "failed"):
+            return since_request >= RETRY_INTERVAL
+        return True
+
+    def _subscribe(self, url, entry, now):
+        callback = f"{self.callback_url.rstrip('/')}/{entry['token']}"
+        data = urlencode({"hub.mode": "subscribe", "hub.topic": entry["topic"], "hub.callback": callback,
+                          "hub.secret": entry["secret"], "hub.lease_seconds": LEASE_SECONDS}).encode("ascii")
+        with self._lock:
+            # Set before the request: a hub may verify before it even answers it
+            if entry["status"] != "active":
+                entry["status"] = "pending"
+            entry["requested"] = now
+            self.dirty = True
+        try:
+            request = urllib.request.Request(entry["hub"], data=data, method="POST")
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+            logger.info(f"Asked {entry['hub']} for a WebSub subscription to {entry['topic']}.")
+        except Exception as e:
+            logger.warning(f"WebSub subscription to {entry['topic']} at {entry['hub']} failed: {e}")
+            with self._lock:
+                if entry["status"] == "pending":
+                    entry["status"] = "failed"
+